@@ -3,10 +3,14 @@ from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import condition
 from queue_system.models import Queue
 from services.models import Service
 from datetime import datetime, timedelta
 from .forms import CustomUserCreationForm
+from services.utils import queue_eta
+from queue_system.etags import user_dashboard_etag
+from queue_system.history import user_token_counts, user_tokens
 
 def register(request):
     if request.method == 'POST':
@@ -45,31 +49,33 @@ def user_login(request):
     return render(request, 'accounts/login.html')
 
 @login_required
+@condition(etag_func=user_dashboard_etag)
 def user_dashboard(request):
-    user_queues = Queue.objects.filter(user=request.user).order_by('-joined_at')
-    active_queue = user_queues.filter(status__in=['waiting', 'serving']).first()
+    # Past tokens may have been archived; read both tables.
+    user_queues = user_tokens(request.user)
+    active_queue = Queue.objects.filter(
+        user=request.user, status__in=['waiting', 'serving']
+    ).order_by('-joined_at').first()
 
     # Calculate estimated time remaining
     estimated_time = None
     position = None
+    serving_ahead = 0
 
     if active_queue:
-        # Count people ahead in queue
-        ahead_count = Queue.objects.filter(
-            service=active_queue.service,
-            status='waiting',
-            token_number__lt=active_queue.token_number
-        ).count()
-
-        position = ahead_count + 1
-
-        # Estimate 5 minutes per person
-        estimated_time = ahead_count * 5
+        # Position and learned wait estimate, shared with the ETA API. The
+        # position counts waiting tokens only; a token being served ahead is
+        # shown separately (the estimate includes it).
+        info = queue_eta(active_queue)
+        position = info['waiting_ahead'] + 1
+        serving_ahead = info['serving_ahead']
+        estimated_time = info['eta_minutes']
 
     context = {
         'user_queues': user_queues,
         'active_queue': active_queue,
         'position': position,
+        'serving_ahead': serving_ahead,
         'estimated_time': estimated_time,
     }
 
@@ -86,16 +92,15 @@ def profile(request):
     @login_required
     def _profile(req):
         user = req.user
-        total_queues = user.queue_set.count()
-        completed_count = user.queue_set.filter(status='completed').count()
-        active_count = user.queue_set.filter(status__in=['waiting', 'serving']).count()
-        recent_queues = user.queue_set.select_related('service').order_by('-joined_at')[:10]
+        # Counts and recent tokens span live and archived tokens.
+        counts = user_token_counts(user)
+        recent_queues = user_tokens(user, limit=10)
 
         context = {
             'user': user,
-            'total_queues': total_queues,
-            'completed_count': completed_count,
-            'active_count': active_count,
+            'total_queues': counts['total'],
+            'completed_count': counts['completed'],
+            'active_count': counts['active'],
             'recent_queues': recent_queues,
         }
         return render(req, 'accounts/profile.html', context)
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-17 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_panel', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='auditlog',
+            name='action',
+            field=models.CharField(choices=[('serve_next', 'Serve Next'), ('complete', 'Complete'), ('skip', 'Skip'), ('cancel', 'Cancel'), ('pause', 'Pause'), ('resume', 'Resume'), ('reorder', 'Reorder'), ('priority', 'Priority'), ('send_sms', 'Send SMS'), ('broadcast_sms', 'Broadcast SMS')], max_length=50),
+        ),
+    ]
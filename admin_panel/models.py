@@ -16,6 +16,8 @@ class AuditLog(models.Model):
         ('resume', 'Resume'),
         ('reorder', 'Reorder'),
         ('priority', 'Priority'),
+        ('send_sms', 'Send SMS'),
+        ('broadcast_sms', 'Broadcast SMS'),
     ]
 
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -2,11 +2,16 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+import asyncio
+import json
 from queue_system.models import Queue
 from services.models import Service
 from services.utils import (
     complete_current_and_serve_next,
+    complete_token,
     serve_next_without_completing,
     skip_token,
     cancel_token,
@@ -15,12 +20,18 @@ from services.utils import (
     reorder_queue,
 )
 from accounts.models import User
+from queue_system import live
+from queue_system.etags import admin_dashboard_etag
+from services.stats import load_counts, queue_counts, service_counts
+from services.sketches import window_percentiles
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta
 from django.utils import timezone
 from django.shortcuts import HttpResponse
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import condition, require_POST
 from .models import AuditLog
 from django.views.decorators.csrf import csrf_protect
-from notifications.sms_service import send_token_sms
+from notifications.sms_service import broadcast_sms, send_token_sms
 from notifications.models import AdminSMSLog
 
 def admin_login(request):
@@ -49,38 +60,136 @@ def admin_login(request):
     return render(request, 'admin_panel/login.html')
 
 @staff_member_required
+@condition(etag_func=admin_dashboard_etag)
 def admin_dashboard(request):
-    services = Service.objects.all()
+    services = list(Service.objects.all())
     total_users = User.objects.count()
-    total_queues = Queue.objects.count()
-    active_queues = Queue.objects.filter(status__in=['waiting', 'serving']).count()
-    completed_queues = Queue.objects.filter(status='completed').count()
+    # Every service's counts come from one cached grouped query.
+    counts = queue_counts()
 
     # Get recent queues
     recent_queues = Queue.objects.select_related('user', 'service').order_by('-joined_at')[:10]
 
     # Annotate services with queue counts
     for service in services:
-        service.in_queue_count = service.queue_set.filter(status__in=['waiting', 'serving']).count()
-        service.completed_count = service.queue_set.filter(status='completed').count()
-        service.serving_count = service.queue_set.filter(status='serving').count()
+        service_stats = service_counts(counts, service.pk)
+        service.in_queue_count = service_stats['in_queue']
+        service.completed_count = service_stats['completed']
+        service.serving_count = service_stats['serving']
 
     context = {
         'services': services,
         'total_users': total_users,
-        'total_queues': total_queues,
-        'active_queues': active_queues,
-        'completed_queues': completed_queues,
+        'total_queues': counts['totals']['total'],
+        'active_queues': counts['totals']['in_queue'],
+        'completed_queues': counts['totals']['completed_today'],
         'recent_queues': recent_queues,
     }
 
     return render(request, 'admin_panel/dashboard.html', context)
 
+@staff_member_required
+async def dashboard_stream(request):
+    """Server-Sent Events stream of service counts for the admin dashboard.
+
+    Sends a ``counts`` event with the counts of the services whose queue
+    changed ({service_id: {in_queue, completed, serving}}) and the overall
+    totals. Only available under ASGI; the
+    dashboard falls back to periodic reloads on error.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'stream_unavailable'}, status=503)
+    service_ids = [pk async for pk in Service.objects.values_list('pk', flat=True)]
+    response = StreamingHttpResponse(_dashboard_events(service_ids), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _dashboard_counts(changed):
+    # Read from the rollup directly: the cached copy may predate the change here.
+    counts = load_counts()
+    return {
+        'services': {
+            pk: {key: service_counts(counts, pk)[key] for key in ('in_queue', 'completed', 'serving')}
+            for pk in changed
+        },
+        'totals': counts['totals'],
+    }
+
+
+async def _dashboard_events(service_ids):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + live.max_stream_seconds()
+    watcher = live.get_watcher()
+    sub = watcher.subscribe(await live.service_versions(service_ids))
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            changed = await sub.wait(min(live.heartbeat_seconds(), remaining))
+            if changed:
+                counts = await sync_to_async(_dashboard_counts)(changed)
+                yield live.sse_event(json.dumps(counts), 'counts')
+            else:
+                yield ': keep-alive\n\n'
+    finally:
+        watcher.unsubscribe(sub)
+
+
 @staff_member_required
 def service_queues(request, service_id):
     service = get_object_or_404(Service, id=service_id)
     queues = Queue.objects.filter(service=service, status__in=['waiting', 'serving']).order_by('token_number')
-    return render(request, 'admin_panel/service_queues.html', {'service': service, 'queues': queues})
+    serving_at = {q.counter_number: q for q in queues if q.status == 'serving'}
+    counters = [(n, serving_at.get(n)) for n in range(1, max(service.num_counters, 1) + 1)]
+    now = timezone.now()
+    windows = [
+        ('Last hour', now - timedelta(hours=1)),
+        ('Today', timezone.localtime(now).replace(hour=0, minute=0, second=0, microsecond=0)),
+        ('Last 7 days', now - timedelta(days=7)),
+    ]
+    timings = [(label, _in_minutes(window_percentiles(start, now, [service.pk]))) for label, start in windows]
+    return render(request, 'admin_panel/service_queues.html', {
+        'service': service,
+        'queues': queues,
+        'counters': counters,
+        'timings': timings,
+    })
+
+
+def _in_minutes(percentiles):
+    return {
+        kind: {key: value / 60 if key != 'count' and value is not None else value for key, value in stats.items()}
+        for kind, stats in percentiles.items()
+    }
+
+
+@staff_member_required
+def timing_percentiles(request):
+    """p50/p90/p99 wait and service times (seconds) for any window.
+
+    Query string: ``start`` and ``end`` (ISO 8601, default the last 24
+    hours) and any number of ``service`` ids (default all services).
+    Windows have hourly resolution.
+    """
+    end = parse_datetime(request.GET.get('end', '')) or timezone.now()
+    start = parse_datetime(request.GET.get('start', '')) or end - timedelta(days=1)
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    if timezone.is_naive(end):
+        end = timezone.make_aware(end)
+    try:
+        service_ids = [int(s) for s in request.GET.getlist('service')] or None
+    except ValueError:
+        return JsonResponse({'error': 'invalid_service'}, status=400)
+    return JsonResponse({
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'services': service_ids,
+        **window_percentiles(start, end, service_ids),
+    })
 
 
 @staff_member_required
@@ -112,6 +221,21 @@ def call_next(request, service_id):
     return HttpResponse(status=405)
 
 
+@staff_member_required
+def call_next_counter(request, service_id, counter_number):
+    if request.method == 'POST':
+        service = get_object_or_404(Service, id=service_id)
+        try:
+            complete_current_and_serve_next(service, counter_number)
+        except ValueError as e:
+            messages.error(request, str(e))
+            return redirect('service_queues', service_id=service_id)
+        AuditLog.objects.create(user=request.user, service=service, action='serve_next',
+                                reason=f'Counter {counter_number}')
+        return redirect('service_queues', service_id=service_id)
+    return HttpResponse(status=405)
+
+
 @staff_member_required
 def pause_service_view(request, service_id):
     if request.method == 'POST':
@@ -129,26 +253,37 @@ def resume_service_view(request, service_id):
         return redirect('service_queues', service_id=svc.id)
     return HttpResponse(status=405)
 
-@staff_member_required
 @staff_member_required
 def complete_queue(request, queue_id):
     if request.method == 'POST':
         queue = get_object_or_404(Queue, id=queue_id)
-        # Use the utility to complete current and serve next only if this was serving
-        if queue.status == 'serving':
-            complete_current_and_serve_next(queue.service)
-            AuditLog.objects.create(user=request.user, service=queue.service, action='complete', target_queue=queue)
-        else:
-            queue.status = 'completed'
-            queue.service_end_time = timezone.now()
-            queue.completed_at = timezone.now()
-            queue.save()
-            AuditLog.objects.create(user=request.user, service=queue.service, action='complete', target_queue=queue)
+        # Completing a serving token also serves the next one
+        complete_token(queue)
+        AuditLog.objects.create(user=request.user, service=queue.service, action='complete', target_queue=queue)
 
         return redirect('service_queues', service_id=queue.service.id)
     return HttpResponse(status=405)
 
 
+@staff_member_required
+@require_POST
+def broadcast_sms_view(request, service_id):
+    """Admin action: queue one message to every waiting token of a service (e.g. a delay notice)."""
+    service = get_object_or_404(Service, id=service_id)
+    message = request.POST.get('message', '').strip()
+    try:
+        queued, skipped = broadcast_sms(service, message, sent_by_admin_user=request.user)
+    except ValueError as e:
+        messages.error(request, f'Failed to send SMS: {e}')
+        return redirect('service_queues', service_id=service.id)
+    AuditLog.objects.create(
+        user=request.user, service=service, action='broadcast_sms', reason=f'{queued} recipients: {message}'
+    )
+    note = f' ({skipped} without a valid phone number skipped)' if skipped else ''
+    messages.success(request, f'SMS queued for {queued} waiting tokens{note}.')
+    return redirect('service_queues', service_id=service.id)
+
+
 @staff_member_required
 def send_token_sms_view(request, queue_id):
     """Admin view: show form and send a manual SMS for a specific token.
@@ -0,0 +1,147 @@
+"""A local stand-in for the Twilio Messages API, for load tests and benchmarks.
+
+Answers ``POST /2010-04-01/Accounts/<sid>/Messages.json`` the way Twilio
+does (201 with a message resource, or a JSON error with Twilio's codes)
+after a configurable latency, failing a configurable share of requests
+with 500 and answering 429 above a configurable request rate. Point the
+adapter at it with ``SMS_API_BASE_URL`` (see ``manage.py fake_sms_provider``
+and ``manage.py sms_benchmark``). It also counts the connections clients
+open, to show whether they are reused.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from .outbox import TokenBucket
+
+_MESSAGES_PATH = re.compile(r'^/2010-04-01/Accounts/(?P<sid>[^/]+)/Messages\.json$')
+
+
+class FakeTwilioServer:
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=50, jitter_ms=0, error_rate=0.0, rate_limit=None,
+                 seed=None):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.limiter = TokenBucket(rate_limit) if rate_limit else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            ('requests', 'accepted', 'rate_limited', 'errors', 'rejected', 'connections', 'peak_connections'), 0
+        )
+        self._open_connections = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve in a background thread; returns self."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-twilio', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve in the calling thread until interrupted."""
+        self._httpd.serve_forever()
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, open_connections=self._open_connections)
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _connection(self, delta):
+        with self._lock:
+            self._open_connections += delta
+            if delta > 0:
+                self._stats['connections'] += 1
+                self._stats['peak_connections'] = max(self._stats['peak_connections'], self._open_connections)
+
+    def _respond(self, sid, form):
+        """``(status, body)`` for one create-message request."""
+        self._count('requests')
+        if self.limiter is not None and self.limiter.try_acquire():
+            self._count('rate_limited')
+            return 429, _error(20429, 'Too Many Requests', 429)
+        with self._lock:
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+        time.sleep(delay)
+        if fail:
+            self._count('errors')
+            return 500, _error(20500, 'Internal Server Error', 500)
+        to, body = form.get('To'), form.get('Body')
+        sender = form.get('From') or form.get('MessagingServiceSid')
+        if not to or not body or not sender:
+            self._count('rejected')
+            return 400, _error(21604, "A 'To' phone number, 'Body' and 'From' are required.", 400)
+        self._count('accepted')
+        return 201, {
+            'sid': 'SM' + uuid.uuid4().hex,
+            'account_sid': sid,
+            'to': to,
+            'from': form.get('From'),
+            'messaging_service_sid': form.get('MessagingServiceSid'),
+            'body': body,
+            'status': 'queued',
+            'num_segments': '1',
+        }
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                server._connection(1)
+
+            def finish(self):
+                server._connection(-1)
+                super().finish()
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                match = _MESSAGES_PATH.match(self.path)
+                if match is None:
+                    status, payload = 404, _error(20404, 'The requested resource was not found', 404)
+                elif not self.headers.get('Authorization'):
+                    status, payload = 401, _error(20003, 'Authenticate', 401)
+                else:
+                    status, payload = server._respond(match['sid'], form)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def _error(code, message, status):
+    return {'code': code, 'message': message, 'more_info': f'https://www.twilio.com/docs/errors/{code}', 'status': status}
@@ -0,0 +1,105 @@
+"""Automatic SMS for token lifecycle events (opt-in with ``SMS_AUTO_NOTIFY``).
+
+``services.utils._queue_changed`` hands every status change to
+``publish_on_commit``. Once the transaction commits, ``publish`` queues
+``SMSLog`` messages in the outbox (``notifications.outbox`` sends them):
+one per changed token, and whenever the head of the queue moved, a notice
+to each of the next ``SMS_NOTIFY_NEXT_COUNT`` waiting tokens: "N ahead"
+(``token_near``) behind the head and "you are next" (``token_next``) at
+it. That is at most two reads and one bulk insert per change however many
+people are notified. The ``(queue_id, event_type)`` key with
+``ignore_conflicts`` makes each notice go out once per token, so a token
+gets one "N ahead" notice when it first comes within reach, one "next"
+notice when it reaches the head, and nothing more on every call-next.
+
+Users who opted out of SMS or have no valid phone number are skipped.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from queue_system.models import Queue, waiting_order
+
+from .models import SMSLog
+from .outbox import send_soon
+from .sms_service import _format_indian
+
+MESSAGES = {
+    'token_created': 'Your token #{token} for {service} is confirmed. We will text you when it is close.',
+    'token_serving': 'Now serving token #{token} at {service}. Please proceed to counter {counter}.',
+    'token_skipped': 'Your token #{token} at {service} was skipped. Please contact the help desk.',
+    'token_cancelled': 'Your token #{token} at {service} has been cancelled.',
+    'token_completed': 'Thank you for visiting {service}. Token #{token} is complete.',
+}
+NEXT_MESSAGE = 'Your token #{token} at {service} is next. Please be ready.'
+AHEAD_MESSAGE = 'Token #{token} at {service}: {ahead} token(s) ahead of you. Please be nearby.'
+
+DEFAULT_EVENTS = ('token_created', 'token_near', 'token_next', 'token_serving', 'token_skipped', 'token_cancelled')
+
+_STATUS_EVENTS = {
+    'waiting': 'token_created',
+    'serving': 'token_serving',
+    'completed': 'token_completed',
+    'cancelled': 'token_cancelled',
+}
+_FIELDS = ('pk', 'token_number', 'counter_number', 'service__name', 'user__phone_number', 'user__sms_opt_in')
+
+
+def publish_on_commit(service_id, changed, skipped=()):
+    """Queue notices for Queue instances that just changed status, once the transaction commits.
+
+    Cancelled tokens whose id is in ``skipped`` were skipped by an admin.
+    """
+    if not getattr(settings, 'SMS_AUTO_NOTIFY', False) or not changed:
+        return
+    events = []
+    for q in changed:
+        event = _STATUS_EVENTS[q.status]
+        if event == 'token_cancelled' and q.pk in skipped:
+            event = 'token_skipped'
+        events.append((q.pk, event))
+    # Only a token leaving the waiting set moves the others up.
+    look_ahead = any(q.status != 'waiting' for q in changed)
+    # Robust: a notification failure must not fail the queue change that committed.
+    transaction.on_commit(lambda: publish(service_id, events, look_ahead), robust=True)
+
+
+def publish(service_id, events, look_ahead=True):
+    """Queue messages for ``events`` (``(queue_id, event_type)`` pairs) and, with
+    ``look_ahead``, the notices for the next waiting tokens of the service.
+
+    Returns the number of messages offered; those already sent for the same
+    token and event are ignored by the database.
+    """
+    enabled = set(getattr(settings, 'SMS_AUTO_NOTIFY_EVENTS', DEFAULT_EVENTS))
+    wanted = {queue_id: event for queue_id, event in events if event in enabled}
+    messages = []
+    if wanted:
+        for pk, token, counter, service, phone, opt_in in Queue.objects.filter(pk__in=wanted).values_list(*_FIELDS):
+            text = MESSAGES[wanted[pk]].format(token=token, service=service, counter=counter)
+            messages.append(_message(pk, wanted[pk], phone, opt_in, text))
+
+    count = getattr(settings, 'SMS_NOTIFY_NEXT_COUNT', 3)
+    if look_ahead and count and enabled & {'token_next', 'token_near'}:
+        upcoming = (
+            Queue.objects.filter(service_id=service_id, status='waiting')
+            .order_by(*waiting_order())
+            .values_list(*_FIELDS)[:count]
+        )
+        for ahead, (pk, token, _, service, phone, opt_in) in enumerate(upcoming):
+            event, template = ('token_near', AHEAD_MESSAGE) if ahead else ('token_next', NEXT_MESSAGE)
+            if event in enabled:
+                text = template.format(ahead=ahead, token=token, service=service)
+                messages.append(_message(pk, event, phone, opt_in, text))
+
+    messages = [m for m in messages if m is not None]
+    if messages:
+        SMSLog.objects.bulk_create(messages, ignore_conflicts=True)
+        transaction.on_commit(send_soon)
+    return len(messages)
+
+
+def _message(queue_id, event, phone, opt_in, text):
+    phone = _format_indian(phone)
+    if not opt_in or not phone:
+        return None
+    return SMSLog(queue_id=queue_id, event_type=event, phone_number=phone, message=text[:160])
@@ -0,0 +1,50 @@
+"""Serve the local fake of the Twilio Messages API (``notifications.fake_provider``).
+
+For load tests of the send path without Twilio: point ``SMS_API_BASE_URL``
+at it (any ``SMS_ACCOUNT_SID``/``SMS_AUTH_TOKEN``/``SMS_FROM_NUMBER`` will
+do) and run ``sms_worker`` or ``sms_benchmark --base-url`` against it.
+Prints request and connection counts on exit.
+
+    python manage.py fake_sms_provider --port 8099 --latency-ms 80 --error-rate 0.02 --rate-limit 100
+    SMS_API_BASE_URL=http://127.0.0.1:8099 python manage.py sms_worker
+"""
+from django.core.management.base import BaseCommand
+
+from notifications.fake_provider import FakeTwilioServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake of the Twilio Messages API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--latency-ms', type=float, default=50, help='Time taken by each request.')
+        parser.add_argument('--jitter-ms', type=float, default=0, help='Random +/- spread of the latency.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered 500.')
+        parser.add_argument('--rate-limit', type=float, help='Requests a second above which it answers 429.')
+        parser.add_argument('--seed', type=int, help='Seed for latency jitter and errors.')
+
+    def handle(self, *args, **options):
+        server = FakeTwilioServer(
+            host=options['host'],
+            port=options['port'],
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            error_rate=options['error_rate'],
+            rate_limit=options['rate_limit'],
+            seed=options['seed'],
+        )
+        self.stdout.write(f'Fake SMS provider listening on {server.url} (Ctrl-C to stop).')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
+        stats = server.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['requests']} requests: {stats['accepted']} accepted, {stats['errors']} errors, "
+            f"{stats['rate_limited']} rate limited, {stats['rejected']} rejected; "
+            f"{stats['connections']} connections (peak {stats['peak_connections']})."
+        ))
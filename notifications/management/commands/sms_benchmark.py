@@ -0,0 +1,188 @@
+"""Measure SMS throughput end to end against a fake provider.
+
+Queues ``--messages`` admin SMS with ``notifications.sms_service.send_token_sms``
+while the outbox worker (``notifications.outbox.run_worker``) sends them to
+``notifications.fake_provider`` started in-process, or to ``--base-url`` (a
+``fake_sms_provider`` started separately). Reports enqueue latency,
+delivery throughput, retries, and the threads and provider connections
+used, then deletes the benchmark rows.
+
+Provider credentials are replaced by dummy ones for the run, so never point
+``--base-url`` at the real provider. Refuses to run while real messages are
+waiting in the outbox, as the worker would send them to the fake.
+
+    python manage.py sms_benchmark --messages 2000 --threads 16 --latency-ms 50
+    python manage.py sms_benchmark --messages 500 --error-rate 0.05 --rate-limit 100
+"""
+import logging
+import os
+import statistics
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q, Sum
+from django.test.utils import override_settings
+
+from accounts.models import User
+from notifications import outbox, sms_service
+from notifications.fake_provider import FakeTwilioServer
+from notifications.models import AdminSMSLog, OutboxMessage
+from queue_system.models import Queue
+from services.models import Service
+
+BENCH_CREDENTIALS = {
+    'SMS_ACCOUNT_SID': 'ACbench0000000000000000000000000000',
+    'SMS_AUTH_TOKEN': 'bench',
+    'SMS_FROM_NUMBER': '+15005550006',
+}
+
+
+class Command(BaseCommand):
+    help = 'Benchmark queuing and delivering SMS through the outbox against a fake provider.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help='Messages to queue and deliver.')
+        parser.add_argument('--threads', type=int, default=8, help='Worker threads (also the HTTP pool size).')
+        parser.add_argument('--batch-size', type=int, default=50, help='Messages claimed per worker round.')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Client-side provider calls a second (default: unlimited).')
+        parser.add_argument('--retry-base', type=float, default=0.2,
+                            help='Seconds before the first retry (and circuit reset) during the run.')
+        parser.add_argument('--timeout', type=float, default=300, help='Give up waiting for delivery after this.')
+        parser.add_argument('--base-url', help='Use a fake provider already running here instead of starting one.')
+        parser.add_argument('--latency-ms', type=float, default=50)
+        parser.add_argument('--jitter-ms', type=float, default=10)
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered 500.')
+        parser.add_argument('--rate-limit', type=float, help='Requests a second above which the fake answers 429.')
+
+    def handle(self, *args, **options):
+        waiting = sum(
+            m.objects.filter(status__in=(OutboxMessage.PENDING, OutboxMessage.SENDING)).count()
+            for m in outbox.OUTBOX_MODELS
+        )
+        if waiting:
+            raise CommandError(f'{waiting} messages are waiting in the outbox; run the benchmark on an idle outbox.')
+
+        server = None
+        if options['base_url']:
+            base_url = options['base_url']
+        else:
+            server = FakeTwilioServer(
+                latency_ms=options['latency_ms'],
+                jitter_ms=options['jitter_ms'],
+                error_rate=options['error_rate'],
+                rate_limit=options['rate_limit'],
+            ).start()
+            base_url = server.url
+
+        saved_env = {name: os.environ.get(name) for name in BENCH_CREDENTIALS}
+        os.environ.update(BENCH_CREDENTIALS)
+        overrides = override_settings(
+            SMS_API_BASE_URL=base_url,
+            # Only the measured worker sends.
+            SMS_SEND_IN_PROCESS=False,
+            SMS_HTTP_POOL_SIZE=options['threads'],
+            SMS_RATE_PER_SECOND=options['rate'] or 1_000_000,
+            SMS_RATE_BURST=None,
+            SMS_RETRY_BASE_SECONDS=options['retry_base'],
+            SMS_RETRY_MAX_SECONDS=options['retry_base'] * 8,
+            SMS_CIRCUIT_RESET_SECONDS=options['retry_base'],
+        )
+        overrides.enable()
+        # Every injected error would log a retry warning.
+        outbox_logger = logging.getLogger(outbox.__name__)
+        log_level = outbox_logger.level
+        if options['verbosity'] < 2:
+            outbox_logger.setLevel(logging.ERROR)
+        _reset_provider()
+        queue = self._seed()
+        try:
+            self._run(queue, server, options)
+        finally:
+            AdminSMSLog.objects.filter(queue=queue).delete()
+            Service.objects.filter(pk=queue.service_id).delete()
+            User.objects.filter(pk=queue.user_id).delete()
+            overrides.disable()
+            outbox_logger.setLevel(log_level)
+            _reset_provider()
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            if server is not None:
+                server.stop()
+
+    def _seed(self):
+        user = User.objects.create(username='bench-sms-user', uqid='UQIDBENCH-SMS000', phone_number='9000000000')
+        service = Service.objects.create(name='Bench SMS', service_type='bank', location='bench')
+        return Queue.objects.create(user=user, service=service, token_number=1)
+
+    def _run(self, queue, server, options):
+        n = options['messages']
+        stop = threading.Event()
+        worker = threading.Thread(target=outbox.run_worker, name='sms-bench-worker', kwargs={
+            'threads': options['threads'], 'batch_size': options['batch_size'], 'poll_seconds': 0.02, 'stop': stop,
+        })
+        started = time.perf_counter()
+        worker.start()
+
+        enqueue_ms = []
+        for i in range(n):
+            t = time.perf_counter()
+            sms_service.send_token_sms(queue, f'Benchmark message {i + 1} of {n}.')
+            enqueue_ms.append((time.perf_counter() - t) * 1000)
+        enqueued = time.perf_counter() - started
+
+        rows = AdminSMSLog.objects.filter(queue=queue)
+        peak_threads = _worker_threads()
+        done = 0
+        deadline = time.perf_counter() + options['timeout']
+        while done < n and time.perf_counter() < deadline:
+            time.sleep(0.05)
+            peak_threads = max(peak_threads, _worker_threads())
+            done = rows.filter(status__in=(OutboxMessage.SENT, OutboxMessage.FAILED)).count()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        worker.join()
+
+        summary = rows.aggregate(
+            sent=Count('pk', filter=Q(status=OutboxMessage.SENT)),
+            failed=Count('pk', filter=Q(status=OutboxMessage.FAILED)),
+            attempts=Sum('attempts'),
+        )
+        self._report(options, enqueue_ms, enqueued, elapsed, summary, done < n, peak_threads, server)
+
+    def _report(self, options, enqueue_ms, enqueued, elapsed, summary, timed_out, worker_threads, server):
+        n = options['messages']
+        enqueue_ms.sort()
+        p99 = enqueue_ms[min(len(enqueue_ms) - 1, int(len(enqueue_ms) * 0.99))]
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{n} messages, {options['threads']} threads, batch {options['batch_size']}"
+        ))
+        self.stdout.write(f'  enqueue:    {n / enqueued:9.1f} msg/s   '
+                          f'p50 {statistics.median(enqueue_ms):7.2f} ms   p99 {p99:7.2f} ms')
+        self.stdout.write(f"  delivery:   {summary['sent'] / elapsed:9.1f} msg/s   "
+                          f"{summary['sent']} sent, {summary['failed']} failed in {elapsed:.2f}s")
+        self.stdout.write(f"  retries:    {(summary['attempts'] or 0) - summary['sent'] - summary['failed']:9d}")
+        self.stdout.write(f'  threads:    {worker_threads:9d}   sending at peak')
+        if server is not None:
+            stats = server.stats()
+            self.stdout.write(f"  provider:   {stats['requests']:9d} requests   {stats['errors']} errors, "
+                              f"{stats['rate_limited']} rate limited")
+            self.stdout.write(f"  connections:{stats['connections']:9d} opened   peak {stats['peak_connections']} open")
+        else:
+            self.stdout.write('  connections:      n/a   (see the fake_sms_provider output)')
+        if timed_out:
+            self.stdout.write(self.style.WARNING(f"Timed out after {options['timeout']:.0f}s before all were delivered."))
+
+
+def _worker_threads():
+    return sum(t.name.startswith('sms-worker') for t in threading.enumerate())
+
+
+def _reset_provider():
+    """Drop the cached adapter and rate limiters so they pick up the current settings."""
+    sms_service._adapter = None
+    outbox._limiters.clear()
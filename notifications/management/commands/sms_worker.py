@@ -0,0 +1,47 @@
+"""Send queued SMS messages from the outbox.
+
+Runs as its own process next to the web workers (see ``notifications.outbox``):
+claims due ``AdminSMSLog``/``SMSLog`` rows in batches and sends them from a
+fixed pool of threads, retrying failures with backoff. Several workers can
+run at once. SIGTERM/SIGINT finish the current batch and exit; rows left
+``sending`` by a killed worker are picked up again after
+``SMS_CLAIM_TIMEOUT_SECONDS``.
+
+    python manage.py sms_worker --threads 4 --batch-size 50
+    python manage.py sms_worker --once   # drain what is due, e.g. from cron
+"""
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from notifications.outbox import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending SMS messages from the outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, help='Concurrent provider calls (default SMS_WORKER_THREADS).')
+        parser.add_argument('--batch-size', type=int, help='Messages claimed per round (default SMS_WORKER_BATCH_SIZE).')
+        parser.add_argument('--poll-seconds', type=float, help='Wait between checks when nothing is due.')
+        parser.add_argument('--once', action='store_true', help='Exit once no message is due.')
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: stop.set())
+
+        started = time.perf_counter()
+        totals = run_worker(
+            threads=options['threads'],
+            batch_size=options['batch_size'],
+            poll_seconds=options['poll_seconds'],
+            once=options['once'],
+            stop=stop,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {totals['sent']}, retrying {totals['pending']}, failed {totals['failed']} "
+            f'in {time.perf_counter() - started:.1f}s.'
+        ))
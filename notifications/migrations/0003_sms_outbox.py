@@ -0,0 +1,99 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:56
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def close_existing_messages(apps, schema_editor):
+    # Rows written before the outbox were already handed to a send thread;
+    # keep their outcome instead of sending them again.
+    for name in ('AdminSMSLog', 'SMSLog'):
+        model = apps.get_model('notifications', name)
+        model.objects.filter(success=True).update(status='sent', attempts=1)
+        model.objects.filter(success=False).update(status='failed', attempts=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_adminsmslog'),
+        ('queue_system', '0009_queue_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adminsmslog',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='adminsmslog',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='adminsmslog',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='adminsmslog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='smslog',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='smslog',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='smslog',
+            name='message',
+            field=models.CharField(blank=True, default='', max_length=160),
+        ),
+        migrations.AddField(
+            model_name='smslog',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='smslog',
+            name='phone_number',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='smslog',
+            name='event_type',
+            field=models.CharField(choices=[('token_created', 'Token Created'), ('token_near', 'Token Near'), ('token_next', 'Token Next'), ('token_serving', 'Token Serving'), ('token_skipped', 'Token Skipped'), ('token_cancelled', 'Token Cancelled'), ('token_completed', 'Token Completed')], max_length=32),
+        ),
+        migrations.AddField(
+            model_name='smslog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='adminsmslog',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='adminsmslog_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='smslog',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='smslog_due_idx'),
+        ),
+        migrations.RunPython(close_existing_messages, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='SMSRateLimit',
+            fields=[
+                ('provider', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.FloatField()),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,8 +1,42 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
-class SMSLog(models.Model):
+class OutboxMessage(models.Model):
+    """Delivery state of an SMS waiting in the outbox.
+
+    Rows are created ``pending`` and sent by ``manage.py sms_worker`` (see
+    ``notifications.outbox``): a worker marks them ``sending`` while it calls
+    the provider, then ``sent``, or back to ``pending`` with a later
+    ``next_attempt_at`` until ``SMS_MAX_ATTEMPTS`` is reached (``failed``).
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # When a worker took the row; a row left ``sending`` longer than
+    # SMS_CLAIM_TIMEOUT_SECONDS (worker crashed) is taken again.
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='%(class)s_due_idx'),
+        ]
+
+
+class SMSLog(OutboxMessage):
     """Record of automated SMS notifications (pre-existing event-based logs).
 
     Keeps the simple (queue_id, event_type) uniqueness to avoid duplicates
@@ -10,6 +44,7 @@ class SMSLog(models.Model):
     """
     EVENT_CHOICES = [
         ('token_created', 'Token Created'),
+        ('token_near', 'Token Near'),
         ('token_next', 'Token Next'),
         ('token_serving', 'Token Serving'),
         ('token_skipped', 'Token Skipped'),
@@ -19,19 +54,21 @@ class SMSLog(models.Model):
 
     queue_id = models.IntegerField(db_index=True)
     event_type = models.CharField(max_length=32, choices=EVENT_CHOICES)
+    phone_number = models.CharField(max_length=20, blank=True, default='')
+    message = models.CharField(max_length=160, blank=True, default='')
     sent_at = models.DateTimeField(auto_now_add=True)
     success = models.BooleanField(default=False)
     provider_id = models.CharField(max_length=200, blank=True, null=True)
     details = models.TextField(blank=True, null=True)
 
-    class Meta:
+    class Meta(OutboxMessage.Meta):
         unique_together = ('queue_id', 'event_type')
 
     def __str__(self):
         return f"SMSLog(queue={self.queue_id}, event={self.event_type}, success={self.success})"
 
 
-class AdminSMSLog(models.Model):
+class AdminSMSLog(OutboxMessage):
     """Record manual SMS messages sent by admins for a specific queue token.
 
     This stores a full audit trail for admin-triggered SMS messages.
@@ -46,8 +83,24 @@ class AdminSMSLog(models.Model):
     provider_id = models.CharField(max_length=200, blank=True, null=True)
     details = models.TextField(blank=True, null=True)
 
-    class Meta:
+    class Meta(OutboxMessage.Meta):
         ordering = ['-sent_at']
 
     def __str__(self):
         return f"AdminSMSLog(queue={self.queue_id if hasattr(self,'queue_id') else self.queue}, token={self.token_number}, admin={self.admin})"
+
+
+class SMSRateLimit(models.Model):
+    """The token bucket of an SMS provider, shared by every sending process.
+
+    Updated by ``notifications.outbox.SharedTokenBucket`` with a
+    compare-and-set on ``version``.
+    """
+    provider = models.CharField(max_length=32, primary_key=True)
+    tokens = models.FloatField()
+    # time.time() of the last take; the bucket refills from here.
+    updated_at = models.FloatField()
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"SMSRateLimit({self.provider}, tokens={self.tokens:.1f})"
@@ -0,0 +1,270 @@
+"""Durable SMS outbox.
+
+Messages are ``AdminSMSLog`` and ``SMSLog`` rows (see ``OutboxMessage``)
+created ``pending``, so a message outlives the web process that queued it.
+``run_worker`` claims due rows in batches and sends them from a fixed pool
+of threads: threads and memory stay bounded however many messages are
+waiting. It runs in ``manage.py sms_worker`` processes and, unless
+``SMS_SEND_IN_PROCESS`` is turned off, in a background thread of every
+process that queues messages (``send_soon``), so SMS go out even where no
+worker process is deployed.
+
+A claim is a compare-and-set update (like ``services.utils._transition``):
+rows move to ``sending`` only while they are still due, stamped with the
+claim time, so two workers never send the same row, and a row whose worker
+died is claimed again once its stamp is older than
+``SMS_CLAIM_TIMEOUT_SECONDS``. Results are written only if the stamp is
+still ours. Failed sends are retried with exponential backoff up to
+``SMS_MAX_ATTEMPTS``; the provider is called at most
+``SMS_RATE_PER_SECOND`` times a second across all sending processes (a
+token bucket kept in the database, see ``SharedTokenBucket``).
+While the provider's circuit breaker is open the worker stops claiming,
+and a message refused by it goes back without using up an attempt.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AdminSMSLog, OutboxMessage, SMSLog, SMSRateLimit
+from .sms_service import PROVIDER_NAME, _CircuitOpenError, _ProviderError, provider_retry_after, provider_send
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MODELS = (AdminSMSLog, SMSLog)
+
+
+class TokenBucket:
+    """Allow ``rate`` calls a second on average, in bursts of up to ``burst``."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = burst or max(1, rate)
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take one token if available; otherwise return the seconds until one is."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Take one token, waiting until one is available."""
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            self._sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """A ``TokenBucket`` kept in the ``SMSRateLimit`` row of ``name``, so every
+    process taking from it shares one rate.
+
+    A take reads the row and writes it back only if its version has not
+    moved (two queries, no locks held); a lost race is retried.
+    """
+
+    ATTEMPTS = 5
+
+    def __init__(self, name, rate, burst=None, clock=time.time, sleep=time.sleep):
+        # Wall-clock time: the refill is computed across processes.
+        super().__init__(rate, burst, clock=clock, sleep=sleep)
+        self.name = name
+
+    def try_acquire(self):
+        rows = SMSRateLimit.objects.filter(provider=self.name)
+        for _ in range(self.ATTEMPTS):
+            now = self._clock()
+            state = rows.values_list('tokens', 'updated_at', 'version').first()
+            if state is None:
+                try:
+                    with transaction.atomic():
+                        SMSRateLimit.objects.create(provider=self.name, tokens=self.capacity - 1, updated_at=now)
+                    return 0
+                except IntegrityError:
+                    # Created concurrently; take from it instead.
+                    continue
+            tokens, updated_at, version = state
+            now = max(now, updated_at)
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+            if rows.filter(version=version).update(tokens=tokens - 1, updated_at=now, version=version + 1):
+                return 0
+        # Other processes keep winning; let them go first.
+        return 1 / self.rate
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def rate_limiter(provider):
+    """The token bucket of ``provider``, shared with every other sending process."""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            limiter = _limiters[provider] = SharedTokenBucket(
+                provider, getattr(settings, 'SMS_RATE_PER_SECOND', 10), getattr(settings, 'SMS_RATE_BURST', None)
+            )
+        return limiter
+
+
+def retry_delay(attempts):
+    """Seconds before retrying a message that has failed ``attempts`` times (with jitter)."""
+    base = getattr(settings, 'SMS_RETRY_BASE_SECONDS', 30)
+    delay = min(getattr(settings, 'SMS_RETRY_MAX_SECONDS', 3600), base * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _due(now):
+    stale = now - timedelta(seconds=getattr(settings, 'SMS_CLAIM_TIMEOUT_SECONDS', 300))
+    return (
+        Q(status=OutboxMessage.PENDING, next_attempt_at__lte=now)
+        | Q(status=OutboxMessage.SENDING, claimed_at__lt=stale)
+    )
+
+
+def claim_batch(model, limit):
+    """Claim up to ``limit`` due messages of ``model`` for this worker; returns them."""
+    if limit <= 0:
+        return []
+    now = timezone.now()
+    ids = list(model.objects.filter(_due(now)).order_by('next_attempt_at').values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    model.objects.filter(_due(now), pk__in=ids).update(
+        status=OutboxMessage.SENDING, claimed_at=now, attempts=F('attempts') + 1
+    )
+    return list(model.objects.filter(pk__in=ids, status=OutboxMessage.SENDING, claimed_at=now))
+
+
+def _record(msg, **fields):
+    """Store the outcome of a claimed message unless another worker has since claimed it."""
+    return type(msg).objects.filter(
+        pk=msg.pk, status=OutboxMessage.SENDING, claimed_at=msg.claimed_at
+    ).update(**fields) == 1
+
+
+def deliver(msg):
+    """Send one claimed message and record the outcome. Returns its new status; never raises."""
+    try:
+        rate_limiter(PROVIDER_NAME).acquire()
+        provider_id, details = provider_send(msg.phone_number, msg.message)
+    except _CircuitOpenError as e:
+        _record(msg, status=OutboxMessage.PENDING, attempts=F('attempts') - 1, claimed_at=None,
+                next_attempt_at=timezone.now() + timedelta(seconds=e.retry_after))
+        return OutboxMessage.PENDING
+    except Exception as e:
+        retryable = getattr(e, 'retryable', True) if isinstance(e, _ProviderError) else True
+        max_attempts = getattr(settings, 'SMS_MAX_ATTEMPTS', 5)
+        if retryable and msg.attempts < max_attempts:
+            logger.warning('SMS %s #%s attempt %s failed, will retry: %s',
+                           type(msg).__name__, msg.pk, msg.attempts, e)
+            status = OutboxMessage.PENDING
+            fields = {'next_attempt_at': timezone.now() + timedelta(seconds=retry_delay(msg.attempts))}
+        else:
+            logger.error('SMS %s #%s failed after %s attempts: %s', type(msg).__name__, msg.pk, msg.attempts, e)
+            status = OutboxMessage.FAILED
+            fields = {'sent_at': timezone.now()}
+        _record(msg, status=status, success=False, details=str(e), claimed_at=None, **fields)
+        return status
+    _record(msg, status=OutboxMessage.SENT, success=True, provider_id=provider_id, details=details,
+            sent_at=timezone.now(), claimed_at=None)
+    return OutboxMessage.SENT
+
+
+def run_worker(threads=None, batch_size=None, poll_seconds=None, once=False, stop=None, wake=None):
+    """Send outbox messages until ``stop`` (a ``threading.Event``) is set.
+
+    Each round claims up to ``batch_size`` messages and waits for all of
+    them before claiming more, so at most that many rows are held at once.
+    With ``once``, returns when no message is due. When nothing is due it
+    waits ``poll_seconds``, or until ``wake`` (an Event) is set. Returns
+    counts per final status of the messages handled.
+    """
+    threads = threads or getattr(settings, 'SMS_WORKER_THREADS', 4)
+    batch_size = batch_size or getattr(settings, 'SMS_WORKER_BATCH_SIZE', 50)
+    poll_seconds = getattr(settings, 'SMS_WORKER_POLL_SECONDS', 1) if poll_seconds is None else poll_seconds
+    stop = stop or threading.Event()
+    totals = dict.fromkeys((OutboxMessage.SENT, OutboxMessage.PENDING, OutboxMessage.FAILED), 0)
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='sms-worker') as pool:
+        while not stop.is_set():
+            close_old_connections()
+            blocked = provider_retry_after()
+            if blocked:
+                stop.wait(blocked)
+                continue
+            batch = []
+            for model in OUTBOX_MODELS:
+                batch += claim_batch(model, batch_size - len(batch))
+            if not batch:
+                if once:
+                    break
+                if wake is None:
+                    stop.wait(poll_seconds)
+                else:
+                    wake.wait(poll_seconds)
+                    wake.clear()
+                continue
+            for status in pool.map(deliver, batch):
+                totals[status] += 1
+    return totals
+
+
+_wake = threading.Event()
+_sender = None
+_sender_pid = None
+_sender_lock = threading.Lock()
+
+
+def send_soon():
+    """Have this process's background sender look for due messages now.
+
+    Call after queuing messages. With ``SMS_SEND_IN_PROCESS`` (the default)
+    the first call starts one daemon thread running ``run_worker`` with
+    ``SMS_IN_PROCESS_THREADS`` threads; it also wakes every
+    ``SMS_IN_PROCESS_POLL_SECONDS`` for retries. Claims are compare-and-set,
+    so it can run alongside ``manage.py sms_worker``; deployments that run
+    the worker can turn it off. Messages left pending when the process
+    exits are sent by the next process that calls this, or by a worker.
+    """
+    global _sender, _sender_pid
+    if not getattr(settings, 'SMS_SEND_IN_PROCESS', True):
+        return
+    pid = os.getpid()
+    with _sender_lock:
+        # Started again in a forked child, or if it ever died.
+        if _sender is None or _sender_pid != pid or not _sender.is_alive():
+            _sender = threading.Thread(target=_send_in_background, name='sms-sender', daemon=True)
+            _sender_pid = pid
+            _sender.start()
+    _wake.set()
+
+
+def _send_in_background():
+    poll_seconds = getattr(settings, 'SMS_IN_PROCESS_POLL_SECONDS', 15)
+    while True:
+        try:
+            run_worker(threads=getattr(settings, 'SMS_IN_PROCESS_THREADS', 2), poll_seconds=poll_seconds, wake=_wake)
+        except Exception:
+            logger.exception('In-process SMS sender failed; restarting')
+            time.sleep(poll_seconds)
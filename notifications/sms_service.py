@@ -8,27 +8,131 @@ Design decisions:
 - Prefix Indian 10-digit numbers with +91 automatically.
 - Validate phone is 10 numeric digits before sending.
 - Do not raise on provider errors; record results to `AdminSMSLog`.
-- Background send to avoid blocking admin requests.
+- One adapter per process (`get_adapter`) reusing pooled keep-alive
+  connections, with a circuit breaker so provider outages fail fast.
+- Queue messages in the durable outbox (`notifications.outbox`) instead of
+  sending from the request; the process's background sender (by default)
+  or `manage.py sms_worker` delivers them.
 """
 import os
-import threading
 import logging
+import threading
+import time
 from typing import Optional
 
-from django.utils import timezone
+from django.conf import settings
+from django.db import transaction
 
 logger = logging.getLogger(__name__)
 
+# Key of the provider's rate limit in the outbox.
+PROVIDER_NAME = 'twilio'
+DEFAULT_API_BASE_URL = 'https://api.twilio.com'
+
 
 def _get_env(name: str) -> Optional[str]:
     return os.environ.get(name)
 
 
 class _ProviderError(Exception):
-    pass
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        # False when sending the same message again cannot succeed (rejected request).
+        self.retryable = retryable
+
+
+def _is_retryable(status_code) -> bool:
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+class _CircuitOpenError(_ProviderError):
+    def __init__(self, retry_after):
+        super().__init__(f'SMS provider circuit open; retry in {retry_after:.0f}s')
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fail fast while the provider is down instead of waiting out a timeout per message.
+
+    Opens after ``failures`` consecutive failed calls. While open, calls are
+    refused for ``reset_seconds``; then one trial call is let through
+    (half-open), which closes the circuit on success or opens it again.
+    Rejected requests (4xx) do not count: the provider answered.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failures=5, reset_seconds=30.0, clock=time.monotonic):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.last_error = None
+        self._opened_at = None
+        self._trial_running = False
+
+    def retry_after(self) -> float:
+        """Seconds until a call may be tried (0 when closed)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            if self.state == self.HALF_OPEN:
+                return self.reset_seconds if self._trial_running else 0.0
+            return max(0.0, self._opened_at + self.reset_seconds - self._clock())
+
+    def before_call(self):
+        """Raise `_CircuitOpenError` if the call must not be made now."""
+        with self._lock:
+            if self.state == self.OPEN:
+                wait = self._opened_at + self.reset_seconds - self._clock()
+                if wait > 0:
+                    raise _CircuitOpenError(wait)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._trial_running:
+                    raise _CircuitOpenError(self.reset_seconds)
+                self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_running = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = str(error)
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failures:
+                if self.state != self.OPEN:
+                    logger.warning('SMS provider circuit opened after %s failures: %s',
+                                   self.consecutive_failures, error)
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+
+    def health(self) -> dict:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'last_error': self.last_error,
+            'retry_after': self.retry_after(),
+        }
 
 
 class TwilioAdapter:
+    """Sends through Twilio over one pooled keep-alive HTTP session.
+
+    Built once per process by `get_adapter` and shared by all sending
+    threads. Uses the twilio library if installed (with its pooled HTTP
+    client), else the REST API through a `requests.Session`; always the
+    latter when ``SMS_API_BASE_URL`` points elsewhere (such as
+    `notifications.fake_provider`).
+    """
+
     def __init__(self):
         self.account_sid = _get_env('SMS_ACCOUNT_SID')
         self.auth_token = _get_env('SMS_AUTH_TOKEN')
@@ -36,16 +140,47 @@ class TwilioAdapter:
         if not (self.account_sid and self.auth_token and self.from_number):
             raise _ProviderError('Missing SMS provider credentials in env')
 
-        try:
-            from twilio.rest import Client
-            self._client = Client(self.account_sid, self.auth_token)
-            self._use_twilio_lib = True
-        except Exception:
-            self._client = None
-            self._use_twilio_lib = False
+        self.base_url = (getattr(settings, 'SMS_API_BASE_URL', '') or DEFAULT_API_BASE_URL).rstrip('/')
+        self.timeout = (getattr(settings, 'SMS_HTTP_CONNECT_TIMEOUT', 3), getattr(settings, 'SMS_HTTP_READ_TIMEOUT', 10))
+        self.breaker = CircuitBreaker(
+            getattr(settings, 'SMS_CIRCUIT_FAILURES', 5), getattr(settings, 'SMS_CIRCUIT_RESET_SECONDS', 30)
+        )
+        self._client = None
+        self._session = None
+        if self.base_url == DEFAULT_API_BASE_URL:
+            try:
+                from twilio.rest import Client
+                from twilio.http.http_client import TwilioHttpClient
+                http_client = TwilioHttpClient(pool_connections=True, timeout=self.timeout[1])
+                self._client = Client(self.account_sid, self.auth_token, http_client=http_client)
+            except Exception:
+                self._client = None
+        if self._client is None:
+            try:
+                import requests
+                from requests.adapters import HTTPAdapter
+            except Exception:
+                raise _ProviderError('Neither twilio lib nor requests available to send SMS')
+            pool_size = getattr(settings, 'SMS_HTTP_POOL_SIZE', 4)
+            self._session = requests.Session()
+            self._session.auth = (self.account_sid, self.auth_token)
+            self._session.mount(self.base_url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0))
 
     def send(self, to_number: str, body: str) -> dict:
-        if self._use_twilio_lib and self._client:
+        self.breaker.before_call()
+        try:
+            resp = self._send(to_number, body)
+        except _ProviderError as e:
+            if e.retryable:
+                self.breaker.record_failure(e)
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return resp
+
+    def _send(self, to_number: str, body: str) -> dict:
+        if self._client is not None:
             try:
                 # If a Messaging Service SID (starts with 'MG') was supplied, use it
                 if isinstance(self.from_number, str) and self.from_number.upper().startswith('MG'):
@@ -54,26 +189,49 @@ class TwilioAdapter:
                     msg = self._client.messages.create(body=body, from_=self.from_number, to=to_number)
                 return {'sid': getattr(msg, 'sid', None), 'status': getattr(msg, 'status', None)}
             except Exception as e:
-                raise _ProviderError(str(e))
-
-        try:
-            import requests
-        except Exception:
-            raise _ProviderError('Neither twilio lib nor requests available to send SMS')
+                raise _ProviderError(str(e), retryable=_is_retryable(getattr(e, 'status', None)))
 
-        url = f'https://api.twilio.com/2010-04-01/Accounts/{self.account_sid}/Messages.json'
+        url = f'{self.base_url}/2010-04-01/Accounts/{self.account_sid}/Messages.json'
         # Support Messaging Service SID by posting MessagingServiceSid instead of From
         if isinstance(self.from_number, str) and self.from_number.upper().startswith('MG'):
             payload = {'MessagingServiceSid': self.from_number, 'To': to_number, 'Body': body}
         else:
             payload = {'From': self.from_number, 'To': to_number, 'Body': body}
         try:
-            r = requests.post(url, data=payload, auth=(self.account_sid, self.auth_token), timeout=10)
-            if r.status_code >= 400:
-                raise _ProviderError(f'HTTP {r.status_code}: {r.text}')
-            return r.json()
+            r = self._session.post(url, data=payload, timeout=self.timeout)
         except Exception as e:
             raise _ProviderError(str(e))
+        if r.status_code >= 400:
+            raise _ProviderError(f'HTTP {r.status_code}: {r.text}', retryable=_is_retryable(r.status_code))
+        try:
+            return r.json()
+        except ValueError as e:
+            raise _ProviderError(f'Invalid provider response: {e}')
+
+    def health(self) -> dict:
+        return dict(self.breaker.health(), base_url=self.base_url, transport='twilio' if self._client else 'requests')
+
+
+_adapter = None
+_adapter_lock = threading.Lock()
+
+
+def get_adapter() -> TwilioAdapter:
+    """The process-wide provider adapter, created on first use.
+
+    Raises `_ProviderError` while credentials are missing.
+    """
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            _adapter = TwilioAdapter()
+        return _adapter
+
+
+def provider_retry_after() -> float:
+    """Seconds until the provider's circuit lets calls through (0 if closed or not yet used)."""
+    adapter = _adapter
+    return adapter.breaker.retry_after() if adapter is not None else 0.0
 
 
 def _format_indian(phone: str) -> Optional[str]:
@@ -92,64 +250,48 @@ def _format_indian(phone: str) -> Optional[str]:
     return None
 
 
-def _admin_background_send(log_obj, to_number: str, body: str):
-    """Background worker that calls provider and updates AdminSMSLog. Never raises."""
+def provider_send(to_number: str, body: str):
+    """Send one SMS through the provider; returns ``(provider_id, details)``.
+
+    Raises `_ProviderError`. With ``SMS_SIMULATE`` set and no credentials
+    configured, pretends to succeed (local/dev testing).
+    """
     simulate = os.environ.get('SMS_SIMULATE', '').lower() in ('1','true','yes')
     try:
-        provider = TwilioAdapter()
+        provider = get_adapter()
     except _ProviderError as e:
-        logger.exception('SMS provider unavailable: %s', e)
         if simulate:
-            # Simulate a successful send for local/dev testing
-            log_obj.success = True
-            log_obj.provider_id = 'SIMULATED'
-            log_obj.details = f'Simulated send: {e}'
-            log_obj.sent_at = timezone.now()
-            log_obj.save()
-            logger.info('Simulated SMS send to %s for queue %s', to_number, getattr(log_obj, 'queue_id', None))
-            return
-        log_obj.success = False
-        log_obj.details = str(e)
-        log_obj.sent_at = timezone.now()
-        log_obj.save()
-        return
+            logger.info('Simulated SMS send to %s', to_number)
+            return 'SIMULATED', f'Simulated send: {e}'
+        raise
 
-    try:
-        resp = provider.send(to_number, body)
-        prov_id = None
-        if isinstance(resp, dict):
-            prov_id = resp.get('sid') or resp.get('message_sid') or resp.get('sid')
-        log_obj.success = True
-        log_obj.provider_id = prov_id
-        log_obj.details = str(resp)
-        log_obj.sent_at = timezone.now()
-        log_obj.save()
-        logger.info('Admin SMS sent to %s for queue %s', to_number, getattr(log_obj.queue_id, 'id', None))
-    except Exception as e:
-        logger.exception('Admin SMS send failed for %s: %s', to_number, e)
-        log_obj.success = False
-        log_obj.details = str(e)
-        log_obj.sent_at = timezone.now()
-        log_obj.save()
+    resp = provider.send(to_number, body)
+    prov_id = None
+    if isinstance(resp, dict):
+        prov_id = resp.get('sid') or resp.get('message_sid')
+    return prov_id, str(resp)
+
+
+def _validate_message(message: str):
+    if not message or not message.strip():
+        raise ValueError('Message must not be empty')
+    if len(message) > 160:
+        raise ValueError('Message exceeds 160 characters')
 
 
 def send_token_sms(queue_obj, message: str, sent_by_admin_user=None):
     """Public entrypoint for sending a manual SMS tied to a queue token.
 
     - Validates message and phone formatting
-    - Creates `AdminSMSLog` record (success=False) immediately for audit
-    - Spawns background thread to call provider and update record
+    - Creates a pending `AdminSMSLog` record, which is both the audit entry
+      and the outbox message the SMS sender sends and updates
     - Returns the AdminSMSLog instance (not necessarily final success)
 
     Safety: does not raise provider errors to caller.
     """
     from notifications.models import AdminSMSLog
 
-    # Basic validation
-    if not message or not message.strip():
-        raise ValueError('Message must not be empty')
-    if len(message) > 160:
-        raise ValueError('Message exceeds 160 characters')
+    _validate_message(message)
 
     # Prefer `phone_number` on user model; fall back to legacy `phone` if present
     user = getattr(queue_obj, 'user', None)
@@ -171,7 +313,7 @@ def send_token_sms(queue_obj, message: str, sent_by_admin_user=None):
     if status in ('completed', 'cancelled'):
         raise ValueError('Cannot send SMS for completed or cancelled tokens')
 
-    # Create audit log entry
+    # Create audit log entry, queued for the SMS worker
     log = AdminSMSLog.objects.create(
         admin=sent_by_admin_user,
         queue=queue_obj,
@@ -180,9 +322,50 @@ def send_token_sms(queue_obj, message: str, sent_by_admin_user=None):
         message=message,
         success=False,
     )
+    _send_on_commit()
+    return log
 
-    # Start background sender
-    thread = threading.Thread(target=_admin_background_send, args=(log, formatted, message), daemon=True)
-    thread.start()
 
-    return log
+def broadcast_sms(service, message: str, sent_by_admin_user=None):
+    """Queue the same SMS to every waiting token of ``service`` (e.g. a delay notice).
+
+    One query selects the waiting tokens of opted-in users with their phone
+    numbers and one bulk insert queues their `AdminSMSLog` rows; the SMS
+    worker then sends them concurrently over its pooled connections.
+    Returns ``(queued, skipped)``, where skipped counts users without a
+    valid phone number.
+    """
+    from notifications.models import AdminSMSLog
+    from queue_system.models import Queue
+
+    _validate_message(message)
+    recipients = (
+        Queue.objects.filter(service=service, status='waiting', user__sms_opt_in=True)
+        .order_by('token_number')
+        .values_list('pk', 'token_number', 'user__phone_number')
+    )
+    logs = []
+    skipped = 0
+    for queue_id, token_number, phone in recipients:
+        formatted = _format_indian(phone)
+        if not formatted:
+            skipped += 1
+            continue
+        logs.append(AdminSMSLog(
+            admin=sent_by_admin_user,
+            queue_id=queue_id,
+            token_number=token_number,
+            phone_number=formatted,
+            message=message,
+        ))
+    AdminSMSLog.objects.bulk_create(logs, batch_size=500)
+    if logs:
+        _send_on_commit()
+    return len(logs), skipped
+
+
+def _send_on_commit():
+    """Wake the in-process sender (``notifications.outbox.send_soon``) once the new rows are committed."""
+    from notifications.outbox import send_soon
+
+    transaction.on_commit(send_soon)
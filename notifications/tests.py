@@ -0,0 +1,233 @@
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import User
+from queue_system.models import Queue
+from services.models import Service
+from services.utils import complete_current_and_serve_next, issue_token
+from . import outbox
+from .models import AdminSMSLog, OutboxMessage, SMSLog, SMSRateLimit
+from .outbox import SharedTokenBucket, TokenBucket
+from .sms_service import _CircuitOpenError, _ProviderError, broadcast_sms, send_token_sms
+
+
+def _message(**fields):
+    return AdminSMSLog.objects.create(phone_number='+919876500010', message='Hello', **fields)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        outbox._limiters.clear()
+
+    def _status(self, msg):
+        return AdminSMSLog.objects.values_list('status', 'attempts').get(pk=msg.pk)
+
+    def test_due_messages_are_claimed_once(self):
+        due = [_message(), _message()]
+        _message(next_attempt_at=timezone.now() + timedelta(minutes=5))
+        claimed = outbox.claim_batch(AdminSMSLog, 10)
+        self.assertEqual(sorted(m.pk for m in claimed), sorted(m.pk for m in due))
+        self.assertEqual({(m.status, m.attempts) for m in claimed}, {(OutboxMessage.SENDING, 1)})
+        self.assertEqual(outbox.claim_batch(AdminSMSLog, 10), [])
+
+    @override_settings(SMS_CLAIM_TIMEOUT_SECONDS=60)
+    def test_stale_claims_are_taken_again(self):
+        msg = _message()
+        [first] = outbox.claim_batch(AdminSMSLog, 10)
+        AdminSMSLog.objects.filter(pk=msg.pk).update(claimed_at=timezone.now() - timedelta(seconds=61))
+        [second] = outbox.claim_batch(AdminSMSLog, 10)
+        self.assertEqual(second.attempts, 2)
+        # The first worker comes back late: its result no longer applies.
+        self.assertFalse(outbox._record(first, status=OutboxMessage.SENT))
+        self.assertEqual(self._status(msg), (OutboxMessage.SENDING, 2))
+
+    def test_sent_message_is_recorded(self):
+        msg = _message()
+        [claimed] = outbox.claim_batch(AdminSMSLog, 1)
+        with mock.patch('notifications.outbox.provider_send', return_value=('SM1', '{}')):
+            self.assertEqual(outbox.deliver(claimed), OutboxMessage.SENT)
+        msg.refresh_from_db()
+        self.assertEqual((msg.status, msg.success, msg.provider_id, msg.claimed_at), ('sent', True, 'SM1', None))
+
+    @override_settings(SMS_MAX_ATTEMPTS=2, SMS_RETRY_BASE_SECONDS=30)
+    def test_failures_back_off_until_the_last_attempt(self):
+        msg = _message()
+        with mock.patch('notifications.outbox.provider_send', side_effect=_ProviderError('HTTP 503')):
+            [claimed] = outbox.claim_batch(AdminSMSLog, 1)
+            self.assertEqual(outbox.deliver(claimed), OutboxMessage.PENDING)
+            msg.refresh_from_db()
+            # Retry after base * 2**0, with up to half of it taken off as jitter.
+            delay = (msg.next_attempt_at - timezone.now()).total_seconds()
+            self.assertTrue(14 < delay <= 30, delay)
+            self.assertEqual(outbox.claim_batch(AdminSMSLog, 1), [])
+
+            AdminSMSLog.objects.filter(pk=msg.pk).update(next_attempt_at=timezone.now())
+            [claimed] = outbox.claim_batch(AdminSMSLog, 1)
+            self.assertEqual(outbox.deliver(claimed), OutboxMessage.FAILED)
+        self.assertEqual(self._status(msg), (OutboxMessage.FAILED, 2))
+
+    def test_permanent_errors_fail_at_once(self):
+        msg = _message()
+        [claimed] = outbox.claim_batch(AdminSMSLog, 1)
+        error = _ProviderError('HTTP 400: invalid number', retryable=False)
+        with mock.patch('notifications.outbox.provider_send', side_effect=error):
+            self.assertEqual(outbox.deliver(claimed), OutboxMessage.FAILED)
+        self.assertEqual(self._status(msg), (OutboxMessage.FAILED, 1))
+
+    def test_open_circuit_returns_the_message_without_using_an_attempt(self):
+        msg = _message()
+        [claimed] = outbox.claim_batch(AdminSMSLog, 1)
+        with mock.patch('notifications.outbox.provider_send', side_effect=_CircuitOpenError(20)):
+            self.assertEqual(outbox.deliver(claimed), OutboxMessage.PENDING)
+        msg.refresh_from_db()
+        self.assertEqual((msg.status, msg.attempts, msg.claimed_at), (OutboxMessage.PENDING, 0, None))
+        self.assertAlmostEqual((msg.next_attempt_at - timezone.now()).total_seconds(), 20, delta=2)
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_bursts_then_waits_for_the_rate(self):
+        now = [0.0]
+        bucket = TokenBucket(2, burst=3, clock=lambda: now[0])
+        self.assertEqual([bucket.try_acquire() for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+        now[0] += 0.5
+        self.assertEqual(bucket.try_acquire(), 0)
+
+    def test_acquire_sleeps_until_a_token_is_free(self):
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        bucket = TokenBucket(4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(6):
+            bucket.acquire()
+        self.assertAlmostEqual(now[0], 0.5)
+
+
+class SharedTokenBucketTests(TestCase):
+    def test_processes_share_one_rate(self):
+        now = [1000.0]
+        # Two processes' buckets for the same provider.
+        first, second = (SharedTokenBucket('test', 2, burst=3, clock=lambda: now[0]) for _ in range(2))
+        self.assertEqual([b.try_acquire() for b in (first, second, first)], [0, 0, 0])
+        self.assertAlmostEqual(second.try_acquire(), 0.5)
+        now[0] += 0.5
+        self.assertEqual(second.try_acquire(), 0)
+        self.assertAlmostEqual(first.try_acquire(), 0.5)
+        self.assertEqual(SMSRateLimit.objects.get(provider='test').version, 3)
+
+    def test_a_lost_race_is_retried(self):
+        bucket = SharedTokenBucket('test', 2, burst=3, clock=lambda: 1000.0)
+        bucket.try_acquire()
+        update = type(SMSRateLimit.objects.all()).update
+        calls = []
+
+        def racing_update(qs, **fields):
+            if 'updated_at' not in fields:
+                return update(qs, **fields)
+            calls.append(fields)
+            if len(calls) == 1:
+                # Another process takes a token between our read and write.
+                SMSRateLimit.objects.filter(provider='test').update(version=F('version') + 1, tokens=1)
+            return update(qs, **fields)
+
+        with mock.patch.object(type(SMSRateLimit.objects.all()), 'update', racing_update):
+            self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(SMSRateLimit.objects.get(provider='test').tokens, 0)
+
+
+class QueuedMessageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        service = Service.objects.create(name='Notify', service_type='bank', location='Main')
+        user = User.objects.create(username='sms', uqid='UQIDTEST-SMS001', phone_number='9876500011')
+        cls.queue = Queue.objects.create(user=user, service=service, token_number=1)
+
+    def test_queued_messages_wake_the_sender_on_commit(self):
+        with mock.patch('notifications.outbox.send_soon') as send_soon:
+            with self.captureOnCommitCallbacks(execute=True):
+                send_token_sms(self.queue, 'Please come to counter 1.')
+                broadcast_sms(self.queue.service, 'Running 10 minutes late.')
+        self.assertEqual(send_soon.call_count, 2)
+        self.assertEqual(AdminSMSLog.objects.filter(status=OutboxMessage.PENDING).count(), 2)
+
+    @override_settings(SMS_SEND_IN_PROCESS=False)
+    def test_in_process_sender_can_be_turned_off(self):
+        with mock.patch('notifications.outbox.threading.Thread') as thread:
+            outbox.send_soon()
+        thread.assert_not_called()
+
+
+class WorkerTests(TransactionTestCase):
+    # The worker reads from its own threads, which only see committed rows.
+
+    def test_wake_cuts_the_idle_wait_short(self):
+        stop, wake = threading.Event(), threading.Event()
+        with mock.patch('notifications.outbox.provider_send', return_value=('SM1', '{}')):
+            worker = threading.Thread(target=outbox.run_worker, kwargs={
+                'threads': 2, 'poll_seconds': 60, 'stop': stop, 'wake': wake,
+            })
+            worker.start()
+            try:
+                msg = _message()
+                wake.set()
+                deadline = time.monotonic() + 5
+                while time.monotonic() < deadline and self._status(msg) != OutboxMessage.SENT:
+                    time.sleep(0.05)
+            finally:
+                stop.set()
+                wake.set()
+                worker.join(5)
+        self.assertEqual(self._status(msg), OutboxMessage.SENT)
+
+    def _status(self, msg):
+        return AdminSMSLog.objects.values_list('status', flat=True).get(pk=msg.pk)
+
+
+@override_settings(SMS_AUTO_NOTIFY=True, SMS_NOTIFY_NEXT_COUNT=3)
+class LifecycleTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = Service.objects.create(name='Notify', service_type='bank', location='Main')
+        cls.user = User.objects.create(username='notify', uqid='UQIDTEST-SMS002', phone_number='9876500012')
+
+    def _notices(self, queue, event):
+        return list(SMSLog.objects.filter(queue_id=queue.pk, event_type=event).values_list('message', flat=True))
+
+    def test_each_token_is_told_it_is_next_once(self):
+        with mock.patch('notifications.outbox.send_soon'):
+            with self.captureOnCommitCallbacks(execute=True):
+                tokens = [issue_token(self.user, self.service) for _ in range(5)]
+            for _ in range(5):
+                with self.captureOnCommitCallbacks(execute=True):
+                    complete_current_and_serve_next(self.service, 1)
+                with self.captureOnCommitCallbacks(execute=True):
+                    # A second call-next with nothing changed for the waiting tokens.
+                    complete_current_and_serve_next(self.service, 1)
+
+        for q in tokens[1:]:
+            [next_notice] = self._notices(q, 'token_next')
+            self.assertIn(f'Your token #{q.token_number} at Notify is next.', next_notice)
+        # Tokens that were further back were told how close they were first.
+        for q in tokens[2:]:
+            [near_notice] = self._notices(q, 'token_near')
+            self.assertIn('ahead of you', near_notice)
+        self.assertEqual(len(self._notices(tokens[0], 'token_serving')), 1)
+
+    @override_settings(SMS_AUTO_NOTIFY_EVENTS=['token_next'])
+    def test_near_notices_can_be_turned_off(self):
+        with mock.patch('notifications.outbox.send_soon'):
+            tokens = [issue_token(self.user, self.service) for _ in range(3)]
+            with self.captureOnCommitCallbacks(execute=True):
+                complete_current_and_serve_next(self.service, 1)
+        self.assertEqual(
+            list(SMSLog.objects.values_list('queue_id', 'event_type')), [(tokens[1].pk, 'token_next')]
+        )
@@ -0,0 +1,76 @@
+"""ETags for conditional GETs on queue pages and APIs.
+
+Every change to a service's queue bumps its ``ServiceQueueVersion`` (see
+``services.utils._queue_changed``), so a response built from a service's
+queue is unchanged for as long as its version is. The functions here are
+``etag_func``s for ``django.views.decorators.http.condition``: they run
+before the view with one cheap lookup, and a matching ``If-None-Match``
+is answered with 304 without running any queue query.
+
+ETAs also depend on the hour of day (see ``services.eta``), so their tags
+include it. Returning None skips the conditional handling and lets the
+view respond (not found, forbidden, ...).
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from services.models import Service
+from .models import Queue
+
+
+def _hour():
+    return timezone.localtime().strftime('%Y%m%d%H')
+
+
+def page_etag(request, *parts):
+    """ETag for an HTML page, or None if it has to be rendered.
+
+    Pages embed a CSRF token and the signed-in user, so the tag is tied to
+    the session; pages with pending flash messages are always rendered.
+    """
+    if len(get_messages(request)):
+        return None
+    session = hashlib.sha256((request.session.session_key or '').encode()).hexdigest()[:12]
+    return '-'.join(str(p) for p in (session, *parts))
+
+
+def queue_api_etag(request, service_id):
+    version = Service.objects.with_queue_version().filter(pk=service_id).values_list(
+        'queue_version', flat=True
+    ).first()
+    if version is None:
+        return None
+    return f'queue-{service_id}-v{version}'
+
+
+def queue_eta_etag(request, queue_id):
+    row = Queue.objects.filter(pk=queue_id).values_list(
+        'user_id', 'service_id', 'service__queue_state__version'
+    ).first()
+    if row is None:
+        return None
+    user_id, service_id, version = row
+    version = version or 0
+    if request.user.pk != user_id and not request.user.is_staff:
+        return None
+    return f'eta-{queue_id}-{service_id}-v{version}-{_hour()}'
+
+
+def user_dashboard_etag(request):
+    # Versions only grow, so the sum over the user's tokens moves on any change
+    # to a service the user queues at; the count catches new tokens.
+    totals = Queue.objects.filter(user=request.user).aggregate(
+        n=Count('id'), v=Sum('service__queue_state__version')
+    )
+    return page_etag(request, 'dashboard', request.user.pk, totals['n'], totals['v'] or 0, _hour())
+
+
+def admin_dashboard_etag(request):
+    from accounts.models import User
+    from services.stats import queue_state
+
+    # The same state keys the cached counts the page shows (see services.stats).
+    return page_etag(request, 'admin', request.user.pk, *queue_state(), User.objects.count())
@@ -0,0 +1,59 @@
+"""Build and read the append-only ``QueueEvent`` log.
+
+``services.utils._queue_changed`` turns each transition into events with
+``transition_events`` and inserts them after bumping the service's queue
+version. That update locks its ``ServiceQueueVersion`` row until commit, so
+the events of one service get ids in commit order. A consumer that keeps the last id it has processed
+and calls ``events_after`` with it never misses or repeats an event of a
+service.
+
+With a single writer at a time (SQLite) that order holds across services
+too. On databases with concurrent writers, transactions of different
+services can commit out of id order, so consumers of several services
+should keep one cursor per service.
+"""
+from django.utils import timezone
+
+from .models import QueueEvent
+
+_STATUS_KINDS = {
+    'waiting': QueueEvent.ISSUED,
+    'serving': QueueEvent.SERVING,
+    'completed': QueueEvent.COMPLETED,
+    'cancelled': QueueEvent.CANCELLED,
+}
+
+
+def transition_events(service_id, version, changed=(), skipped=(), reprioritized=(), reordered=False):
+    """Unsaved events for one change of a service's queue.
+
+    ``changed`` are Queue instances that just moved to their current status
+    (cancelled ones whose id is in ``skipped`` were skipped by an admin),
+    ``reprioritized`` those whose priority level just changed.
+    """
+    now = timezone.now()
+    events = []
+    for q in changed:
+        kind = _STATUS_KINDS[q.status]
+        if kind == QueueEvent.CANCELLED and q.pk in skipped:
+            kind = QueueEvent.SKIPPED
+        events.append(QueueEvent(
+            service_id=service_id, version=version, at=now, kind=kind, queue_id=q.pk, token_number=q.token_number,
+            counter_number=q.counter_number if kind == QueueEvent.SERVING else None,
+        ))
+    for q in reprioritized:
+        events.append(QueueEvent(
+            service_id=service_id, version=version, at=now, kind=QueueEvent.PRIORITY, queue_id=q.pk,
+            token_number=q.token_number, priority_level=q.priority_level,
+        ))
+    if reordered:
+        events.append(QueueEvent(service_id=service_id, version=version, at=now, kind=QueueEvent.REORDERED))
+    return events
+
+
+def events_after(after_id, service_id=None, limit=1000):
+    """Up to ``limit`` events with an id above ``after_id``, oldest first, optionally of one service."""
+    events = QueueEvent.objects.filter(id__gt=after_id)
+    if service_id is not None:
+        events = events.filter(service_id=service_id)
+    return list(events.order_by('id')[:limit])
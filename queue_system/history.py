@@ -0,0 +1,54 @@
+"""Read a user's tokens across the live ``Queue`` table and ``QueueHistory``.
+
+Finished tokens older than ``QUEUE_ARCHIVE_AFTER_DAYS`` are moved to
+``QueueHistory`` by ``manage.py archive_queue_history``, keeping their ids.
+Pages that show a user's past tokens read through these helpers so the
+move is invisible to them. Both kinds of row have the same attributes
+(``is_archived`` tells them apart).
+"""
+import heapq
+from itertools import islice
+
+from .models import Queue, QueueHistory
+
+
+def user_tokens(user, limit=None):
+    """The user's tokens from both tables, newest first, with ``service`` loaded."""
+    live = Queue.objects.filter(user=user).select_related('service').order_by('-joined_at')
+    archived = QueueHistory.objects.filter(user=user).select_related('service').order_by('-joined_at')
+    if limit is not None:
+        live, archived = live[:limit], archived[:limit]
+    merged = heapq.merge(live, archived, key=lambda q: q.joined_at, reverse=True)
+    return list(islice(merged, limit))
+
+
+def user_token_counts(user):
+    """``{'total', 'completed', 'active'}`` counts of the user's tokens across both tables."""
+    from django.db.models import Count, Q
+
+    live = Queue.objects.filter(user=user).aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(status='completed')),
+        active=Count('id', filter=Q(status__in=['waiting', 'serving'])),
+    )
+    archived = QueueHistory.objects.filter(user=user).aggregate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(status='completed')),
+    )
+    return {
+        'total': live['total'] + archived['total'],
+        'completed': live['completed'] + archived['completed'],
+        'active': live['active'],
+    }
+
+
+def find_token(queue_id, user=None):
+    """The token with ``queue_id`` from either table (optionally only if it belongs to ``user``), or None."""
+    for model in (Queue, QueueHistory):
+        tokens = model.objects.select_related('service', 'user').filter(pk=queue_id)
+        if user is not None:
+            tokens = tokens.filter(user=user)
+        token = tokens.first()
+        if token is not None:
+            return token
+    return None
@@ -0,0 +1,119 @@
+"""Live queue updates for Server-Sent Events streams.
+
+Every committed queue change bumps the service's queue version (see
+``services.utils._queue_changed``). Instead of each open page polling the
+ETA endpoint, SSE streams subscribe here to the services they show. One
+watcher task per event loop reads the versions of all subscribed services
+in a single query every ``QUEUE_STREAM_POLL_SECONDS`` and wakes only the
+streams whose service actually changed; they then recompute their answer.
+
+Streams need the ASGI entry point (``smart_queue/asgi.py``): under WSGI an
+async streaming response is buffered until it ends, so the views refuse
+the stream there and the pages fall back to polling.
+"""
+import asyncio
+import weakref
+
+from django.conf import settings
+
+from services.models import Service
+
+
+def poll_seconds():
+    return getattr(settings, 'QUEUE_STREAM_POLL_SECONDS', 1)
+
+
+def heartbeat_seconds():
+    return getattr(settings, 'QUEUE_STREAM_HEARTBEAT_SECONDS', 15)
+
+
+def max_stream_seconds():
+    return getattr(settings, 'QUEUE_STREAM_MAX_SECONDS', 300)
+
+
+class Subscription:
+    """A stream's interest in some services; ``changed`` is set when any of them moves.
+
+    ``versions`` holds the version of each service the stream last answered
+    from, so a change committed before the watcher's first poll is not lost.
+    """
+
+    def __init__(self, versions):
+        self.versions = dict(versions)
+        self.changed = asyncio.Event()
+        self.changed_services = set()
+
+    async def wait(self, timeout):
+        """Wait up to ``timeout`` seconds and return the ids of the services that changed."""
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.changed.clear()
+        changed, self.changed_services = self.changed_services, set()
+        return changed
+
+
+class VersionWatcher:
+    """Polls the queue version of every subscribed service in one query."""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._task = None
+
+    def subscribe(self, versions):
+        """Watch the services in ``versions`` (service id -> version already seen)."""
+        sub = Subscription(versions)
+        self._subscriptions.add(sub)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return sub
+
+    def unsubscribe(self, sub):
+        self._subscriptions.discard(sub)
+
+    async def _run(self):
+        while self._subscriptions:
+            watched = set().union(*(s.versions for s in self._subscriptions))
+            versions = {
+                pk: version
+                async for pk, version in Service.objects.with_queue_version().filter(pk__in=watched).values_list(
+                    'pk', 'queue_version'
+                )
+            }
+            for sub in list(self._subscriptions):
+                hit = {pk for pk, seen in sub.versions.items() if versions.get(pk, seen) != seen}
+                if hit:
+                    sub.versions.update((pk, versions[pk]) for pk in hit)
+                    sub.changed_services |= hit
+                    sub.changed.set()
+            await asyncio.sleep(poll_seconds())
+
+
+async def service_versions(service_ids):
+    """Current ``queue_version`` of each service, read before computing an answer from it."""
+    return {
+        pk: version
+        async for pk, version in Service.objects.with_queue_version().filter(pk__in=service_ids).values_list(
+            'pk', 'queue_version'
+        )
+    }
+
+
+_watchers = weakref.WeakKeyDictionary()
+
+
+def get_watcher():
+    """Return the watcher for the running event loop."""
+    loop = asyncio.get_running_loop()
+    watcher = _watchers.get(loop)
+    if watcher is None:
+        watcher = _watchers[loop] = VersionWatcher()
+    return watcher
+
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Event carrying ``data`` (already JSON encoded)."""
+    lines = [f'event: {event}'] if event else []
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
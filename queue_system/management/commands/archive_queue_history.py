@@ -0,0 +1,77 @@
+"""Move finished tokens out of the live Queue table into QueueHistory.
+
+Completed and cancelled tokens that finished more than
+``QUEUE_ARCHIVE_AFTER_DAYS`` days ago are copied to ``QueueHistory`` (same
+id) and deleted from ``Queue``, one chunk per transaction, so the live
+table only holds active and recently finished tokens. Safe to run
+repeatedly, e.g. nightly from cron:
+
+    python manage.py archive_queue_history --older-than-days 30 --chunk-size 1000
+
+Audit and SMS log entries pointing at an archived token lose the link
+(their foreign keys are SET_NULL).
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from queue_system.models import Queue, QueueHistory
+
+FINISHED = ('completed', 'cancelled')
+
+
+class Command(BaseCommand):
+    help = 'Archive finished tokens older than a given age from the live queue table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=float,
+                            default=getattr(settings, 'QUEUE_ARCHIVE_AFTER_DAYS', 30),
+                            help='Archive tokens that finished at least this many days ago.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Tokens moved per transaction.')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['older_than_days'])
+        chunk_size = options['chunk_size']
+        candidates = Queue.objects.filter(status__in=FINISHED).filter(
+            Q(service_end_time__lt=cutoff) | Q(service_end_time__isnull=True, joined_at__lt=cutoff)
+        )
+
+        started = time.perf_counter()
+        moved = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                tokens = list(candidates.filter(pk__gt=last_pk).select_related('skip').order_by('pk')[:chunk_size])
+                if not tokens:
+                    break
+                QueueHistory.objects.bulk_create([self._history(q) for q in tokens], ignore_conflicts=True)
+                Queue.objects.filter(pk__in=[q.pk for q in tokens], status__in=FINISHED).delete()
+            last_pk = tokens[-1].pk
+            moved += len(tokens)
+            self.stdout.write(f'  {moved} tokens archived')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {moved} tokens finished before {cutoff:%Y-%m-%d %H:%M} '
+            f'in {time.perf_counter() - started:.1f}s.'
+        ))
+
+    @staticmethod
+    def _history(q):
+        return QueueHistory(
+            id=q.pk,
+            user_id=q.user_id,
+            service_id=q.service_id,
+            token_number=q.token_number,
+            status=q.status,
+            joined_at=q.joined_at,
+            service_start_time=q.service_start_time,
+            service_end_time=q.service_end_time,
+            counter_number=q.counter_number,
+            priority_level=q.priority_level,
+            skip_reason=q.skip_reason,
+        )
@@ -0,0 +1,157 @@
+"""Benchmark the queue hot-path queries with and without the hot-path indexes.
+
+Seeds a large token history inside a transaction, runs each hot query with
+the ``queue_system`` hot-path indexes dropped and then restored, prints the
+query plan and median latency for both, and rolls everything back.
+
+    python manage.py bench_queue_queries --tokens 1000000
+"""
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import User
+from queue_system.models import Queue, ahead_of, waiting_order
+from services.models import Service
+
+HOT_PATH_INDEXES = (
+    'queue_svc_status_token_idx',
+    'queue_svc_dispatch_idx',
+    'queue_svc_dispatch_id_idx',
+    'queue_active_svc_token_idx',
+)
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare plans and latency of the queue hot-path queries with and without the hot-path indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=1_000_000, help='Historical tokens to seed.')
+        parser.add_argument('--services', type=int, default=4, help='Services to spread the tokens over.')
+        parser.add_argument('--active', type=int, default=300, help='Waiting tokens per service.')
+        parser.add_argument('--repeat', type=int, default=50, help='Timed runs per query.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                services = self._seed(options)
+                target = services[0]
+                queries = self._queries(target)
+                results = {}
+                # Not entered as a context manager: the SQLite editor refuses to
+                # enter inside a transaction, but plain index DDL is transactional.
+                editor = connection.schema_editor()
+                indexes = [i for i in Queue._meta.indexes if i.name in HOT_PATH_INDEXES]
+                for index in indexes:
+                    editor.execute(editor.sql_delete_index % {
+                        'table': editor.quote_name(Queue._meta.db_table),
+                        'name': editor.quote_name(index.name),
+                    })
+                results['without'] = self._measure(queries, options['repeat'])
+                for index in indexes:
+                    editor.execute(index.create_sql(Queue, editor))
+                results['with'] = self._measure(queries, options['repeat'])
+                self._report(queries, results, options)
+                raise _Rollback
+        except _Rollback:
+            self.stdout.write('Seeded data rolled back.')
+
+    def _seed(self, options):
+        n_services = options['services']
+        per_service = options['tokens'] // n_services
+        active = options['active']
+        batch_size = options['batch_size']
+        user = User.objects.create(username='bench-queue-user', uqid='UQIDBENCH-000000', phone_number='0000000000')
+        services = [
+            Service.objects.create(name=f'Bench {i}', service_type='bank', location='bench')
+            for i in range(n_services)
+        ]
+        now = timezone.now()
+        started = time.perf_counter()
+        for svc in services:
+            batch = []
+            for token in range(1, per_service + 1):
+                if token > per_service - active:
+                    status = 'waiting'
+                elif token == per_service - active:
+                    status = 'serving'
+                else:
+                    status = 'cancelled' if token % 10 == 0 else 'completed'
+                batch.append(Queue(
+                    user=user,
+                    service=svc,
+                    token_number=token,
+                    status=status,
+                    counter_number=1 if status == 'serving' else None,
+                    priority_level=1 if token % 50 == 0 else 0,
+                ))
+                if len(batch) >= batch_size:
+                    Queue.objects.bulk_create(batch)
+                    batch = []
+            if batch:
+                Queue.objects.bulk_create(batch)
+            Service.objects.filter(pk=svc.pk).update(last_token_number=per_service)
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Queue._meta.db_table}')
+        elif connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        self.stdout.write(
+            f'Seeded {per_service * n_services} tokens over {n_services} services '
+            f'in {time.perf_counter() - started:.1f}s (at {now:%Y-%m-%d %H:%M}).'
+        )
+        return services
+
+    def _queries(self, svc):
+        waiting = Queue.objects.filter(service=svc, status='waiting')
+        mid = waiting.order_by(*waiting_order())[150]
+        return {
+            'current serving (call next)': lambda: Queue.objects.filter(
+                service=svc, status='serving').order_by('token_number')[:1],
+            'next waiting (call next)': lambda: Queue.objects.filter(
+                service=svc, status='waiting').order_by(*waiting_order())[:1],
+            'tokens ahead (get_queue_eta)': lambda: waiting.filter(ahead_of(mid)),
+            'active list (queue_api)': lambda: Queue.objects.filter(
+                service=svc, status__in=['waiting', 'serving']).order_by('token_number'),
+            'completed count (dashboard)': lambda: Queue.objects.filter(service=svc, status='completed'),
+            'active count (dashboard)': lambda: Queue.objects.filter(status__in=['waiting', 'serving']),
+        }
+
+    def _measure(self, queries, repeat):
+        out = {}
+        for name, build in queries.items():
+            qs = build()
+            is_count = 'count' in name or 'ahead' in name
+            plan = qs.explain()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                if is_count:
+                    build().count()
+                else:
+                    list(build())
+                timings.append((time.perf_counter() - started) * 1000)
+            out[name] = (plan, statistics.median(timings))
+        return out
+
+    def _report(self, queries, results, options):
+        self.stdout.write(f"\nMedian of {options['repeat']} runs, {connection.vendor}:\n")
+        for name in queries:
+            before_plan, before_ms = results['without'][name]
+            after_plan, after_ms = results['with'][name]
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(f'  without indexes: {before_ms:9.3f} ms')
+            for line in before_plan.splitlines():
+                self.stdout.write(f'      {line}')
+            self.stdout.write(f'  with indexes:    {after_ms:9.3f} ms')
+            for line in after_plan.splitlines():
+                self.stdout.write(f'      {line}')
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_system', '0003_queue_priority_level_queue_skip_reason'),
+        ('services', '0002_service_last_token_number_service_paused'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'status', 'token_number'], name='queue_svc_status_token_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'status', '-priority_level', 'token_number'], name='queue_svc_dispatch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'status', '-priority_level', 'id'], name='queue_svc_dispatch_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(condition=models.Q(('status__in', ['waiting', 'serving'])), fields=['service', 'token_number'], name='queue_active_svc_token_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:29
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def assign_counter_to_serving_tokens(apps, schema_editor):
+    # Tokens served before counters were tracked get the lowest counters free
+    # at their service, in the order they started.
+    Queue = apps.get_model('queue_system', 'Queue')
+    serving = Queue.objects.filter(status='serving')
+    busy = defaultdict(set)
+    for service_id, counter in serving.filter(counter_number__isnull=False).values_list('service_id', 'counter_number'):
+        busy[service_id].add(counter)
+    for q in serving.filter(counter_number__isnull=True).order_by('service_start_time', 'pk'):
+        counter = 1
+        while counter in busy[q.service_id]:
+            counter += 1
+        busy[q.service_id].add(counter)
+        Queue.objects.filter(pk=q.pk).update(counter_number=counter)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_system', '0004_queue_hot_path_indexes'),
+        ('services', '0002_service_last_token_number_service_paused'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_counter_to_serving_tokens, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='queue',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'serving')), fields=('service', 'counter_number'), name='one_serving_token_per_counter', violation_error_message='Only one token can be serving at a counter at any time.'),
+        ),
+        migrations.AddConstraint(
+            model_name='queue',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('status', 'serving'), _negated=True), ('counter_number__isnull', False), _connector='OR'), name='serving_token_has_counter', violation_error_message='A serving token must be assigned a counter.'),
+        ),
+    ]
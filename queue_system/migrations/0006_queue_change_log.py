@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_system', '0005_one_serving_token_per_counter'),
+        ('services', '0004_servicetimeestimate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('token_number', models.IntegerField(null=True)),
+                ('status', models.CharField(max_length=20)),
+                ('queue', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='queue_system.queue')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_changes', to='services.service')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['service', 'version'], name='queue_change_svc_version_idx')],
+            },
+        ),
+    ]
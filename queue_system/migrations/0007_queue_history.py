@@ -0,0 +1,37 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_system', '0006_queue_change_log'),
+        ('services', '0006_timingbucket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('token_number', models.IntegerField()),
+                ('status', models.CharField(choices=[('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('joined_at', models.DateTimeField()),
+                ('service_start_time', models.DateTimeField(blank=True, null=True)),
+                ('service_end_time', models.DateTimeField(blank=True, null=True)),
+                ('counter_number', models.IntegerField(blank=True, null=True)),
+                ('priority_level', models.IntegerField(default=0)),
+                ('skip_reason', models.TextField(blank=True, null=True)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_history', to='services.service')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_history', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'queue history',
+                'indexes': [models.Index(fields=['user', '-joined_at'], name='queue_hist_user_joined_idx'), models.Index(fields=['service', 'joined_at'], name='queue_hist_svc_joined_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,175 @@
+# Generated by Django 6.0.1 on 2026-10-17 14:05
+
+import django.db.models.deletion
+import queue_system.models
+from django.db import migrations, models
+from django.db.models import F
+
+STATUS_CHOICES = [('waiting', 'Waiting'), ('serving', 'Serving'), ('completed', 'Completed'), ('cancelled', 'Cancelled')]
+HISTORY_STATUS_CHOICES = [('completed', 'Completed'), ('cancelled', 'Cancelled')]
+# Frozen copy of QueueStatusField.CODES.
+CODES = {'waiting': 1, 'serving': 2, 'completed': 3, 'cancelled': 4}
+BATCH_SIZE = 1000
+
+
+def encode_status(apps, schema_editor):
+    for name in ('Queue', 'QueueHistory'):
+        model = apps.get_model('queue_system', name)
+        for status, code in CODES.items():
+            model.objects.filter(status=status).update(status_code=code)
+
+
+def decode_status(apps, schema_editor):
+    for name in ('Queue', 'QueueHistory'):
+        model = apps.get_model('queue_system', name)
+        for status, code in CODES.items():
+            model.objects.filter(status_code=code).update(status=status)
+
+
+def move_legacy_columns(apps, schema_editor):
+    Queue = apps.get_model('queue_system', 'Queue')
+    QueueSkipReason = apps.get_model('queue_system', 'QueueSkipReason')
+    # The legacy timestamps were written alongside the service times; older
+    # rows may only have the legacy ones.
+    Queue.objects.filter(service_start_time__isnull=True).update(service_start_time=F('served_at'))
+    Queue.objects.filter(service_end_time__isnull=True).update(service_end_time=F('completed_at'))
+    reasons = Queue.objects.exclude(skip_reason__isnull=True).exclude(skip_reason='').values_list('pk', 'skip_reason')
+    batch = []
+    for queue_id, reason in reasons.iterator(chunk_size=BATCH_SIZE):
+        batch.append(QueueSkipReason(queue_id=queue_id, reason=reason))
+        if len(batch) == BATCH_SIZE:
+            QueueSkipReason.objects.bulk_create(batch)
+            batch = []
+    QueueSkipReason.objects.bulk_create(batch)
+
+
+def restore_legacy_columns(apps, schema_editor):
+    Queue = apps.get_model('queue_system', 'Queue')
+    QueueSkipReason = apps.get_model('queue_system', 'QueueSkipReason')
+    Queue.objects.update(served_at=F('service_start_time'), completed_at=F('service_end_time'))
+    for queue_id, reason in QueueSkipReason.objects.values_list('queue_id', 'reason').iterator(chunk_size=BATCH_SIZE):
+        Queue.objects.filter(pk=queue_id).update(skip_reason=reason)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_system', '0007_queue_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueSkipReason',
+            fields=[
+                ('queue', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='skip', serialize=False, to='queue_system.queue')),
+                ('reason', models.TextField()),
+            ],
+        ),
+        # Everything over status is rebuilt once the column holds codes.
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='queue_svc_status_token_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='queue_svc_dispatch_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='queue_svc_dispatch_id_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='queue',
+            name='queue_active_svc_token_idx',
+        ),
+        migrations.RemoveConstraint(
+            model_name='queue',
+            name='one_serving_token_per_counter',
+        ),
+        migrations.RemoveConstraint(
+            model_name='queue',
+            name='serving_token_has_counter',
+        ),
+        # Nullable so that, when unapplying, the column can be added back before it is refilled.
+        migrations.AlterField(
+            model_name='queuehistory',
+            name='status',
+            field=models.CharField(choices=HISTORY_STATUS_CHOICES, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='queue',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='queuehistory',
+            name='status_code',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.RunPython(encode_status, decode_status),
+        migrations.RunPython(move_legacy_columns, restore_legacy_columns),
+        migrations.RemoveField(
+            model_name='queue',
+            name='status',
+        ),
+        migrations.RemoveField(
+            model_name='queuehistory',
+            name='status',
+        ),
+        migrations.RemoveField(
+            model_name='queue',
+            name='served_at',
+        ),
+        migrations.RemoveField(
+            model_name='queue',
+            name='completed_at',
+        ),
+        migrations.RemoveField(
+            model_name='queue',
+            name='skip_reason',
+        ),
+        migrations.RenameField(
+            model_name='queue',
+            old_name='status_code',
+            new_name='status',
+        ),
+        migrations.RenameField(
+            model_name='queuehistory',
+            old_name='status_code',
+            new_name='status',
+        ),
+        migrations.AlterField(
+            model_name='queue',
+            name='status',
+            field=queue_system.models.QueueStatusField(choices=STATUS_CHOICES, default='waiting'),
+        ),
+        migrations.AlterField(
+            model_name='queuehistory',
+            name='status',
+            field=queue_system.models.QueueStatusField(choices=HISTORY_STATUS_CHOICES),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'status', 'token_number'], name='queue_svc_status_token_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'status', '-priority_level', 'token_number'], name='queue_svc_dispatch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(fields=['service', 'status', '-priority_level', 'id'], name='queue_svc_dispatch_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='queue',
+            index=models.Index(condition=models.Q(('status__in', ['waiting', 'serving'])), fields=['service', 'token_number'], name='queue_active_svc_token_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='queue',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'serving')), fields=('service', 'counter_number'), name='one_serving_token_per_counter', violation_error_message='Only one token can be serving at a counter at any time.'),
+        ),
+        migrations.AddConstraint(
+            model_name='queue',
+            constraint=models.CheckConstraint(condition=models.Q(models.Q(('status', 'serving'), _negated=True), ('counter_number__isnull', False), _connector='OR'), name='serving_token_has_counter', violation_error_message='A serving token must be assigned a counter.'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('queue_system', '0008_compact_queue_rows'),
+        ('services', '0006_timingbucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueueEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Issued'), (2, 'Serving'), (3, 'Completed'), (4, 'Skipped'), (5, 'Cancelled'), (6, 'Reordered'), (7, 'Priority changed')])),
+                ('version', models.PositiveIntegerField()),
+                ('at', models.DateTimeField()),
+                ('token_number', models.IntegerField(null=True)),
+                ('counter_number', models.PositiveSmallIntegerField(null=True)),
+                ('priority_level', models.SmallIntegerField(null=True)),
+                ('queue', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='queue_system.queue')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue_events', to='services.service')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['service', 'id'], name='queue_event_svc_id_idx')],
+            },
+        ),
+    ]
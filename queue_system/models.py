@@ -1,11 +1,79 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from services.models import Service
-from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.functional import cached_property
 
 User = get_user_model()
 
+
+def dispatch_sequence_field():
+    """Name of the field that orders waiting tokens of equal priority.
+
+    Token numbers follow join order unless per-worker token leasing is enabled,
+    in which case blocks from different workers interleave and the row id (the
+    database's insert sequence) decides instead.
+    """
+    if getattr(settings, 'QUEUE_TOKEN_LEASE_SIZE', 0) > 1:
+        return 'id'
+    return 'token_number'
+
+
+def waiting_order():
+    """Return the ``order_by()`` fields that decide which waiting token is served next.
+
+    Higher priority first, then join order.
+    """
+    return ('-priority_level', dispatch_sequence_field())
+
+
+def dispatch_key(priority_level, sequence):
+    """In-memory sort key that orders tokens the same way as ``waiting_order()``."""
+    return (-priority_level, sequence)
+
+
+def ahead_of(queue):
+    """Return a ``Q`` matching the tokens served before ``queue`` in dispatch order."""
+    field = dispatch_sequence_field()
+    return models.Q(priority_level__gt=queue.priority_level) | models.Q(
+        priority_level=queue.priority_level, **{f'{field}__lt': getattr(queue, field)}
+    )
+
+class QueueStatusField(models.PositiveSmallIntegerField):
+    """A token status stored as a small integer but used as its name everywhere.
+
+    Filters, updates, ``values()`` and instances all keep the names
+    (``'waiting'``, ``'serving'``, ...); only the column holds ``CODES``.
+    Codes are part of the stored data: never renumber, only append.
+    """
+    CODES = {'waiting': 1, 'serving': 2, 'completed': 3, 'cancelled': 4}
+    NAMES = {code: name for name, code in CODES.items()}
+
+    @cached_property
+    def validators(self):
+        # Values are names, checked against ``choices``; the integer range
+        # validators of the parent class do not apply to them.
+        return list(self._validators)
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else self.NAMES[value]
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return self.NAMES[int(value)]
+
+    def get_prep_value(self, value):
+        value = models.Field.get_prep_value(self, value)
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return self.CODES[value]
+        return int(value)
+
+
 class Queue(models.Model):
     STATUS_CHOICES = [
         ('waiting', 'Waiting'),
@@ -17,38 +85,240 @@ class Queue(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     service = models.ForeignKey(Service, on_delete=models.CASCADE)
     token_number = models.IntegerField()
-    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='waiting')
+    status = QueueStatusField(choices=STATUS_CHOICES, default='waiting')
     joined_at = models.DateTimeField(auto_now_add=True)
     # When the service actually started serving this token
     service_start_time = models.DateTimeField(null=True, blank=True)
     # When the service finished serving this token
     service_end_time = models.DateTimeField(null=True, blank=True)
-    # legacy timestamps kept for compatibility
-    served_at = models.DateTimeField(null=True, blank=True)
-    completed_at = models.DateTimeField(null=True, blank=True)
     counter_number = models.IntegerField(null=True, blank=True)
     # Priority level: higher value means served earlier (for emergency/priority tokens)
     priority_level = models.IntegerField(default=0)
-    # If token was skipped by admin, store the reason
-    skip_reason = models.TextField(null=True, blank=True)
+
+    # Finished tokens are moved to QueueHistory by ``manage.py archive_queue_history``.
+    is_archived = False
 
     class Meta:
         unique_together = ('service', 'token_number')
+        indexes = [
+            # (service, status) lookups ordered by token: current serving token,
+            # tokens-ahead counts and per-service status counts.
+            models.Index(fields=['service', 'status', 'token_number'], name='queue_svc_status_token_idx'),
+            # Next waiting token in dispatch order (see waiting_order()), and the
+            # same under token leasing, where the row id replaces the token number.
+            models.Index(fields=['service', 'status', '-priority_level', 'token_number'], name='queue_svc_dispatch_idx'),
+            models.Index(fields=['service', 'status', '-priority_level', 'id'], name='queue_svc_dispatch_id_idx'),
+            # Active-only index for the live queue listings; stays small however much
+            # history accumulates. SQLite only uses partial indexes for literal
+            # predicates, so there the full indexes above do the work.
+            models.Index(
+                fields=['service', 'token_number'],
+                name='queue_active_svc_token_idx',
+                condition=models.Q(status__in=['waiting', 'serving']),
+            ),
+        ]
+        constraints = [
+            # Enforced by the database so they also hold for bulk/conditional updates.
+            # Each counter serves one token at a time; a service serves up to
+            # num_counters tokens at once (bounded in services.utils).
+            models.UniqueConstraint(
+                fields=['service', 'counter_number'],
+                condition=models.Q(status='serving'),
+                name='one_serving_token_per_counter',
+                violation_error_message='Only one token can be serving at a counter at any time.',
+            ),
+            models.CheckConstraint(
+                condition=~models.Q(status='serving') | models.Q(counter_number__isnull=False),
+                name='serving_token_has_counter',
+                violation_error_message='A serving token must be assigned a counter.',
+            ),
+        ]
 
     def __str__(self):
         return f"Token {self.token_number} - {self.user.username} at {self.service.name}"
 
-    def clean(self):
-        # Prevent more than one 'serving' token per service at the application level.
-        if self.status == 'serving':
-            qs = Queue.objects.filter(service=self.service, status='serving')
-            if self.pk:
-                qs = qs.exclude(pk=self.pk)
-            if qs.exists():
-                raise ValidationError('Only one token can be serving for a service at any time.')
+    # legacy timestamps kept for compatibility; always equal to the service times
+    @property
+    def served_at(self):
+        return self.service_start_time
+
+    @served_at.setter
+    def served_at(self, value):
+        self.service_start_time = value
+
+    @property
+    def completed_at(self):
+        return self.service_end_time
+
+    @completed_at.setter
+    def completed_at(self, value):
+        self.service_end_time = value
+
+    # If token was skipped by admin, the reason (stored in QueueSkipReason)
+    @property
+    def skip_reason(self):
+        if '_skip_reason' in self.__dict__:
+            return self._skip_reason
+        try:
+            return self.skip.reason
+        except ObjectDoesNotExist:
+            return None
+
+    @skip_reason.setter
+    def skip_reason(self, value):
+        # Written by save().
+        self._skip_reason = value
 
     def save(self, *args, **kwargs):
-        # Run validation within a transaction to reduce race windows.
+        # No full_clean(): its unique, constraint and foreign key checks would
+        # add queries to every join and transition. The database enforces them
+        # and raises IntegrityError instead.
+        if '_skip_reason' not in self.__dict__:
+            super().save(*args, **kwargs)
+            return
         with transaction.atomic():
-            self.full_clean()
             super().save(*args, **kwargs)
+            set_skip_reason(self, self._skip_reason)
+
+
+class QueueSkipReason(models.Model):
+    """Why an admin skipped or cancelled a token.
+
+    Few tokens have one, so it lives here rather than as a column on every
+    ``Queue`` row; ``Queue.skip_reason`` reads and writes it.
+    """
+    queue = models.OneToOneField(Queue, on_delete=models.CASCADE, primary_key=True, related_name='skip')
+    reason = models.TextField()
+
+    def __str__(self):
+        return f"Token {self.queue_id}: {self.reason}"
+
+
+def set_skip_reason(queue, reason):
+    """Store (or with None, clear) the skip reason of a saved token."""
+    if reason:
+        QueueSkipReason.objects.update_or_create(queue_id=queue.pk, defaults={'reason': reason})
+    else:
+        QueueSkipReason.objects.filter(queue_id=queue.pk).delete()
+    queue.__dict__['_skip_reason'] = reason or None
+
+
+class QueueHistory(models.Model):
+    """A finished (completed or cancelled) token moved out of the live ``Queue`` table.
+
+    Keeps the token's original id, so links to ``/queue/status/<id>/`` keep
+    working. ``served_at`` / ``completed_at`` are not stored separately:
+    they always equal the service start and end times.
+    Written by ``manage.py archive_queue_history``; read through
+    ``queue_system.history`` together with the live table.
+    """
+    STATUS_CHOICES = [c for c in Queue.STATUS_CHOICES if c[0] in ('completed', 'cancelled')]
+
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='queue_history')
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='queue_history')
+    token_number = models.IntegerField()
+    status = QueueStatusField(choices=STATUS_CHOICES)
+    joined_at = models.DateTimeField()
+    service_start_time = models.DateTimeField(null=True, blank=True)
+    service_end_time = models.DateTimeField(null=True, blank=True)
+    counter_number = models.IntegerField(null=True, blank=True)
+    priority_level = models.IntegerField(default=0)
+    skip_reason = models.TextField(null=True, blank=True)
+
+    is_archived = True
+
+    class Meta:
+        verbose_name_plural = 'queue history'
+        indexes = [
+            models.Index(fields=['user', '-joined_at'], name='queue_hist_user_joined_idx'),
+            models.Index(fields=['service', 'joined_at'], name='queue_hist_svc_joined_idx'),
+        ]
+
+    def __str__(self):
+        return f"Token {self.token_number} - {self.user.username} at {self.service.name} (archived)"
+
+    @property
+    def served_at(self):
+        return self.service_start_time
+
+    @property
+    def completed_at(self):
+        return self.service_end_time
+
+
+class QueueChange(models.Model):
+    """One entry of a service's bounded change log, read by ``queue_api`` deltas.
+
+    Written by ``services.utils`` in the same transaction as the change, one
+    row per token whose state changed, tagged with the service queue version
+    the change produced. A row without a token means the whole active list
+    changed (a reorder) and clients must reload it. Old versions are pruned,
+    see ``QUEUE_CHANGE_LOG_SIZE``.
+    """
+    RESET = 'reset'
+
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='queue_changes')
+    version = models.PositiveIntegerField()
+    # Only read for the serving user's uqid; no constraint so pruning and
+    # token cleanup stay independent.
+    queue = models.ForeignKey(Queue, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    token_number = models.IntegerField(null=True)
+    status = models.CharField(max_length=20)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['service', 'version'], name='queue_change_svc_version_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.service_id} v{self.version}: token {self.token_number} {self.status}"
+
+
+class QueueEvent(models.Model):
+    """Append-only log of every queue transition, for incremental consumers.
+
+    ``services.utils`` writes one row per transition in the same transaction
+    as the change, tagged with the service queue version it produced.
+    Rows are never updated or pruned, and consumers resume from the last id
+    they read (see ``queue_system.events``). Unlike ``QueueChange``, which
+    only keeps enough recent states for ``queue_api`` deltas, this keeps what
+    happened: who was skipped, reprioritised, served at which counter.
+    """
+    ISSUED = 1
+    SERVING = 2
+    COMPLETED = 3
+    SKIPPED = 4
+    CANCELLED = 5
+    REORDERED = 6
+    PRIORITY = 7
+    KIND_CHOICES = [
+        (ISSUED, 'Issued'),
+        (SERVING, 'Serving'),
+        (COMPLETED, 'Completed'),
+        (SKIPPED, 'Skipped'),
+        (CANCELLED, 'Cancelled'),
+        (REORDERED, 'Reordered'),
+        (PRIORITY, 'Priority changed'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='queue_events')
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    version = models.PositiveIntegerField()
+    at = models.DateTimeField()
+    # The token, or none for a reorder of the whole queue. No constraint, so
+    # archived tokens keep their events.
+    queue = models.ForeignKey(Queue, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    token_number = models.IntegerField(null=True)
+    # Counter of a serving event, new level of a priority change.
+    counter_number = models.PositiveSmallIntegerField(null=True)
+    priority_level = models.SmallIntegerField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['service', 'id'], name='queue_event_svc_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.service_id} v{self.version}: token {self.token_number} {self.get_kind_display()}"
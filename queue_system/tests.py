@@ -1,3 +1,77 @@
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 
-# Create your tests here.
+from accounts.models import User
+from services.models import Service
+from .models import Queue
+
+
+class QueueModelTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = Service.objects.create(name='Desk', service_type='bank', location='Main')
+        cls.user = User.objects.create(username='model', uqid='UQIDTEST-MODEL1', phone_number='9876500020')
+
+    def test_save_leaves_constraints_to_the_database(self):
+        with self.assertNumQueries(1):
+            Queue.objects.create(user=self.user, service=self.service, token_number=1)
+        for fields in ({'token_number': 1}, {'token_number': 2, 'status': 'serving'}):
+            with self.subTest(**fields), self.assertRaises(IntegrityError), transaction.atomic():
+                Queue.objects.create(user=self.user, service=self.service, **fields)
+
+
+class QueueApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = Service.objects.create(name='Counter', service_type='bank', location='Main')
+        cls.users = [
+            User.objects.create(username=f'user{i}', uqid=f'UQIDTEST-{i:06d}', phone_number=f'98765{i:05d}')
+            for i in range(10)
+        ]
+
+    def _seed(self, count):
+        start = Queue.objects.filter(service=self.service).count()
+        Queue.objects.bulk_create(
+            Queue(
+                user=self.users[token % len(self.users)],
+                service=self.service,
+                token_number=token,
+                status='serving' if token == 1 else 'waiting',
+                counter_number=1 if token == 1 else None,
+            )
+            for token in range(start + 1, count + 1)
+        )
+
+    def _get(self, **params):
+        return self.client.get(f'/queue/api/{self.service.pk}/', params)
+
+    def test_query_count_does_not_grow_with_the_queue(self):
+        # Etag version lookup, service, one page of tokens.
+        for size in (10, 1000, 10_000):
+            self._seed(size)
+            with self.assertNumQueries(3):
+                response = self._get(limit=1000)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['queues']), min(size, 1000))
+
+    def test_serving_token_shows_user_uqid(self):
+        self._seed(3)
+        queues = self._get().json()['queues']
+        self.assertEqual(queues[0], {'token': 1, 'status': 'serving', 'user_uqid': 'UQIDTEST-000001'})
+        self.assertIsNone(queues[1]['user_uqid'])
+
+    def test_keyset_pagination_walks_the_whole_queue(self):
+        self._seed(25)
+        tokens = []
+        params = {'limit': 10}
+        while True:
+            data = self._get(**params).json()
+            tokens += [q['token'] for q in data['queues']]
+            if data['next_after'] is None:
+                break
+            params['after'] = data['next_after']
+        self.assertEqual(tokens, list(range(1, 26)))
+
+    def test_invalid_page_parameters(self):
+        self.assertEqual(self._get(limit=0).status_code, 400)
+        self.assertEqual(self._get(after='x').status_code, 400)
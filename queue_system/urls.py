@@ -5,6 +5,8 @@ urlpatterns = [
     path('status/<int:queue_id>/', views.queue_status, name='queue_status'),
     path('my-queues/', views.my_queues, name='my_queues'),
     path('api/<int:service_id>/', views.queue_api, name='queue_api'),
+    path('eta/bulk/', views.queue_eta_bulk, name='queue_eta_bulk'),
     path('eta/<int:queue_id>/', views.queue_eta, name='queue_eta'),
+    path('stream/<int:queue_id>/', views.queue_stream, name='queue_stream'),
     path('cancel/<int:queue_id>/', views.cancel_own_queue, name='cancel_own_queue'),
 ]
\ No newline at end of file
@@ -1,45 +1,112 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+import asyncio
+import json
 from .models import Queue
+from . import live
+from .history import find_token, user_tokens
+from .etags import queue_api_etag, queue_eta_etag
 from services.models import Service
-from services.utils import get_queue_eta
+from services.utils import get_bulk_queue_eta, get_queue_eta, queue_changes_since, queue_eta as compute_queue_eta
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404
 
 @login_required
 def queue_status(request, queue_id):
-    queue = get_object_or_404(Queue, id=queue_id, user=request.user)
+    # Archived tokens keep their id, so old status links still resolve.
+    queue = find_token(queue_id, user=request.user)
+    if queue is None:
+        raise Http404('No such token.')
     return render(request, 'queue_system/queue_status.html', {'queue': queue})
 
 @login_required
 def my_queues(request):
-    queues = Queue.objects.filter(user=request.user).order_by('-joined_at')
+    queues = user_tokens(request.user)
     return render(request, 'queue_system/my_queues.html', {'queues': queues})
 
+# Default and largest number of tokens in one queue_api page.
+QUEUE_API_PAGE_SIZE = 200
+QUEUE_API_MAX_PAGE_SIZE = 1000
+
+
+@condition(etag_func=queue_api_etag)
 def queue_api(request, service_id):
-    service = get_object_or_404(Service, id=service_id)
-    queues = Queue.objects.filter(service=service, status__in=['waiting', 'serving']).order_by('token_number')
+    """Active tokens of a service, in token order.
+
+    The list is paginated by token number: ``?after=<token>&limit=<n>``
+    returns up to ``limit`` tokens after ``after``, and ``next_after`` is the
+    cursor for the following page (null on the last page).
+
+    With ``?since=<version>`` (the ``version`` of an earlier response; for a
+    paginated list, of its first page) only the tokens that changed since are
+    sent: ``changed`` holds tokens to add or update, ``removed`` the token
+    numbers that left the active list. ``full`` is true when a page of the
+    complete list is sent instead, because the client was too far behind.
+    """
+    service = get_object_or_404(Service.objects.with_queue_version(), id=service_id)
+    try:
+        since = request.GET.get('since')
+        since = int(since) if since is not None else None
+        after = request.GET.get('after')
+        after = int(after) if after is not None else None
+        limit = int(request.GET.get('limit', QUEUE_API_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'invalid_parameter'}, status=400)
+    if not 1 <= limit <= QUEUE_API_MAX_PAGE_SIZE:
+        return JsonResponse({'error': 'invalid_limit', 'max': QUEUE_API_MAX_PAGE_SIZE}, status=400)
+
+    if since is not None:
+        delta = queue_changes_since(service, since)
+        if delta is not None:
+            return JsonResponse({
+                'service': service.name,
+                'version': service.queue_version,
+                'since': since,
+                'full': False,
+                'changed': [
+                    {'token': token, 'status': status, 'user_uqid': uqid}
+                    for token, status, uqid in delta['changed']
+                ],
+                'removed': delta['removed'],
+            })
+
+    # One query per page whatever the queue length: the user's uqid is joined
+    # in and only the serialized columns are read.
+    queues = Queue.objects.filter(service=service, status__in=['waiting', 'serving'])
+    if after is not None:
+        queues = queues.filter(token_number__gt=after)
+    rows = list(queues.order_by('token_number').values_list('token_number', 'status', 'user__uqid')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
 
     data = {
         'service': service.name,
+        'version': service.queue_version,
+        'full': True,
         'queues': [
             {
-                'token': q.token_number,
-                'status': q.status,
-                'user_uqid': q.user.uqid if q.status == 'serving' else None
-            } for q in queues
-        ]
+                'token': token,
+                'status': status,
+                'user_uqid': uqid if status == 'serving' else None
+            } for token, status, uqid in rows
+        ],
+        'next_after': rows[-1][0] if has_more else None,
     }
     return JsonResponse(data)
 
 
 @login_required
+@condition(etag_func=queue_eta_etag)
 def queue_eta(request, queue_id):
     """Return ETA and status info for a user's queue entry.
 
     Response JSON:
-    - queue_id, token_number, status, tokens_ahead, eta_minutes, current_serving
+    - queue_id, token_number, status, tokens_ahead, waiting_ahead, serving_ahead,
+      eta_minutes, current_serving
     """
     queue = get_object_or_404(Queue, pk=queue_id)
     # Only owner or staff can access ETA for this queue
@@ -50,6 +117,101 @@ def queue_eta(request, queue_id):
     return JsonResponse(info)
 
 
+@login_required
+async def queue_stream(request, queue_id):
+    """Server-Sent Events stream of a queue entry's ETA info.
+
+    Sends an ``eta`` event (same JSON as ``queue_eta``) on connect and again
+    whenever the service's queue changes the answer, then an ``end`` event
+    once the token is completed or cancelled. Only available under ASGI;
+    clients fall back to polling ``queue_eta`` on error.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'stream_unavailable'}, status=503)
+    user = await request.auser()
+    queue = await Queue.objects.filter(pk=queue_id).only('id', 'user_id', 'service_id').afirst()
+    if queue is None:
+        return JsonResponse({'error': 'not_found'}, status=404)
+    if user.pk != queue.user_id and not user.is_staff:
+        return JsonResponse({'error': 'forbidden'}, status=403)
+
+    response = StreamingHttpResponse(_queue_events(queue.pk, queue.service_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _load_queue_eta(queue_id):
+    queue = Queue.objects.select_related('service').filter(pk=queue_id).first()
+    return compute_queue_eta(queue) if queue is not None else None
+
+
+async def _queue_events(queue_id, service_id):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + live.max_stream_seconds()
+    watcher = live.get_watcher()
+    # Read the version before the answer so a change in between is seen.
+    sub = watcher.subscribe(await live.service_versions([service_id]))
+    last = None
+    try:
+        while True:
+            info = await sync_to_async(_load_queue_eta)(queue_id)
+            if info is None or info['status'] not in ('waiting', 'serving'):
+                if info is not None:
+                    yield live.sse_event(json.dumps(info), 'eta')
+                yield live.sse_event('{}', 'end')
+                return
+            if info != last:
+                yield live.sse_event(json.dumps(info), 'eta')
+                last = info
+            # Wait for a change; comment lines keep proxies from closing the connection.
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    # The browser's EventSource reconnects on its own.
+                    return
+                if await sub.wait(min(live.heartbeat_seconds(), remaining)):
+                    break
+                yield ': keep-alive\n\n'
+    finally:
+        watcher.unsubscribe(sub)
+
+
+# Upper bound on the ids one bulk ETA request may ask for.
+BULK_ETA_MAX_IDS = 200
+
+
+@login_required
+def queue_eta_bulk(request):
+    """Return ETA info for many queue entries at once.
+
+    Query string: ``ids=1,2,3`` or ``service=<id>``. Non-staff users only
+    get their own tokens; ids they cannot see are left out of the answer.
+
+    Response JSON:
+    - results: list of queue_eta objects
+    """
+    user = None if request.user.is_staff else request.user
+    service_id = request.GET.get('service')
+    if service_id is not None:
+        try:
+            service_id = int(service_id)
+        except ValueError:
+            return JsonResponse({'error': 'invalid_service'}, status=400)
+        results = get_bulk_queue_eta(service_id=service_id, user=user)
+    else:
+        try:
+            ids = [int(i) for i in request.GET.get('ids', '').split(',') if i.strip()]
+        except ValueError:
+            return JsonResponse({'error': 'invalid_ids'}, status=400)
+        if not ids:
+            return JsonResponse({'error': 'missing_ids'}, status=400)
+        if len(ids) > BULK_ETA_MAX_IDS:
+            return JsonResponse({'error': 'too_many_ids', 'max': BULK_ETA_MAX_IDS}, status=400)
+        results = get_bulk_queue_eta(queue_ids=ids, user=user)
+    return JsonResponse({'results': results})
+
+
 @login_required
 def cancel_own_queue(request, queue_id):
     """Allow a user to cancel their own waiting token.
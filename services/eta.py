@@ -0,0 +1,86 @@
+"""Waiting-time estimates learned from completed tokens.
+
+Every completed token feeds its service time (``service_end_time`` minus
+``service_start_time``) into an exponentially weighted average for its
+service and hour of day (``ServiceTimeEstimate``). The update is a single
+``UPDATE ... SET avg_seconds = avg_seconds + alpha * (x - avg_seconds)``, so
+it stays O(1) however much history a service has.
+
+ETAs divide the per-token time by the number of counters currently serving.
+Until an hour has enough samples the estimate falls back to the service's
+other hours, then to ``Service.avg_service_time``.
+"""
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ServiceTimeEstimate
+
+# Weight of the newest sample in the moving average.
+ALPHA = 0.1
+# Samples an hour needs before its own estimate is trusted.
+MIN_SAMPLES = 5
+# Ignore samples longer than this (a token left serving by mistake).
+MAX_SAMPLE_SECONDS = 4 * 60 * 60
+# How long a service's estimates are cached per process.
+CACHE_SECONDS = 60
+
+
+def _cache_key(service_id):
+    return f'services:eta:{service_id}'
+
+
+def record_service_time(service_id, started, ended):
+    """Fold one completed token's service time into the estimate for its hour."""
+    if not started or not ended:
+        return
+    seconds = (ended - started).total_seconds()
+    if seconds <= 0 or seconds > MAX_SAMPLE_SECONDS:
+        return
+    hour = timezone.localtime(started).hour
+    rows = ServiceTimeEstimate.objects.filter(service_id=service_id, hour=hour)
+    updated = rows.update(
+        avg_seconds=F('avg_seconds') + ALPHA * (seconds - F('avg_seconds')),
+        samples=F('samples') + 1,
+    )
+    if not updated:
+        try:
+            with transaction.atomic():
+                ServiceTimeEstimate.objects.create(service_id=service_id, hour=hour, avg_seconds=seconds, samples=1)
+        except IntegrityError:
+            # Created concurrently; fold the sample in instead.
+            rows.update(
+                avg_seconds=F('avg_seconds') + ALPHA * (seconds - F('avg_seconds')),
+                samples=F('samples') + 1,
+            )
+
+
+def _load_estimates(service_id):
+    return {
+        hour: (avg, samples)
+        for hour, avg, samples in ServiceTimeEstimate.objects.filter(service_id=service_id).values_list(
+            'hour', 'avg_seconds', 'samples'
+        )
+    }
+
+
+def minutes_per_token(service, when=None):
+    """Estimated minutes one counter spends on a token of ``service`` at ``when`` (default now)."""
+    estimates = cache.get_or_set(_cache_key(service.pk), lambda: _load_estimates(service.pk), CACHE_SECONDS)
+    hour = timezone.localtime(when or timezone.now()).hour
+    avg, samples = estimates.get(hour, (None, 0))
+    if samples >= MIN_SAMPLES:
+        return avg / 60
+    total = sum(n for _, n in estimates.values())
+    if total >= MIN_SAMPLES:
+        return sum(a * n for a, n in estimates.values()) / total / 60
+    return service.avg_service_time or 5
+
+
+def estimate_wait_minutes(service, tokens_ahead, active_counters=1, when=None):
+    """Minutes until a token with ``tokens_ahead`` tokens before it is called."""
+    if tokens_ahead <= 0:
+        return 0
+    counters = max(1, min(active_counters or 1, max(service.num_counters, 1)))
+    return round(tokens_ahead * minutes_per_token(service, when) / counters)
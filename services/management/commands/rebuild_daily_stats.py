@@ -0,0 +1,82 @@
+"""Recompute the ServiceDailyStats rollup from the Queue and QueueHistory tables.
+
+Reads the live and archived token history in primary-key chunks, so memory
+stays bounded by the number of (service, day) rows rather than the number
+of tokens, then replaces the rollup rows in one transaction. Migration
+``services.0007_backfill_daily_stats`` fills the rollup the same way on
+deploy; run this to repair drift. Changes made while it scans are only
+reflected once they are in the table, so prefer a quiet period.
+
+    python manage.py rebuild_daily_stats --chunk-size 10000
+"""
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from queue_system.models import Queue, QueueHistory
+from services.models import ServiceDailyStats
+from services.stats import COUNTERS
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-service daily statistics rollup from the queue history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=10_000, help='Tokens read per query.')
+        parser.add_argument('--service', type=int, action='append', dest='services',
+                            help='Only rebuild this service id (repeatable).')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        rollup = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        started = time.perf_counter()
+        scanned = 0
+        # Live tokens, then those archived to QueueHistory.
+        fields = ('pk', 'service_id', 'status', 'joined_at', 'service_start_time', 'service_end_time')
+        for model in (Queue, QueueHistory):
+            tokens = model.objects.order_by('pk')
+            if options['services']:
+                tokens = tokens.filter(service_id__in=options['services'])
+            last_pk = 0
+            while True:
+                rows = list(tokens.filter(pk__gt=last_pk).values_list(*fields)[:chunk_size])
+                if not rows:
+                    break
+                for pk, service_id, status, joined, started_at, ended_at in rows:
+                    self._count(rollup, service_id, status, joined, started_at, ended_at)
+                last_pk = rows[-1][0]
+                scanned += len(rows)
+                self.stdout.write(f'  {scanned} tokens read')
+
+        with transaction.atomic():
+            existing = ServiceDailyStats.objects.all()
+            if options['services']:
+                existing = existing.filter(service_id__in=options['services'])
+            existing.delete()
+            ServiceDailyStats.objects.bulk_create(
+                (
+                    ServiceDailyStats(service_id=service_id, date=day, **counters)
+                    for (service_id, day), counters in rollup.items()
+                ),
+                batch_size=chunk_size,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {len(rollup)} daily rows from {scanned} tokens in {time.perf_counter() - started:.1f}s.'
+        ))
+
+    @staticmethod
+    def _count(rollup, service_id, status, joined, started_at, ended_at):
+        # Same rules as services.stats.transition_deltas: each event on its own day.
+        rollup[service_id, timezone.localdate(joined)]['issued'] += 1
+        if started_at:
+            served = rollup[service_id, timezone.localdate(started_at)]
+            served['served'] += 1
+            served['total_wait_seconds'] += (started_at - joined).total_seconds()
+        if status in ('completed', 'cancelled'):
+            finished = rollup[service_id, timezone.localdate(ended_at or joined)]
+            finished[status] += 1
+            if status == 'completed' and started_at and ended_at:
+                finished['total_service_seconds'] += (ended_at - started_at).total_seconds()
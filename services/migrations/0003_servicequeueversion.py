@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0002_service_last_token_number_service_paused'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceQueueVersion',
+            fields=[
+                ('service', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='queue_state', serialize=False, to='services.service')),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
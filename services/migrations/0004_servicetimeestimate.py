@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0003_servicequeueversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceTimeEstimate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('avg_seconds', models.FloatField()),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='time_estimates', to='services.service')),
+            ],
+            options={
+                'unique_together': {('service', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0004_servicetimeestimate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('issued', models.PositiveIntegerField(default=0)),
+                ('served', models.PositiveIntegerField(default=0)),
+                ('completed', models.PositiveIntegerField(default=0)),
+                ('cancelled', models.PositiveIntegerField(default=0)),
+                ('total_wait_seconds', models.FloatField(default=0)),
+                ('total_service_seconds', models.FloatField(default=0)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='services.service')),
+            ],
+            options={
+                'unique_together': {('service', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-17 07:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0005_servicedailystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimingBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('kind', models.CharField(choices=[('wait', 'Wait time'), ('service', 'Service time')], max_length=10)),
+                ('bucket', models.SmallIntegerField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timing_buckets', to='services.service')),
+            ],
+            options={
+                'unique_together': {('service', 'kind', 'hour', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 6.0.1 on 2026-10-17 16:20
+
+from collections import defaultdict
+
+from django.db import migrations
+from django.utils import timezone
+
+# Frozen copy of services.stats.COUNTERS.
+COUNTERS = ('issued', 'served', 'completed', 'cancelled', 'total_wait_seconds', 'total_service_seconds')
+BATCH_SIZE = 1000
+
+
+def backfill_daily_stats(apps, schema_editor):
+    """Recompute the rollup from the live and archived tokens (as ``manage.py rebuild_daily_stats`` does).
+
+    The dashboards read only the rollup, so without this every count would
+    start at zero and finishing an older token would drive ``in_queue``
+    negative. Rows written since the rollup was created are replaced, so
+    this is safe wherever it runs.
+    """
+    ServiceDailyStats = apps.get_model('services', 'ServiceDailyStats')
+    rollup = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    fields = ('service_id', 'status', 'joined_at', 'service_start_time', 'service_end_time')
+    for model in (apps.get_model('queue_system', 'Queue'), apps.get_model('queue_system', 'QueueHistory')):
+        rows = model.objects.values_list(*fields).iterator(chunk_size=BATCH_SIZE)
+        # Same rules as services.stats.transition_deltas: each event on its own day.
+        for service_id, status, joined, started_at, ended_at in rows:
+            rollup[service_id, timezone.localdate(joined)]['issued'] += 1
+            if started_at:
+                served = rollup[service_id, timezone.localdate(started_at)]
+                served['served'] += 1
+                served['total_wait_seconds'] += (started_at - joined).total_seconds()
+            if status in ('completed', 'cancelled'):
+                finished = rollup[service_id, timezone.localdate(ended_at or joined)]
+                finished[status] += 1
+                if status == 'completed' and started_at and ended_at:
+                    finished['total_service_seconds'] += (ended_at - started_at).total_seconds()
+    ServiceDailyStats.objects.all().delete()
+    ServiceDailyStats.objects.bulk_create(
+        (
+            ServiceDailyStats(service_id=service_id, date=day, **counters)
+            for (service_id, day), counters in rollup.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0006_timingbucket'),
+        # The token tables in their current shape (status codes, no legacy columns).
+        ('queue_system', '0009_queue_event'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,12 @@
 from django.db import models
+from django.db.models.functions import Coalesce
+
+
+class ServiceQuerySet(models.QuerySet):
+    def with_queue_version(self):
+        """Annotate each service with ``queue_version`` (see ``ServiceQueueVersion``)."""
+        return self.annotate(queue_version=Coalesce('queue_state__version', 0))
+
 
 class Service(models.Model):
     SERVICE_TYPES = [
@@ -18,5 +26,94 @@ class Service(models.Model):
     # Allow pausing a service queue (no new serving will be assigned)
     paused = models.BooleanField(default=False)
 
+    objects = ServiceQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name} - {self.location}"
+
+
+class ServiceQueueVersion(models.Model):
+    """Change counter of a service's queue, bumped once per committed change.
+
+    Lets per-process caches, ETags, delta polls and the event log detect and
+    order changes. It has its own row rather than a ``Service`` column so
+    that joins, which bump it, leave the service row alone: with token
+    leasing (``services.token_leases``) a join does not write that row at
+    all. Services that never changed have no row; read the version through
+    ``Service.objects.with_queue_version()``, which counts them as 0.
+    """
+    service = models.OneToOneField(Service, on_delete=models.CASCADE, primary_key=True, related_name='queue_state')
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.service.name} v{self.version}"
+
+
+class ServiceTimeEstimate(models.Model):
+    """Exponentially weighted average service time of a service at one hour of the day.
+
+    Updated incrementally each time a token is completed (see ``services.eta``).
+    """
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='time_estimates')
+    hour = models.PositiveSmallIntegerField()  # 0-23, local time
+    avg_seconds = models.FloatField()
+    samples = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('service', 'hour')
+
+    def __str__(self):
+        return f"{self.service.name} @ {self.hour:02d}h: {self.avg_seconds:.0f}s ({self.samples} samples)"
+
+
+class ServiceDailyStats(models.Model):
+    """Token outcomes of a service on one day, kept up to date as the queue changes.
+
+    Each event is counted on the day it happens: ``issued`` on joining,
+    ``served`` when called to a counter (adding its wait to
+    ``total_wait_seconds``), ``completed``/``cancelled`` when finished (a
+    completed token that was being served adds to ``total_service_seconds``).
+    Updated incrementally by ``services.utils``; ``manage.py
+    rebuild_daily_stats`` recomputes it from the ``Queue`` table.
+    """
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    issued = models.PositiveIntegerField(default=0)
+    served = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    total_wait_seconds = models.FloatField(default=0)
+    total_service_seconds = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('service', 'date')
+
+    def __str__(self):
+        return f"{self.service.name} on {self.date}: {self.issued} issued, {self.completed} completed"
+
+
+class TimingBucket(models.Model):
+    """One bucket of a service's log histogram of wait or service times for one hour.
+
+    Buckets are logarithmic (see ``services.sketches``), so a histogram is a
+    few dozen rows however many tokens it counts, and histograms merge by
+    adding counts: any window of hours and services is one grouped SUM.
+    """
+    WAIT = 'wait'
+    SERVICE = 'service'
+    KIND_CHOICES = [
+        (WAIT, 'Wait time'),
+        (SERVICE, 'Service time'),
+    ]
+
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, related_name='timing_buckets')
+    hour = models.DateTimeField()  # start of the hour
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    bucket = models.SmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('service', 'kind', 'hour', 'bucket')
+
+    def __str__(self):
+        return f"{self.service.name} {self.kind} @ {self.hour:%Y-%m-%d %H}h bucket {self.bucket}: {self.count}"
@@ -0,0 +1,289 @@
+"""Optional in-process queue state per service.
+
+Enabled with ``settings.QUEUE_ENGINE_IN_MEMORY``. Each worker process keeps
+the waiting tokens of a service in a priority heap keyed by
+``queue_system.models.dispatch_key`` (priority, then join order), with a
+Fenwick counter per priority level for ranks, so picking the next token and
+looking up a token's position are O(log n) in memory instead of ordering or
+counting the waiting set in the database on every request.
+
+The database stays the source of truth: ``services.utils`` writes every
+change to the ``Queue`` table first and applies it here after commit.
+The service's queue version (``ServiceQueueVersion``) is bumped once per
+change. Lookups are answered from memory; every
+``QUEUE_ENGINE_CHECK_SECONDS`` the state's version is compared with the
+database, and a state that missed a change (made by another worker) is
+rebuilt from the ``Queue`` table. Until then other workers' joins and
+priority changes are not seen, so positions may lag and the next token is
+picked in this worker's order. A dispatch that picks a token another worker
+already took is caught by the compare-and-set in ``services.utils`` and
+drops the state.
+"""
+import heapq
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from queue_system.models import Queue, dispatch_key, dispatch_sequence_field
+from .models import Service
+
+
+class WaitingToken:
+    """The fields of a waiting token needed to order and serve it."""
+
+    __slots__ = ('id', 'user_id', 'token_number', 'priority_level', 'joined_at', 'sequence', 'key', 'removed')
+
+    def __init__(self, id, user_id, token_number, priority_level, joined_at):
+        self.id = id
+        self.user_id = user_id
+        self.token_number = token_number
+        self.priority_level = priority_level
+        self.joined_at = joined_at
+        self.sequence = id if dispatch_sequence_field() == 'id' else token_number
+        self.key = dispatch_key(priority_level, self.sequence)
+        self.removed = False
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    @classmethod
+    def from_queue(cls, queue):
+        return cls(queue.pk, queue.user_id, queue.token_number, queue.priority_level, queue.joined_at)
+
+
+class FenwickCounter:
+    """Counts of waiting tokens by sequence number, with O(log n) prefix counts.
+
+    Positions are stored relative to ``base`` and the tree doubles in size as
+    higher sequence numbers arrive. Sequences only grow, so served tokens
+    leave a dead prefix below the lowest member; once it is most of the tree
+    the counter is rebuilt from that member (checked every ``len(members)``
+    removals, so at amortized O(1) per removal).
+    """
+
+    MIN_SIZE = 64
+
+    def __init__(self, base, size=MIN_SIZE):
+        self.base = base
+        self.total = 0
+        self._members = set()
+        self._tree = [0] * (size + 1)
+        self._removals = 0
+
+    def add(self, sequence, delta):
+        if sequence < self.base or sequence - self.base + 1 >= len(self._tree):
+            self._resize(min(self.base, sequence), max(sequence, self.base + len(self._tree) - 2))
+        i = sequence - self.base + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+        self.total += delta
+        if delta > 0:
+            self._members.add(sequence)
+        else:
+            self._members.discard(sequence)
+            self._removals += 1
+            if self._removals >= max(self.MIN_SIZE, len(self._members)):
+                self._compact(sequence)
+
+    def count_below(self, sequence):
+        """Number of members with a sequence lower than ``sequence``."""
+        i = min(sequence - self.base, len(self._tree) - 1)
+        count = 0
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+        return count
+
+    def _compact(self, removed):
+        self._removals = 0
+        low = min(self._members, default=removed + 1)
+        if low - self.base > (len(self._tree) - 1) // 2:
+            self._resize(low, max(self._members, default=low))
+
+    def _resize(self, low, high):
+        size = self.MIN_SIZE
+        while size < high - low + 1:
+            size *= 2
+        members = self._members
+        self.base = low
+        self.total = 0
+        self._members = set()
+        self._tree = [0] * (size + 1)
+        for sequence in members:
+            self.add(sequence, 1)
+
+
+class ServiceQueueState:
+    """Waiting tokens of one service, in dispatch order.
+
+    A heap gives the next token to serve; one Fenwick counter per priority
+    level gives a token's position (tokens ahead of it) in O(log n).
+    """
+
+    def __init__(self, service_id, version, tokens):
+        self.service_id = service_id
+        self.version = version
+        # When the version was last compared with the database (time.monotonic()).
+        self.checked_at = time.monotonic()
+        self.lock = threading.Lock()
+        self._by_id = {}
+        self._heap = []
+        self._counters = {}
+        for token in tokens:
+            self.add(token)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def add(self, token):
+        if token.id in self._by_id:
+            self.remove(token.id)
+        self._by_id[token.id] = token
+        heapq.heappush(self._heap, token)
+        counter = self._counters.get(token.priority_level)
+        if counter is None:
+            counter = self._counters[token.priority_level] = FenwickCounter(token.sequence)
+        counter.add(token.sequence, 1)
+
+    def remove(self, queue_id):
+        token = self._by_id.pop(queue_id, None)
+        if token is None:
+            return
+        # Lazy deletion from the heap; dropped when it reaches the top, or
+        # all at once when most of the heap is removed tokens.
+        token.removed = True
+        if len(self._heap) > 2 * len(self._by_id) + 64:
+            self._heap = [t for t in self._heap if not t.removed]
+            heapq.heapify(self._heap)
+        counter = self._counters[token.priority_level]
+        counter.add(token.sequence, -1)
+        if not counter.total:
+            del self._counters[token.priority_level]
+
+    def peek(self):
+        """Return the next token to serve, or None."""
+        while self._heap and self._heap[0].removed:
+            heapq.heappop(self._heap)
+        return self._heap[0] if self._heap else None
+
+    def position(self, queue_id):
+        """Number of waiting tokens ahead of ``queue_id``, or None if it is not waiting."""
+        token = self._by_id.get(queue_id)
+        if token is None:
+            return None
+        ahead = sum(c.total for p, c in self._counters.items() if p > token.priority_level)
+        return ahead + self._counters[token.priority_level].count_below(token.sequence)
+
+
+class QueueEngine:
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def state(self, service_id):
+        """Return the service's state, rebuilt from the database if it is missing or stale.
+
+        Served from memory while the state was checked within the last
+        ``QUEUE_ENGINE_CHECK_SECONDS``; after that, one primary-key lookup of
+        the service's queue version, and the waiting set is only reloaded when
+        that version moved without us.
+        """
+        state = self._states.get(service_id)
+        now = time.monotonic()
+        if state is not None and now - state.checked_at < getattr(settings, 'QUEUE_ENGINE_CHECK_SECONDS', 2):
+            return state
+        version = Service.objects.with_queue_version().filter(pk=service_id).values_list(
+            'queue_version', flat=True
+        ).first()
+        if version is None:
+            self.invalidate(service_id)
+            return None
+        if state is None or state.version != version:
+            return self._load(service_id)
+        state.checked_at = now
+        return state
+
+    def _load(self, service_id):
+        # Read the version before the rows: a change landing in between leaves
+        # the state one version behind, so the next access reloads it again.
+        version = Service.objects.with_queue_version().filter(pk=service_id).values_list(
+            'queue_version', flat=True
+        ).get()
+        rows = Queue.objects.filter(service_id=service_id, status='waiting').values_list(
+            'id', 'user_id', 'token_number', 'priority_level', 'joined_at'
+        )
+        state = ServiceQueueState(service_id, version, [WaitingToken(*row) for row in rows])
+        with self._lock:
+            self._states[service_id] = state
+        return state
+
+    def apply(self, service_id, version, added=(), removed=()):
+        """Apply a committed change that moved the service to ``version``.
+
+        Only applied if this state was at the previous version; otherwise it
+        missed a change from another worker and is dropped for a rebuild.
+        """
+        state = self._states.get(service_id)
+        if state is None:
+            return
+        with state.lock:
+            if state.version != version - 1:
+                self.invalidate(service_id)
+                return
+            for queue_id in removed:
+                state.remove(queue_id)
+            for token in added:
+                state.add(token)
+            state.version = version
+
+    def invalidate(self, service_id):
+        with self._lock:
+            self._states.pop(service_id, None)
+
+    def next_waiting(self, service_id):
+        """Return an unsaved ``Queue`` for the next token to serve, or None."""
+        state = self.state(service_id)
+        if state is None:
+            return None
+        with state.lock:
+            token = state.peek()
+        if token is None:
+            return None
+        return Queue(
+            id=token.id,
+            user_id=token.user_id,
+            service_id=service_id,
+            token_number=token.token_number,
+            priority_level=token.priority_level,
+            joined_at=token.joined_at,
+            status='waiting',
+        )
+
+    def position(self, service_id, queue_id):
+        state = self.state(service_id)
+        if state is None:
+            return None
+        with state.lock:
+            return state.position(queue_id)
+
+
+_engine = None
+_engine_pid = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return this process's engine, or None when the in-memory engine is disabled."""
+    global _engine, _engine_pid
+    if not getattr(settings, 'QUEUE_ENGINE_IN_MEMORY', False):
+        return None
+    pid = os.getpid()
+    if _engine is None or _engine_pid != pid:
+        with _engine_lock:
+            if _engine is None or _engine_pid != pid:
+                _engine = QueueEngine()
+                _engine_pid = pid
+    return _engine
@@ -0,0 +1,134 @@
+"""Wait and service time percentiles from mergeable log histograms.
+
+Each sample (seconds) is counted in a logarithmic bucket: bucket ``i``
+holds values in ``(GAMMA ** (i - 1), GAMMA ** i]`` and reports them as
+``2 * GAMMA ** i / (GAMMA + 1)``, so every quantile is within
+``(GAMMA - 1) / (GAMMA + 1)`` (about 2.4%) of a true sample value however
+many samples there are. Values up to a second share bucket 0.
+
+``services.utils`` counts samples per service and hour in ``TimingBucket``
+rows as tokens are served (wait time) and completed (service time), with
+F() increments. Histograms merge by adding bucket counts, so the
+percentiles of any window of hours and services come from one grouped
+query over a few dozen rows per hour.
+"""
+import math
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from .models import TimingBucket
+
+GAMMA = 1.05
+_LOG_GAMMA = math.log(GAMMA)
+# Ignore samples longer than this (a token left waiting or serving by mistake).
+MAX_SAMPLE_SECONDS = 24 * 60 * 60
+
+
+def bucket_index(seconds):
+    if seconds <= 1:
+        return 0
+    return math.ceil(math.log(seconds) / _LOG_GAMMA)
+
+
+def bucket_value(index):
+    if index == 0:
+        return 1.0
+    return 2 * GAMMA ** index / (GAMMA + 1)
+
+
+class LogHistogram:
+    """Bucket counts of one or more merged histograms."""
+
+    def __init__(self, counts=None):
+        self.counts = Counter(counts or {})
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def add(self, seconds, n=1):
+        self.counts[bucket_index(seconds)] += n
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        return self
+
+    def quantile(self, q):
+        """Estimated ``q`` quantile (0..1) in seconds, or None if empty."""
+        total = self.total
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                return bucket_value(index)
+        return bucket_value(max(self.counts))
+
+
+def hour_start(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def transition_samples(queues):
+    """``(kind, hour, seconds)`` samples for Queue instances that just moved to their current status."""
+    samples = []
+    for q in queues:
+        if q.status == 'serving' and q.joined_at and q.service_start_time:
+            samples.append((TimingBucket.WAIT, q.service_start_time, q.service_start_time - q.joined_at))
+        elif q.status == 'completed' and q.service_start_time and q.service_end_time:
+            samples.append((TimingBucket.SERVICE, q.service_end_time, q.service_end_time - q.service_start_time))
+    return [
+        (kind, hour_start(at), delta.total_seconds())
+        for kind, at, delta in samples
+        if 0 <= delta.total_seconds() <= MAX_SAMPLE_SECONDS
+    ]
+
+
+def record_samples(service_id, samples):
+    """Count ``(kind, hour, seconds)`` samples in the service's histograms."""
+    buckets = Counter((kind, hour, bucket_index(seconds)) for kind, hour, seconds in samples)
+    for (kind, hour, bucket), n in buckets.items():
+        rows = TimingBucket.objects.filter(service_id=service_id, kind=kind, hour=hour, bucket=bucket)
+        if rows.update(count=F('count') + n):
+            continue
+        try:
+            with transaction.atomic():
+                TimingBucket.objects.create(service_id=service_id, kind=kind, hour=hour, bucket=bucket, count=n)
+        except IntegrityError:
+            # Created concurrently; add to it instead.
+            rows.update(count=F('count') + n)
+
+
+def window_histograms(start, end, service_ids=None):
+    """Merged histograms per kind for the hours from the one containing ``start`` up to ``end``.
+
+    Optionally limited to some services.
+    """
+    rows = TimingBucket.objects.filter(hour__gte=hour_start(start), hour__lt=end)
+    if service_ids is not None:
+        rows = rows.filter(service_id__in=service_ids)
+    histograms = defaultdict(LogHistogram)
+    for kind, bucket, n in rows.values_list('kind', 'bucket').annotate(n=Sum('count')).order_by():
+        histograms[kind].counts[bucket] += n
+    return histograms
+
+
+def window_percentiles(start, end, service_ids=None, quantiles=(0.5, 0.9, 0.99)):
+    """Wait and service time percentiles (seconds) for a window.
+
+    Returns ``{kind: {'count': n, 'p50': s, 'p90': s, 'p99': s}}`` for both
+    kinds; percentiles are None when the window has no samples.
+    """
+    histograms = window_histograms(start, end, service_ids)
+    result = {}
+    for kind, _ in TimingBucket.KIND_CHOICES:
+        histogram = histograms.get(kind, LogHistogram())
+        result[kind] = {'count': histogram.total}
+        for q in quantiles:
+            value = histogram.quantile(q)
+            result[kind][f'p{round(q * 100)}'] = round(value, 1) if value is not None else None
+    return result
@@ -0,0 +1,120 @@
+"""Queue statistics for the dashboards.
+
+Counts come from the ``ServiceDailyStats`` rollup, which ``services.utils``
+updates in the same transaction as every queue change (right after commit
+for joins under token leasing), so reading them
+costs a few hundred rollup rows instead of a scan of the ``Queue`` table.
+Only the serving count, bounded by the number of counters, is read live.
+
+``queue_counts`` caches the result under a key made of the number of
+services, the sum of their queue versions (see ``queue_state``) and the
+date. Any committed queue change moves the key, whichever process made it,
+so a copy is never served after the queues changed, even with a cache that
+is not shared between processes (the default local-memory cache), and a
+version-based ETag (``queue_system.etags.admin_dashboard_etag``) never
+labels stale counts. Old copies simply expire.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import Service, ServiceDailyStats
+
+CACHE_KEY = 'services:queue_counts'
+
+COUNTERS = ('issued', 'served', 'completed', 'cancelled', 'total_wait_seconds', 'total_service_seconds')
+
+_EMPTY = {'total': 0, 'in_queue': 0, 'serving': 0, 'completed': 0, 'completed_today': 0}
+
+
+def transition_deltas(queues):
+    """Rollup increments for Queue instances that just moved to their current status."""
+    deltas = dict.fromkeys(COUNTERS, 0)
+    for q in queues:
+        if q.status == 'waiting':
+            deltas['issued'] += 1
+        elif q.status == 'serving':
+            deltas['served'] += 1
+            if q.joined_at and q.service_start_time:
+                deltas['total_wait_seconds'] += (q.service_start_time - q.joined_at).total_seconds()
+        elif q.status in ('completed', 'cancelled'):
+            deltas[q.status] += 1
+            if q.status == 'completed' and q.service_start_time and q.service_end_time:
+                deltas['total_service_seconds'] += (q.service_end_time - q.service_start_time).total_seconds()
+    return {name: value for name, value in deltas.items() if value}
+
+
+def record_daily_stats(service_id, deltas, day=None):
+    """Add ``deltas`` (counter name -> increment) to the service's rollup row for ``day`` (default today)."""
+    if not deltas:
+        return
+    day = day or timezone.localdate()
+    rows = ServiceDailyStats.objects.filter(service_id=service_id, date=day)
+    increments = {name: F(name) + value for name, value in deltas.items()}
+    if rows.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            ServiceDailyStats.objects.create(service_id=service_id, date=day, **deltas)
+    except IntegrityError:
+        # Created concurrently; add to it instead.
+        rows.update(**increments)
+
+
+def load_counts(service_ids=None):
+    """Token counts per service and overall, read from the rollup.
+
+    Returns ``{'services': {service_id: counts}, 'totals': counts}`` where
+    counts has ``total`` (issued), ``in_queue`` (waiting or serving),
+    ``serving``, ``completed`` and ``completed_today``.
+    """
+    from queue_system.models import Queue
+
+    rollup = ServiceDailyStats.objects.all()
+    serving = Queue.objects.filter(status='serving')
+    if service_ids is not None:
+        rollup = rollup.filter(service_id__in=service_ids)
+        serving = serving.filter(service_id__in=service_ids)
+    rows = (
+        rollup.values('service_id')
+        .annotate(
+            n_issued=Sum('issued'),
+            n_completed=Sum('completed'),
+            n_cancelled=Sum('cancelled'),
+            n_completed_today=Sum('completed', filter=Q(date=timezone.localdate()), default=0),
+        )
+        .order_by()
+    )
+    serving_by_service = dict(serving.values_list('service_id').annotate(n=Count('id')).order_by())
+    by_service = {
+        row['service_id']: {
+            'total': row['n_issued'],
+            'in_queue': row['n_issued'] - row['n_completed'] - row['n_cancelled'],
+            'serving': serving_by_service.get(row['service_id'], 0),
+            'completed': row['n_completed'],
+            'completed_today': row['n_completed_today'],
+        }
+        for row in rows
+    }
+    totals = {key: sum(row[key] for row in by_service.values()) for key in _EMPTY}
+    return {'services': by_service, 'totals': totals}
+
+
+def queue_state():
+    """``(services, sum of queue versions, date)``; moves whenever counts may have changed."""
+    totals = Service.objects.aggregate(n=Count('id'), v=Sum('queue_state__version'))
+    return totals['n'], totals['v'] or 0, timezone.localdate().isoformat()
+
+
+def queue_counts():
+    """Cached ``load_counts()`` for every service, as of the current ``queue_state()``."""
+    key = ':'.join(str(part) for part in (CACHE_KEY, *queue_state()))
+    return cache.get_or_set(key, load_counts, getattr(settings, 'QUEUE_STATS_CACHE_SECONDS', 30))
+
+
+def service_counts(counts, service_id):
+    """Counts of one service from a ``queue_counts()`` result (zeros if it has no tokens)."""
+    return counts['services'].get(service_id, _EMPTY)
+
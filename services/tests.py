@@ -1,3 +1,361 @@
-from django.test import TestCase
+import random
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import User
+from queue_system.models import Queue, QueueEvent
+from . import queue_engine, stats, token_leases, utils
+from .models import Service, ServiceDailyStats, ServiceQueueVersion
+from .queue_engine import FenwickCounter, ServiceQueueState, WaitingToken
+from .utils import (
+    _SERVE_ATTEMPTS, _finish, _transition, complete_current_and_serve_next, complete_token, issue_token,
+    serve_next_without_completing, skip_token,
+)
+
+
+@override_settings(QUEUE_TOKEN_LEASE_SIZE=10, QUEUE_TOKEN_LEASE_TIMEOUT=60)
+class TokenLeaseTests(TransactionTestCase):
+    # Leases are only used outside a transaction, which TestCase would wrap every test in.
+
+    def setUp(self):
+        token_leases._pool = None
+        self.services = [
+            Service.objects.create(name=f'Lease {i}', service_type='bank', location='Main') for i in range(2)
+        ]
+        self.user = User.objects.create(username='lease', uqid='UQIDTEST-LEASE1', phone_number='9876500001')
+
+    def tearDown(self):
+        token_leases._pool = None
+
+    def _last_token_number(self, service):
+        return Service.objects.values_list('last_token_number', flat=True).get(pk=service.pk)
+
+    def test_tokens_come_from_one_leased_block(self):
+        svc = self.services[0]
+        tokens = [issue_token(self.user, svc).token_number for _ in range(3)]
+        self.assertEqual(tokens, [1, 2, 3])
+        self.assertEqual(self._last_token_number(svc), 10)
+
+    def test_joins_within_a_block_do_not_write_the_service_row(self):
+        svc = self.services[0]
+        issue_token(self.user, svc)
+        with CaptureQueriesContext(connection) as queries:
+            issue_token(self.user, svc)
+        table = connection.ops.quote_name(Service._meta.db_table)
+        self.assertEqual([q['sql'] for q in queries if q['sql'].startswith(f'UPDATE {table}')], [])
+
+    def test_join_writes_no_per_service_row_before_commit(self):
+        svc = self.services[0]
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            queue = issue_token(self.user, svc)
+        self.assertTrue(Queue.objects.filter(pk=queue.pk).exists())
+        self.assertFalse(ServiceQueueVersion.objects.filter(service=svc).exists())
+        self.assertFalse(ServiceDailyStats.objects.filter(service=svc).exists())
+        # The deferred recording, as run once the token has committed.
+        on_commit.call_args.args[0]()
+        self.assertEqual(ServiceQueueVersion.objects.get(service=svc).version, 1)
+        self.assertEqual(ServiceDailyStats.objects.get(service=svc).issued, 1)
+
+    def test_failed_join_keeps_the_block_leased(self):
+        svc = self.services[0]
+        with mock.patch.object(Queue.objects, 'create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                issue_token(self.user, svc)
+        # The block leased by the failed join stays committed, so no other
+        # worker can lease the numbers this process goes on handing out.
+        self.assertEqual(self._last_token_number(svc), 10)
+        self.assertEqual(issue_token(self.user, svc).token_number, 2)
+        self.assertEqual(Queue.objects.filter(service=svc).count(), 1)
+
+    def test_expired_leases_are_given_back_on_any_join(self):
+        first, second = self.services
+        with override_settings(QUEUE_TOKEN_LEASE_TIMEOUT=0):
+            token_leases._pool = None
+            issue_token(self.user, first)
+            issue_token(self.user, second)
+        self.assertEqual(self._last_token_number(first), 1)
+
+    def test_leases_in_use_do_not_time_out(self):
+        svc = self.services[0]
+        # Each join comes 50 seconds after the last, within the 60 second timeout.
+        with mock.patch('services.token_leases.time') as clock:
+            clock.monotonic.side_effect = [0, 50, 100, 150]
+            tokens = [issue_token(self.user, svc).token_number for _ in range(4)]
+        self.assertEqual(tokens, [1, 2, 3, 4])
+        self.assertEqual(self._last_token_number(svc), 10)
+
+
+class TransitionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = Service.objects.create(name='Desk', service_type='bank', location='Main', num_counters=2)
+        cls.user = User.objects.create(username='walker', uqid='UQIDTEST-TRANS1', phone_number='9876500002')
+
+    def setUp(self):
+        self.tokens = [issue_token(self.user, self.service) for _ in range(3)]
+
+    def _status(self, queue):
+        return Queue.objects.values_list('status', flat=True).get(pk=queue.pk)
+
+    def _events(self, kind):
+        return QueueEvent.objects.filter(service=self.service, kind=kind).count()
+
+    def test_transition_only_applies_from_the_expected_status(self):
+        q = self.tokens[0]
+        self.assertFalse(_transition(q, 'serving', 'completed'))
+        self.assertEqual(q.status, 'waiting')
+        self.assertTrue(_transition(q, 'waiting', 'cancelled'))
+        self.assertEqual(q.status, 'cancelled')
+        self.assertEqual(self._status(q), 'cancelled')
+
+    def test_transition_from_a_stale_instance_loses(self):
+        first = self.tokens[0]
+        stale = Queue.objects.get(pk=first.pk)
+        self.assertTrue(_transition(first, 'waiting', 'serving', counter_number=1))
+        self.assertFalse(_transition(stale, 'waiting', 'cancelled'))
+        self.assertEqual(stale.status, 'waiting')
+        self.assertEqual(self._status(first), 'serving')
+
+    def test_serve_next_picks_again_when_the_candidate_is_taken(self):
+        taken, second = self.tokens[0], self.tokens[1]
+        real_next_waiting = utils._next_waiting
+        calls = []
+
+        def next_waiting(service_id, engine=None):
+            candidate = real_next_waiting(service_id, engine)
+            if not calls:
+                # Another worker cancels the candidate between the read and the update.
+                Queue.objects.filter(pk=candidate.pk).update(status='cancelled')
+            calls.append(candidate.pk)
+            return candidate
+
+        with mock.patch('services.utils._next_waiting', side_effect=next_waiting):
+            served = serve_next_without_completing(self.service, 1)
+        self.assertEqual(calls, [taken.pk, second.pk])
+        self.assertEqual(served.pk, second.pk)
+        self.assertEqual(self._status(second), 'serving')
+
+    def test_serve_next_gives_up_after_repeated_losses(self):
+        stale = Queue.objects.get(pk=self.tokens[0].pk)
+        Queue.objects.filter(pk=stale.pk).update(status='cancelled')
+        with mock.patch('services.utils._next_waiting', return_value=stale) as next_waiting:
+            self.assertIsNone(serve_next_without_completing(self.service, 1))
+        self.assertEqual(next_waiting.call_count, _SERVE_ATTEMPTS)
+        self.assertEqual(Queue.objects.filter(service=self.service, status='serving').count(), 0)
+
+    def test_busy_counter_rejects_a_second_serving_token(self):
+        first = serve_next_without_completing(self.service, 1)
+        self.assertIsNone(serve_next_without_completing(self.service, 1))
+        # The rejected update ran in a savepoint; the transaction is still usable.
+        self.assertEqual(self._status(self.tokens[1]), 'waiting')
+        self.assertEqual(list(Queue.objects.filter(status='serving').values_list('pk', flat=True)), [first.pk])
+
+    def test_counters_serve_in_order_in_parallel(self):
+        at_1 = serve_next_without_completing(self.service)
+        at_2 = serve_next_without_completing(self.service)
+        self.assertEqual((at_1.pk, at_1.counter_number), (self.tokens[0].pk, 1))
+        self.assertEqual((at_2.pk, at_2.counter_number), (self.tokens[1].pk, 2))
+        self.assertIsNone(serve_next_without_completing(self.service))
+
+    def test_call_next_completes_and_serves_at_the_same_counter(self):
+        serve_next_without_completing(self.service, 2)
+        completed, served = complete_current_and_serve_next(self.service, 2)
+        self.assertEqual(completed.pk, self.tokens[0].pk)
+        self.assertEqual((served.pk, served.counter_number), (self.tokens[1].pk, 2))
+        self.assertEqual(self._status(completed), 'completed')
+
+    def test_complete_token_serves_next_unless_paused(self):
+        serving = serve_next_without_completing(self.service, 1)
+        _, served = complete_token(serving)
+        self.assertEqual((served.pk, served.counter_number), (self.tokens[1].pk, 1))
+        Service.objects.filter(pk=self.service.pk).update(paused=True)
+        served = Queue.objects.select_related('service').get(pk=served.pk)
+        _, after_pause = complete_token(served)
+        self.assertIsNone(after_pause)
+        self.assertEqual(self._status(self.tokens[2]), 'waiting')
+
+    def test_finishing_a_finished_token_changes_nothing(self):
+        q = self.tokens[0]
+        complete_token(q)
+        completed = self._events(QueueEvent.COMPLETED)
+        self.assertIsNone(_finish(q, 'cancelled'))
+        _, next_q = skip_token(q.pk, reason='late')
+        self.assertIsNone(next_q)
+        self.assertEqual(self._status(q), 'completed')
+        self.assertEqual(self._events(QueueEvent.COMPLETED), completed)
+        self.assertEqual(self._events(QueueEvent.SKIPPED), 0)
+
+    def test_eta_reports_the_serving_token_apart_from_the_waiting_ones(self):
+        serve_next_without_completing(self.service, 1)
+        info = utils.queue_eta(Queue.objects.get(pk=self.tokens[2].pk))
+        self.assertEqual((info['waiting_ahead'], info['serving_ahead'], info['tokens_ahead']), (1, 1, 2))
+
+    def test_finish_follows_a_concurrent_change(self):
+        stale = Queue.objects.get(pk=self.tokens[0].pk)
+        serve_next_without_completing(self.service, 1)
+        # The instance still says waiting; the finish retries from serving.
+        self.assertEqual(_finish(stale, 'completed'), 'serving')
+        self.assertEqual(self._status(stale), 'completed')
+
+
+class FenwickCounterTests(SimpleTestCase):
+    def test_counts_below_across_resizes(self):
+        counter = FenwickCounter(100, size=4)
+        sequences = [100, 103, 150, 1000, 40]  # grows past the end, then below the base
+        for sequence in sequences:
+            counter.add(sequence, 1)
+        self.assertEqual(counter.total, 5)
+        for probe in (0, 40, 41, 100, 101, 104, 150, 151, 999, 1000, 5000):
+            self.assertEqual(counter.count_below(probe), sum(s < probe for s in sequences), probe)
+
+    def test_removed_members_stop_counting(self):
+        counter = FenwickCounter(1, size=4)
+        for sequence in range(1, 10):
+            counter.add(sequence, 1)
+        counter.add(3, -1)
+        counter.add(20, 1)  # resize after a removal must not bring it back
+        self.assertEqual(counter.total, 9)
+        self.assertEqual(counter.count_below(5), 3)
+        self.assertEqual(counter.count_below(21), 9)
+
+    def test_served_prefix_is_compacted_away(self):
+        counter = FenwickCounter(1)
+        for sequence in range(1, 100_001):
+            counter.add(sequence, 1)
+            if sequence > 10:
+                counter.add(sequence - 10, -1)
+        self.assertEqual(counter.total, 10)
+        # Bounded by the live span, not the 100,000 sequences seen.
+        self.assertLessEqual(len(counter._tree), 4 * FenwickCounter.MIN_SIZE + 1)
+        self.assertEqual(counter.count_below(99_995), 4)
+        self.assertEqual(counter.count_below(50), 0)
+
+
+def _token(pk, priority=0):
+    return WaitingToken(pk, None, pk, priority, None)
+
+
+class ServiceQueueStateTests(SimpleTestCase):
+    def test_serves_by_priority_then_join_order(self):
+        state = ServiceQueueState(1, 0, [_token(1), _token(2, priority=1), _token(3), _token(4, priority=1)])
+        order = []
+        while state.peek() is not None:
+            order.append(state.peek().id)
+            state.remove(state.peek().id)
+        self.assertEqual(order, [2, 4, 1, 3])
+        self.assertEqual(len(state), 0)
+
+    def test_removed_tokens_are_skipped_lazily(self):
+        state = ServiceQueueState(1, 0, [_token(pk) for pk in range(1, 6)])
+        state.remove(1)
+        state.remove(2)
+        self.assertEqual(len(state._heap), 5)  # still in the heap until they reach the top
+        self.assertEqual(state.peek().id, 3)
+        self.assertEqual(len(state._heap), 3)
+        self.assertIsNone(state.position(1))
+
+    def test_readding_with_a_new_priority_moves_the_token(self):
+        state = ServiceQueueState(1, 0, [_token(pk) for pk in range(1, 6)])
+        self.assertEqual(state.position(5), 4)
+        state.add(_token(5, priority=2))
+        self.assertEqual(state.position(5), 0)
+        self.assertEqual(state.position(1), 1)
+        self.assertEqual(state.peek().id, 5)
+        self.assertEqual(len(state), 5)
+
+    def test_positions_match_a_sorted_list(self):
+        rng = random.Random(7)
+        state = ServiceQueueState(1, 0, [])
+        waiting = {}
+        next_id = 1
+        for _ in range(2000):
+            if waiting and rng.random() < 0.4:
+                pk = rng.choice(list(waiting))
+                del waiting[pk]
+                state.remove(pk)
+            else:
+                priority = rng.choice((0, 0, 0, 1, 2))
+                waiting[next_id] = priority
+                state.add(_token(next_id, priority))
+                next_id += 1
+        expected = sorted(waiting, key=lambda pk: (-waiting[pk], pk))
+        self.assertEqual([state.position(pk) for pk in expected], list(range(len(expected))))
+        self.assertEqual(state.peek().id, expected[0])
+
+
+@override_settings(QUEUE_ENGINE_IN_MEMORY=True)
+class QueueEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = Service.objects.create(name='Engine', service_type='bank', location='Main')
+        cls.user = User.objects.create(username='engine', uqid='UQIDTEST-ENGIN1', phone_number='9876500003')
+
+    def setUp(self):
+        queue_engine._engine = None
+        self.addCleanup(setattr, queue_engine, '_engine', None)
+        self.engine = queue_engine.get_engine()
+        self.tokens = [issue_token(self.user, self.service) for _ in range(4)]
+
+    def test_follows_changes_made_through_utils(self):
+        self.assertEqual(self.engine.next_waiting(self.service.pk).pk, self.tokens[0].pk)
+        # on_commit hooks do not run inside TestCase; apply them by hand.
+        with self.captureOnCommitCallbacks(execute=True):
+            serve_next_without_completing(self.service, 1)
+            utils.set_priority(self.tokens[3].pk, 1)
+        self.assertEqual(self.engine.next_waiting(self.service.pk).pk, self.tokens[3].pk)
+        self.assertEqual(self.engine.position(self.service.pk, self.tokens[1].pk), 1)
+        self.assertIsNone(self.engine.position(self.service.pk, self.tokens[0].pk))
+
+    def test_lookups_are_answered_from_memory(self):
+        self.engine.state(self.service.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.engine.position(self.service.pk, self.tokens[2].pk), 2)
+            self.assertEqual(self.engine.next_waiting(self.service.pk).pk, self.tokens[0].pk)
+
+    @override_settings(QUEUE_ENGINE_CHECK_SECONDS=2)
+    def test_rebuilds_after_a_change_it_did_not_see(self):
+        with mock.patch('services.queue_engine.time') as clock:
+            clock.monotonic.return_value = 100
+            state = self.engine.state(self.service.pk)
+            # Another worker serves the head; this process's engine never hears of it.
+            with self.captureOnCommitCallbacks(execute=False):
+                serve_next_without_completing(self.service, 1)
+            self.assertEqual(self.engine.position(self.service.pk, self.tokens[1].pk), 1)
+            clock.monotonic.return_value = 102
+            self.assertEqual(self.engine.next_waiting(self.service.pk).pk, self.tokens[1].pk)
+            self.assertIsNot(self.engine.state(self.service.pk), state)
+
+    def test_out_of_order_apply_drops_the_state(self):
+        state = self.engine.state(self.service.pk)
+        self.engine.apply(self.service.pk, state.version + 2, removed=[self.tokens[0].pk])
+        self.assertNotIn(self.service.pk, self.engine._states)
+        self.assertEqual(self.engine.position(self.service.pk, self.tokens[0].pk), 0)
+
+
+class QueueCountsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.service = Service.objects.create(name='Counts', service_type='bank', location='Main')
+        cls.user = User.objects.create(username='counts', uqid='UQIDTEST-COUNT1', phone_number='9876500004')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_counts_follow_changes_made_elsewhere(self):
+        issue_token(self.user, self.service)
+        self.assertEqual(stats.queue_counts()['totals']['in_queue'], 1)
+        state = stats.queue_state()
+        # A change committed by another process: this process's cache is not cleared.
+        issue_token(self.user, self.service)
+        self.assertNotEqual(stats.queue_state(), state)
+        self.assertEqual(stats.queue_counts()['totals']['in_queue'], 2)
+
+    def test_unchanged_queues_are_answered_from_the_cache(self):
+        issue_token(self.user, self.service)
+        stats.queue_counts()
+        with self.assertNumQueries(1):
+            self.assertEqual(stats.queue_counts()['totals']['total'], 1)
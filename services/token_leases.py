@@ -0,0 +1,155 @@
+"""Per-process token number leases (hi/lo allocation).
+
+Opt-in via ``settings.QUEUE_TOKEN_LEASE_SIZE``. When enabled, each worker
+process reserves a block of token numbers from ``Service.last_token_number``
+in one statement and hands them out locally, so joins only touch the
+service row once per block instead of once per token. The join's own
+transaction then writes only the token row; the queue version, logs and
+rollup follow right after commit (see ``services.utils.issue_token``).
+
+Blocks held by different workers interleave (worker A hands out 1, 2, 3
+while worker B hands out 51, 52), so token numbers no longer reflect join
+order. Service order then comes from the row id, the database's insert
+sequence (see ``queue_system.models.dispatch_sequence_field``).
+
+Leases are taken and given back in their own transactions, outside the
+transaction of the join, so a join that rolls back never un-leases a block
+the process keeps handing out; its number just becomes a gap.
+
+Unused numbers are given back once a lease has been idle (no token issued
+from it) for ``QUEUE_TOKEN_LEASE_TIMEOUT`` seconds, or when the process
+exits, provided no other worker has leased past them in the meantime;
+otherwise they simply become gaps. A busy lease never times out. There is no
+background reaper: idle leases of every service are given back the next time
+the process issues a token for any service, so a process that stops issuing
+tokens altogether holds its leases until it exits.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Service
+
+logger = logging.getLogger(__name__)
+
+
+class _Lease:
+    __slots__ = ('next', 'hi', 'expires_at')
+
+    def __init__(self, lo, hi, expires_at):
+        self.next = lo
+        self.hi = hi
+        self.expires_at = expires_at
+
+
+class TokenLeasePool:
+    """Token number leases held by the current process, keyed by service id."""
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self._leases = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def next_token(self, service_id):
+        """Return the next token number for ``service_id``, leasing a new block if needed.
+
+        Must be called outside any transaction (see ``_acquire``). Each call
+        keeps the lease for another ``timeout`` seconds, and gives back the
+        leases of every service that have been idle longer.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._release_expired(now)
+            lease = self._leases.get(service_id)
+            if lease is None or lease.next > lease.hi:
+                lease = self._acquire(service_id, now)
+            token = lease.next
+            lease.next += 1
+            lease.expires_at = now + self.timeout
+            return token
+
+    def discard(self, service_id):
+        """Drop the lease for a service without giving numbers back (e.g. after a collision)."""
+        with self._lock:
+            self._leases.pop(service_id, None)
+
+    def release_all(self):
+        """Give back the unused part of every lease. Registered to run at process exit."""
+        if os.getpid() != self._pid:
+            # Inherited atexit hook in a forked child: the leases are not ours.
+            return
+        with self._lock:
+            for service_id, lease in list(self._leases.items()):
+                try:
+                    self._release(service_id, lease)
+                except Exception:
+                    logger.exception('Failed to release token lease for service %s', service_id)
+            self._leases.clear()
+
+    def _release_expired(self, now):
+        for service_id, lease in list(self._leases.items()):
+            if lease.expires_at > now:
+                continue
+            try:
+                self._release(service_id, lease)
+            except Exception:
+                # Keep the lease and try again on the next call.
+                logger.exception('Failed to release token lease for service %s', service_id)
+
+    def _acquire(self, service_id, now):
+        from .utils import allocate_token_numbers
+
+        # Commits on its own: inside an atomic block this would only be a
+        # savepoint, and a rollback of the caller would hand the same block to
+        # another worker while this process keeps using it.
+        if transaction.get_connection().in_atomic_block:
+            raise RuntimeError('Token leases must be acquired outside a transaction')
+        with transaction.atomic():
+            hi = allocate_token_numbers(service_id, self.size)
+        lease = _Lease(hi - self.size + 1, hi, now + self.timeout)
+        self._leases[service_id] = lease
+        return lease
+
+    def _release(self, service_id, lease):
+        if lease.next <= lease.hi:
+            # Only rewind the counter if nobody has leased past our block.
+            Service.objects.filter(pk=service_id, last_token_number=lease.hi).update(
+                last_token_number=lease.next - 1
+            )
+        self._leases.pop(service_id, None)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return this process's lease pool, or None when leasing is disabled.
+
+    The pool is recreated after a fork so a preloaded parent's leases are
+    never shared between workers.
+    """
+    global _pool, _pool_pid
+    size = getattr(settings, 'QUEUE_TOKEN_LEASE_SIZE', 0)
+    if size <= 1:
+        return None
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = TokenLeasePool(size, getattr(settings, 'QUEUE_TOKEN_LEASE_TIMEOUT', 60))
+                _pool_pid = pid
+                atexit.register(_pool.release_all)
+    return _pool
+
+
+def leasing_enabled():
+    return getattr(settings, 'QUEUE_TOKEN_LEASE_SIZE', 0) > 1
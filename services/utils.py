@@ -1,166 +1,370 @@
+from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
-from django.db.models import Max
+from django.db.models import F, Max
 from django.db import IntegrityError
-from django.core.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
 
-from .models import Service
-from queue_system.models import Queue
+from .models import Service, ServiceQueueVersion
+from .eta import estimate_wait_minutes, record_service_time
+from .stats import record_daily_stats, transition_deltas
+from .sketches import record_samples, transition_samples
+from queue_system.models import (
+    Queue, ahead_of, dispatch_key, dispatch_sequence_field, set_skip_reason, waiting_order,
+)
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
-def issue_token(user, service):
-    """Issue the next sequential token for a service safely using a DB lock.
+def allocate_token_numbers(service_id, count=1):
+    """Advance ``Service.last_token_number`` by ``count`` and return the new value.
 
-    Returns the created Queue instance.
+    The increment is a single ``UPDATE ... SET last_token_number = last_token_number + n``
+    so the database serialises concurrent callers on the service row without a
+    separate ``SELECT ... FOR UPDATE``. The read that follows runs in the same
+    transaction, after our UPDATE, so it always sees our own increment.
+    Numbers ``value - count + 1 .. value`` belong to the caller.
     """
-    # Try to create a token in a transaction, using the maximum of stored last_token_number
-    # and any existing token_number in the DB to avoid duplicates when inconsistencies exist.
     with transaction.atomic():
-        svc = Service.objects.select_for_update().get(pk=service.pk)
+        updated = Service.objects.filter(pk=service_id).update(
+            last_token_number=F('last_token_number') + count
+        )
+        if not updated:
+            raise Service.DoesNotExist(f'Service {service_id} does not exist')
+        return Service.objects.filter(pk=service_id).values_list('last_token_number', flat=True).get()
+
+
+def _resync_last_token_number(service_id):
+    """Raise ``last_token_number`` to the highest issued token if it fell behind.
+
+    Only used as a fallback when a token insert collides; it is the one place
+    that still aggregates over the service's token history.
+    """
+    agg = Queue.objects.filter(service_id=service_id).aggregate(max_token=Max('token_number'))
+    max_token = agg.get('max_token') or 0
+    Service.objects.filter(pk=service_id, last_token_number__lt=max_token).update(last_token_number=max_token)
+
+
+def _bump_queue_version(service_id):
+    """Add one to the service's queue version, creating its row on the first change."""
+    versions = ServiceQueueVersion.objects.filter(service_id=service_id)
+    if versions.update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            ServiceQueueVersion.objects.create(service_id=service_id, version=1)
+    except IntegrityError:
+        # Created concurrently; bump it instead.
+        versions.update(version=F('version') + 1)
+
+
+# Prune a service's change log once every this many versions.
+_CHANGE_LOG_PRUNE_EVERY = 100
+
+
+def _queue_changed(service_id, added=(), removed=(), reordered=False, changed=(), skipped=(), reprioritized=()):
+    """Record that a service's queue changed inside the current transaction.
+
+    Callers do this as their last statement. It bumps the service's
+    ``ServiceQueueVersion``, appends to the logs under the new version, and
+    ends with the ``ServiceDailyStats`` rollup and the timing histograms, so
+    the per-service rows are locked only from here until commit (joins under
+    token leasing call it after commit instead, see ``issue_token``).
+    ``changed`` are the Queue instances whose status changed, written to the
+    ``QueueChange`` log (a reorder logs a reset instead). Every transition,
+    including skips (ids in ``skipped``), priority changes (``reprioritized``
+    instances) and reorders, is appended to the ``QueueEvent`` log, and status
+    changes are published as SMS notices after commit (if enabled). ``added`` and
+    ``removed`` are the Queue instances / ids entering or leaving the waiting
+    set, applied to the in-process engine (if enabled) once the transaction
+    commits.
+    """
+    from .queue_engine import get_engine
+    from notifications.lifecycle import publish_on_commit
+
+    _bump_queue_version(service_id)
+    publish_on_commit(service_id, changed, skipped)
+    engine = get_engine()
+    if engine is not None or changed or reordered or reprioritized:
+        _log_change(service_id, engine, added, removed, reordered, changed, skipped, reprioritized)
+    record_daily_stats(service_id, transition_deltas(changed))
+    record_samples(service_id, transition_samples(changed))
+
+
+def _log_change(service_id, engine, added, removed, reordered, changed, skipped, reprioritized):
+    """Append a change to the event and change logs and queue it for the in-process engine."""
+    from .queue_engine import WaitingToken
+    from queue_system.events import transition_events
+    from queue_system.models import QueueChange, QueueEvent
+
+    version = ServiceQueueVersion.objects.filter(service_id=service_id).values_list('version', flat=True).get()
+    QueueEvent.objects.bulk_create(
+        transition_events(service_id, version, changed, skipped, reprioritized, reordered)
+    )
+    if reordered:
+        changes = [QueueChange(service_id=service_id, version=version, status=QueueChange.RESET)]
+    else:
+        changes = [
+            QueueChange(service_id=service_id, version=version, queue_id=q.pk, token_number=q.token_number, status=q.status)
+            for q in changed
+        ]
+    if changes:
+        QueueChange.objects.bulk_create(changes)
+        if version % _CHANGE_LOG_PRUNE_EVERY == 0:
+            keep = getattr(settings, 'QUEUE_CHANGE_LOG_SIZE', 500)
+            QueueChange.objects.filter(service_id=service_id, version__lte=version - keep).delete()
+    if engine is None:
+        return
+    if reordered:
+        transaction.on_commit(lambda: engine.invalidate(service_id))
+        return
+    tokens = [WaitingToken.from_queue(q) for q in added]
+    removed = list(removed)
+    transaction.on_commit(lambda: engine.apply(service_id, version, added=tokens, removed=removed))
+
 
-        # Get current max token for the service from DB
-        agg = Queue.objects.filter(service=svc).aggregate(max_token=Max('token_number'))
-        max_token = agg.get('max_token') or 0
+def issue_token(user, service):
+    """Issue the next sequential token for a service.
 
-        base = max(svc.last_token_number or 0, max_token)
-        next_token = base + 1
+    The token number comes from an atomic increment of ``Service.last_token_number``,
+    so a join costs the same no matter how many tokens the service has issued.
+    Under token leasing it comes from this process's block and the join's
+    transaction writes only the token row (see ``_record_join``).
+    Returns the created Queue instance.
+    """
+    from . import token_leases
 
-        # Update the service last_token_number to the new value
-        svc.last_token_number = next_token
-        svc.save(update_fields=["last_token_number"])
+    pool = token_leases.get_pool()
+    # Leased blocks must be committed independently of the token insert, so
+    # the number is taken before the token transaction opens (a failed join
+    # then only leaves a gap), and leasing is skipped when the caller already
+    # holds a transaction.
+    use_lease = pool is not None and not transaction.get_connection().in_atomic_block
+    leased_token = pool.next_token(service.pk) if use_lease else None
 
-        # Create the queue entry. Wrap in try/except to handle rare race that still
-        # results in an IntegrityError, in which case retry once.
+    with transaction.atomic():
+        next_token = leased_token if use_lease else allocate_token_numbers(service.pk)
         try:
+            # Savepoint so a collision does not poison the outer transaction.
+            with transaction.atomic():
+                queue = Queue.objects.create(
+                    user=user,
+                    service=service,
+                    token_number=next_token,
+                    status='waiting'
+                )
+        except IntegrityError:
+            # The counter is behind the stored tokens (e.g. rows inserted outside
+            # issue_token). Resync it from the table and retry once; a second
+            # failure is raised to the caller.
+            if use_lease:
+                pool.discard(service.pk)
+            _resync_last_token_number(service.pk)
+            next_token = allocate_token_numbers(service.pk)
             queue = Queue.objects.create(
                 user=user,
                 service=service,
                 token_number=next_token,
                 status='waiting'
             )
-        except (IntegrityError, ValidationError):
-            # Another process inserted the same token_number concurrently. Retry once.
-            # Note: This should be exceedingly rare because we locked Service, but
-            # extra safety ensures we do not raise a ValidationError to the user.
-            transaction.set_rollback(False)
-            # Recompute next token and try again
-            svc = Service.objects.select_for_update().get(pk=service.pk)
-            agg = Queue.objects.filter(service=svc).aggregate(max_token=Max('token_number'))
-            max_token = agg.get('max_token') or 0
-            next_token = max(svc.last_token_number or 0, max_token) + 1
-            svc.last_token_number = next_token
-            svc.save(update_fields=["last_token_number"])
-            # second attempt - if this also fails it will raise to caller
-            queue = Queue.objects.create(
-                user=user,
-                service=service,
-                token_number=next_token,
-                status='waiting'
-            )
+        if use_lease:
+            # Keep the join off every per-service row: the version, logs and
+            # rollup are written right after commit, in their own transaction.
+            transaction.on_commit(lambda: _record_join(service.pk, queue), robust=True)
+        else:
+            _queue_changed(service.pk, added=[queue], changed=[queue])
 
     return queue
 
 
-def complete_current_and_serve_next(service):
-    """Complete the currently serving token (if any) and serve the next waiting token.
+def _record_join(service_id, queue):
+    """Record a join committed under token leasing.
 
-    Ensures only one token per service is in 'serving' state by using transactions and
-    row-level locks on the Queue rows and Service row.
-    Returns a tuple (completed_queue, next_queue) where either may be None.
+    Runs after the token commits, so for a moment pollers can see the token
+    under the previous queue version, and if this fails (it is logged) the
+    version only moves on with the service's next change.
     """
     with transaction.atomic():
-        svc = Service.objects.select_for_update().get(pk=service.pk)
+        _queue_changed(service_id, added=[queue], changed=[queue])
 
-        # Close out the currently serving token (if any)
-        current = (
-            Queue.objects.select_for_update()
-            .filter(service=svc, status='serving')
-            .order_by('token_number')
-            .first()
-        )
 
-        completed = None
-        if current:
-            current.status = 'completed'
-            now = timezone.now()
-            current.service_end_time = now
-            current.completed_at = now
-            current.save()
-            completed = current
+# Attempts to claim a waiting token before giving up when other workers keep
+# winning the race for the same candidate.
+_SERVE_ATTEMPTS = 3
 
-        # If the service is paused, do not assign a new serving token
-        if svc.paused:
-            return (completed, None)
-
-        # Pick the next waiting token in order. Consider priority_level first (higher first),
-        # then ascending token_number to keep FIFO among same priority.
-        next_q = (
-            Queue.objects.select_for_update()
-            .filter(service=svc, status='waiting')
-            .order_by('-priority_level', 'token_number')
-            .first()
-        )
 
-        if next_q:
-            now = timezone.now()
-            next_q.status = 'serving'
-            next_q.service_start_time = now
-            next_q.served_at = now
-            next_q.save()
+def _transition(queue, from_status, to_status, **fields):
+    """Compare-and-set a token from ``from_status`` to ``to_status``.
+
+    Applies the change as one ``UPDATE ... WHERE id = %s AND status = %s`` and
+    reports success from the affected-row count, so no row locks are taken.
+    On success the in-memory instance is updated to match.
+    """
+    changes = dict(fields, status=to_status)
+    applied = Queue.objects.filter(pk=queue.pk, status=from_status).update(**changes) == 1
+    if applied:
+        for name, value in changes.items():
+            setattr(queue, name, value)
+    return applied
+
+
+def _next_waiting(service_id, engine=None):
+    if engine is not None:
+        return engine.next_waiting(service_id)
+    return Queue.objects.filter(service_id=service_id, status='waiting').order_by(*waiting_order()).first()
 
-        return (completed, next_q)
 
+def _check_counter(service, counter_number):
+    if not 1 <= counter_number <= max(service.num_counters, 1):
+        raise ValueError(f'Counter {counter_number} does not exist for {service.name}')
 
-def serve_next_without_completing(service):
-    """Mark the next waiting token as serving without changing current serving token.
 
-    Use-case: when no current serving token exists but admin requests to serve next.
+def _serve_next(service_id, counter_number):
+    """Move the next waiting token to serving at ``counter_number``. Returns it, or None.
+
+    Returns None when nothing is waiting or the counter is already serving a
+    token (the ``one_serving_token_per_counter`` constraint rejects the update).
+    Counters only contend with each other for the same waiting candidate.
     """
-    with transaction.atomic():
-        svc = Service.objects.select_for_update().get(pk=service.pk)
-        if svc.paused:
+    from .queue_engine import get_engine
+
+    engine = get_engine()
+    for _ in range(_SERVE_ATTEMPTS):
+        candidate = _next_waiting(service_id, engine)
+        if candidate is None:
             return None
+        now = timezone.now()
+        try:
+            # Savepoint so a constraint violation leaves the transaction usable.
+            with transaction.atomic():
+                if _transition(candidate, 'waiting', 'serving', counter_number=counter_number,
+                               service_start_time=now):
+                    return candidate
+        except IntegrityError:
+            return None
+        # Another counter claimed or someone cancelled the candidate; pick again.
+        if engine is not None:
+            # The in-memory order was stale; fall back to the database from here on.
+            engine.invalidate(service_id)
+            engine = None
+    return None
+
 
-        # Ensure no other token is serving
-        existing = Queue.objects.filter(service=svc, status='serving').exists()
-        if existing:
+def _finish(queue, to_status, **fields):
+    """Move a token to ``completed``/``cancelled`` from whatever active state it is in.
+
+    Returns the status it was in before, or None if it was already finished.
+    """
+    for _ in range(_SERVE_ATTEMPTS):
+        previous = queue.status
+        if previous not in ('waiting', 'serving'):
             return None
+        now = timezone.now()
+        if _transition(queue, previous, to_status, service_end_time=now, **fields):
+            if previous == 'serving' and to_status == 'completed':
+                record_service_time(queue.service_id, queue.service_start_time, now)
+            return previous
+        queue.refresh_from_db(fields=['status'])
+    return None
 
-        next_q = (
-            Queue.objects.select_for_update()
-            .filter(service=svc, status='waiting')
-            .order_by('-priority_level', 'token_number')
-            .first()
-        )
 
+def complete_current_and_serve_next(service, counter_number=1):
+    """Complete the token serving at ``counter_number`` (if any) and serve the next waiting token there.
+
+    Each step is a conditional UPDATE (see ``_transition``) scoped to one
+    counter, so calls for different counters of the same service do not block
+    each other.
+    Returns a tuple (completed_queue, next_queue) where either may be None.
+    """
+    _check_counter(service, counter_number)
+    with transaction.atomic():
+        completed = None
+        current = Queue.objects.filter(
+            service_id=service.pk, status='serving', counter_number=counter_number
+        ).first()
+        if current and _finish(current, 'completed') == 'serving':
+            completed = current
+
+        # If the service is paused, do not assign a new serving token
+        next_q = None if service.paused else _serve_next(service.pk, counter_number)
+        if completed or next_q:
+            _queue_changed(
+                service.pk,
+                removed=[next_q.pk] if next_q else (),
+                changed=[q for q in (completed, next_q) if q],
+            )
+        return (completed, next_q)
+
+
+def free_counters(service):
+    """Return the counter numbers of ``service`` that are not serving anyone."""
+    busy = set(
+        Queue.objects.filter(service_id=service.pk, status='serving').values_list('counter_number', flat=True)
+    )
+    return [n for n in range(1, max(service.num_counters, 1) + 1) if n not in busy]
+
+
+def serve_next_without_completing(service, counter_number=None):
+    """Mark the next waiting token as serving without completing anything.
+
+    Serves at ``counter_number``, or at the first free counter when omitted.
+    Returns None if the service is paused, nothing is waiting or no counter is free.
+    """
+    if service.paused:
+        return None
+    if counter_number is None:
+        free = free_counters(service)
+        if not free:
+            return None
+        counter_number = free[0]
+    else:
+        _check_counter(service, counter_number)
+    with transaction.atomic():
+        next_q = _serve_next(service.pk, counter_number)
         if next_q:
-            now = timezone.now()
-            next_q.status = 'serving'
-            next_q.service_start_time = now
-            next_q.served_at = now
-            next_q.save()
+            _queue_changed(service.pk, removed=[next_q.pk], changed=[next_q])
         return next_q
 
 
+def _left_waiting(queue, previous, next_q):
+    """Ids that left the waiting set when ``queue`` finished from ``previous`` and ``next_q`` was served."""
+    ids = [queue.pk] if previous == 'waiting' else []
+    if next_q:
+        ids.append(next_q.pk)
+    return ids
+
+
+def complete_token(queue):
+    """Complete a specific token. If it was serving, serve the next one at its counter.
+
+    Returns (completed_queue, next_served_queue)
+    """
+    with transaction.atomic():
+        counter_number = queue.counter_number
+        previous = _finish(queue, 'completed')
+        next_q = None
+        if previous == 'serving' and not queue.service.paused:
+            next_q = _serve_next(queue.service_id, counter_number)
+        if previous:
+            _queue_changed(
+                queue.service_id,
+                removed=_left_waiting(queue, previous, next_q),
+                changed=[q for q in (queue, next_q) if q],
+            )
+        return (queue, next_q)
+
+
 def skip_token(queue_id, admin_user=None, reason=None):
     """Skip (cancel) a token and if it was serving, serve the next one.
 
     Returns (skipped_queue, next_served_queue)
     """
     with transaction.atomic():
-        q = Queue.objects.select_for_update().get(pk=queue_id)
-        was_serving = q.status == 'serving'
-        q.status = 'cancelled'
-        now = timezone.now()
-        q.service_end_time = now
-        q.completed_at = now
-        if reason:
-            q.skip_reason = reason
-        q.save()
+        q = Queue.objects.select_related('service').get(pk=queue_id)
+        previous = _finish(q, 'cancelled')
+        if previous and reason:
+            set_skip_reason(q, reason)
 
         # Log admin action if provided (import locally to avoid circular imports)
         if admin_user:
@@ -174,9 +378,16 @@ def skip_token(queue_id, admin_user=None, reason=None):
             )
 
         next_q = None
-        if was_serving:
-            # serve next if any
-            _, next_q = complete_current_and_serve_next(q.service)
+        if previous == 'serving' and not q.service.paused:
+            # serve next at the freed counter, if anyone is waiting
+            next_q = _serve_next(q.service_id, q.counter_number)
+        if previous:
+            _queue_changed(
+                q.service_id,
+                removed=_left_waiting(q, previous, next_q),
+                changed=[x for x in (q, next_q) if x],
+                skipped=[q.pk] if reason else (),
+            )
 
         return (q, next_q)
 
@@ -195,10 +406,15 @@ def reorder_queue(service, ordered_queue_ids, admin_user=None, reason=None):
     This operation should only be used when the service is paused.
     It will reassign token_number sequentially following the provided order.
     """
+    from . import token_leases
+
     with transaction.atomic():
         svc = Service.objects.select_for_update().get(pk=service.pk)
         if not svc.paused:
             raise ValueError('Service must be paused to reorder tokens')
+        if token_leases.leasing_enabled():
+            # Service order follows the row id under leasing, so renumbering would not reorder.
+            raise ValueError('Reordering is not supported while token leasing is enabled')
 
         # Fetch current waiting queues for the service
         queues = list(Queue.objects.select_for_update().filter(service=svc, status='waiting'))
@@ -226,21 +442,91 @@ def reorder_queue(service, ordered_queue_ids, admin_user=None, reason=None):
                 reason=reason
             )
 
+        _queue_changed(svc.pk, reordered=True)
         return True
 
 
-def pause_service(service_id):
+def set_priority(queue_id, priority_level, admin_user=None, reason=None):
+    """Change a waiting token's priority level (higher is served earlier).
+
+    Returns the updated Queue instance.
+    """
+    with transaction.atomic():
+        q = Queue.objects.select_related('service').get(pk=queue_id)
+        if not _transition(q, 'waiting', 'waiting', priority_level=priority_level):
+            raise ValueError('Only waiting tokens can change priority')
+
+        if admin_user:
+            from admin_panel.models import AuditLog
+            AuditLog.objects.create(
+                user=admin_user,
+                service=q.service,
+                action='priority',
+                target_queue=q,
+                reason=reason
+            )
+
+        # Re-adding a token to the engine moves it to its new place.
+        _queue_changed(q.service_id, added=[q], reprioritized=[q])
+        return q
+
+
+def _set_paused(service_id, paused):
     svc = get_object_or_404(Service, pk=service_id)
-    svc.paused = True
-    svc.save(update_fields=['paused'])
+    with transaction.atomic():
+        Service.objects.filter(pk=svc.pk).update(paused=paused)
+        _queue_changed(svc.pk)
+    svc.paused = paused
     return svc
 
 
+def pause_service(service_id):
+    return _set_paused(service_id, True)
+
+
 def resume_service(service_id):
-    svc = get_object_or_404(Service, pk=service_id)
-    svc.paused = False
-    svc.save(update_fields=['paused'])
-    return svc
+    return _set_paused(service_id, False)
+
+
+def queue_changes_since(service, since):
+    """Token changes of ``service`` between version ``since`` and ``service.queue_version``.
+
+    ``service`` comes from ``Service.objects.with_queue_version()``.
+
+    Returns ``{'changed': [...], 'removed': [...]}`` with each token's latest
+    state: waiting/serving tokens as ``(token_number, status, user_uqid)`` and
+    finished tokens as token numbers. Returns None when the change log cannot
+    answer (the client is too far behind, the log does not reach back that far,
+    or the list was reordered) and the caller should send a full snapshot.
+    """
+    from queue_system.models import QueueChange
+
+    current = service.queue_version
+    if since == current:
+        return {'changed': [], 'removed': []}
+    if since > current or since < current - getattr(settings, 'QUEUE_CHANGE_LOG_SIZE', 500):
+        return None
+    log = QueueChange.objects.filter(service=service)
+    # Versions from before the log was written, or already pruned, leave gaps.
+    if not log.filter(version__lte=since).exists():
+        return None
+    rows = log.filter(version__gt=since, version__lte=current).order_by('version', 'id').values_list(
+        'token_number', 'status', 'queue__user__uqid'
+    )
+    latest = {}
+    for token, status, uqid in rows:
+        if status == QueueChange.RESET:
+            return None
+        latest[token] = (status, uqid)
+    changed = []
+    removed = []
+    for token in sorted(latest):
+        status, uqid = latest[token]
+        if status in ('waiting', 'serving'):
+            changed.append((token, status, uqid if status == 'serving' else None))
+        else:
+            removed.append(token)
+    return {'changed': changed, 'removed': removed}
 
 
 def get_queue_eta(queue_id):
@@ -250,40 +536,114 @@ def get_queue_eta(queue_id):
         'queue_id': int,
         'token_number': int,
         'status': str,
-        'tokens_ahead': int,
+        'tokens_ahead': int,     # waiting_ahead + serving_ahead, what the ETA is based on
+        'waiting_ahead': int,    # waiting tokens served before this one
+        'serving_ahead': int,    # 1 if a token is being served ahead of this one, else 0
         'eta_minutes': int,
         'current_serving': int|None,
     }
     """
-    q = get_object_or_404(Queue, pk=queue_id)
+    q = get_object_or_404(Queue.objects.select_related('service'), pk=queue_id)
+    return queue_eta(q)
+
+
+def queue_eta(q):
+    """ETA information (see ``get_queue_eta``) for an already loaded Queue instance."""
+    from .queue_engine import get_engine
+
     svc = q.service
 
-    # Count waiting tokens with smaller token_number
-    tokens_ahead = (
-        Queue.objects.filter(service=svc, status='waiting', token_number__lt=q.token_number)
-        .count()
+    # Waiting tokens served before this one, in true dispatch order (priority
+    # first). Answered from the in-memory rank index when the engine is enabled.
+    tokens_ahead = 0
+    if q.status == 'waiting':
+        engine = get_engine()
+        position = engine.position(svc.pk, q.pk) if engine is not None else None
+        if position is None:
+            position = Queue.objects.filter(service=svc, status='waiting').filter(ahead_of(q)).count()
+        tokens_ahead = position
+
+    serving = list(
+        Queue.objects.filter(service=svc, status='serving').order_by('token_number').values_list('token_number', flat=True)
     )
+    return _eta_info(svc, q.pk, q.token_number, q.status, tokens_ahead, serving)
 
-    # If there is a current serving token with token_number < q.token_number,
-    # then that token contributes to waiting time as well.
-    current_serving = (
-        Queue.objects.filter(service=svc, status='serving').order_by('token_number').first()
-    )
 
-    if current_serving and current_serving.token_number < q.token_number:
+def _eta_info(svc, queue_id, token_number, status, tokens_ahead, serving):
+    """Build the ETA dict from a token's waiting position and the service's serving token numbers (sorted)."""
+    current_serving = serving[0] if serving else None
+
+    # A token being served ahead of this one contributes to waiting time as well.
+    if status == 'waiting' and current_serving is not None and current_serving < token_number:
         extra = 1
     else:
         extra = 0
 
     total_ahead = tokens_ahead + extra
 
-    eta_minutes = total_ahead * (svc.avg_service_time or 5)
+    eta_minutes = estimate_wait_minutes(svc, total_ahead, active_counters=len(serving))
 
     return {
-        'queue_id': q.pk,
-        'token_number': q.token_number,
-        'status': q.status,
+        'queue_id': queue_id,
+        'token_number': token_number,
+        'status': status,
         'tokens_ahead': total_ahead,
+        'waiting_ahead': tokens_ahead,
+        'serving_ahead': extra,
         'eta_minutes': eta_minutes,
-        'current_serving': current_serving.token_number if current_serving else None,
+        'current_serving': current_serving,
     }
+
+
+def get_bulk_queue_eta(queue_ids=None, service_id=None, user=None):
+    """ETA information (see ``get_queue_eta``) for many tokens from one snapshot.
+
+    Pass ``queue_ids`` for specific tokens or ``service_id`` for every active
+    token of a service; ``user`` restricts the answer to that user's tokens.
+    Positions are computed in Python from a single read of the services'
+    waiting and serving tokens, so the cost is two queries however many
+    tokens are asked for. Unknown or filtered-out ids are left out.
+    """
+    seq_field = dispatch_sequence_field()
+    fields = ('id', 'service_id', 'token_number', 'status', 'priority_level', seq_field)
+
+    if service_id is not None:
+        services = {svc.pk: svc for svc in Service.objects.filter(pk=service_id)}
+    else:
+        targets = Queue.objects.filter(pk__in=queue_ids).select_related('service')
+        if user is not None:
+            targets = targets.filter(user=user)
+        targets = list(targets)
+        services = {q.service_id: q.service for q in targets}
+    if not services:
+        return []
+
+    # The snapshot: every active token of the services involved.
+    snapshot = Queue.objects.filter(service_id__in=services, status__in=['waiting', 'serving'])
+    rows = list(snapshot.values_list(*fields, 'user_id'))
+
+    waiting = {}
+    serving = {sid: [] for sid in services}
+    for row in rows:
+        if row[3] == 'serving':
+            serving[row[1]].append(row[2])
+        else:
+            waiting.setdefault(row[1], []).append(row)
+    positions = {}
+    for sid, tokens in waiting.items():
+        tokens.sort(key=lambda r: dispatch_key(r[4], r[5]))
+        positions.update((r[0], i) for i, r in enumerate(tokens))
+    for tokens in serving.values():
+        tokens.sort()
+
+    if service_id is not None:
+        targets = [r for r in rows if user is None or r[6] == user.pk]
+        targets.sort(key=lambda r: r[2])
+        answer = [(r[0], r[1], r[2], r[3]) for r in targets]
+    else:
+        answer = [(q.pk, q.service_id, q.token_number, q.status) for q in targets]
+
+    return [
+        _eta_info(services[sid], qid, token, status, positions.get(qid, 0) if status == 'waiting' else 0, serving[sid])
+        for qid, sid, token, status in answer
+    ]
@@ -126,4 +126,90 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
 STATIC_URL = 'static/'
-STATIC_ROOT = BASE_DIR / 'staticfiles'
\ No newline at end of file
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+
+# Queue token allocation
+# When greater than 1, each worker process leases blocks of this many token
+# numbers per service instead of incrementing the counter on every join.
+QUEUE_TOKEN_LEASE_SIZE = int(os.environ.get('QUEUE_TOKEN_LEASE_SIZE', '0'))
+# Seconds before an idle lease's unused numbers are given back.
+QUEUE_TOKEN_LEASE_TIMEOUT = int(os.environ.get('QUEUE_TOKEN_LEASE_TIMEOUT', '60'))
+
+# Keep each service's waiting tokens in an in-process priority heap for
+# dispatch decisions instead of ordering them in the database per request.
+QUEUE_ENGINE_IN_MEMORY = os.environ.get('QUEUE_ENGINE_IN_MEMORY', '').lower() in ('1', 'true', 'yes')
+# Seconds the in-memory state answers positions and picks the next token
+# without checking the database for other workers' changes (0 checks on
+# every lookup).
+QUEUE_ENGINE_CHECK_SECONDS = float(os.environ.get('QUEUE_ENGINE_CHECK_SECONDS', '2'))
+
+# Live queue updates (Server-Sent Events, served under ASGI).
+# How often the shared watcher checks services for queue changes.
+QUEUE_STREAM_POLL_SECONDS = float(os.environ.get('QUEUE_STREAM_POLL_SECONDS', '1'))
+# Keep-alive comment interval, and how long one stream lives before the browser reconnects.
+QUEUE_STREAM_HEARTBEAT_SECONDS = int(os.environ.get('QUEUE_STREAM_HEARTBEAT_SECONDS', '15'))
+QUEUE_STREAM_MAX_SECONDS = int(os.environ.get('QUEUE_STREAM_MAX_SECONDS', '300'))
+
+# Versions of per-service queue changes kept for queue_api deltas (?since=);
+# clients further behind get a full snapshot.
+QUEUE_CHANGE_LOG_SIZE = int(os.environ.get('QUEUE_CHANGE_LOG_SIZE', '500'))
+
+# Seconds the dashboards' grouped queue counts are cached. The cache key moves
+# with every queue change (see services.stats), so this only bounds how long
+# unused copies are kept.
+QUEUE_STATS_CACHE_SECONDS = int(os.environ.get('QUEUE_STATS_CACHE_SECONDS', '30'))
+
+# Finished tokens older than this many days are moved from the live queue
+# table to the history table by `manage.py archive_queue_history`.
+QUEUE_ARCHIVE_AFTER_DAYS = float(os.environ.get('QUEUE_ARCHIVE_AFTER_DAYS', '30'))
+
+# SMS outbox (notifications/outbox.py). By default every process that queues
+# messages also sends them from a background thread with a few threads of
+# its own. Deployments that run `manage.py sms_worker` as a separate process
+# can turn that off.
+SMS_SEND_IN_PROCESS = os.environ.get('SMS_SEND_IN_PROCESS', '1').lower() in ('1', 'true', 'yes')
+SMS_IN_PROCESS_THREADS = int(os.environ.get('SMS_IN_PROCESS_THREADS', '2'))
+# How often the in-process sender looks for retries that have come due.
+SMS_IN_PROCESS_POLL_SECONDS = float(os.environ.get('SMS_IN_PROCESS_POLL_SECONDS', '15'))
+# `manage.py sms_worker`: provider calls in flight per worker, and messages
+# claimed per round.
+SMS_WORKER_THREADS = int(os.environ.get('SMS_WORKER_THREADS', '4'))
+SMS_WORKER_BATCH_SIZE = int(os.environ.get('SMS_WORKER_BATCH_SIZE', '50'))
+SMS_WORKER_POLL_SECONDS = float(os.environ.get('SMS_WORKER_POLL_SECONDS', '1'))
+# Sends per message before it is marked failed; retries back off
+# exponentially from the base delay up to the maximum.
+SMS_MAX_ATTEMPTS = int(os.environ.get('SMS_MAX_ATTEMPTS', '5'))
+SMS_RETRY_BASE_SECONDS = float(os.environ.get('SMS_RETRY_BASE_SECONDS', '30'))
+SMS_RETRY_MAX_SECONDS = float(os.environ.get('SMS_RETRY_MAX_SECONDS', '3600'))
+# A message still marked sending after this long (its worker died) is sent again.
+SMS_CLAIM_TIMEOUT_SECONDS = int(os.environ.get('SMS_CLAIM_TIMEOUT_SECONDS', '300'))
+# Provider calls per second, and the burst allowed above it. The limit is for
+# all processes together (every web process's in-process sender and every
+# sms_worker): they take from one token bucket kept in the database.
+SMS_RATE_PER_SECOND = float(os.environ.get('SMS_RATE_PER_SECOND', '10'))
+SMS_RATE_BURST = int(os.environ.get('SMS_RATE_BURST', '10'))
+
+# SMS provider connection, shared by all sending threads of a process.
+# Base URL override for the provider's REST API (e.g. a local test double).
+SMS_API_BASE_URL = os.environ.get('SMS_API_BASE_URL', '')
+# Keep-alive connections kept open to the provider (match SMS_WORKER_THREADS).
+SMS_HTTP_POOL_SIZE = int(os.environ.get('SMS_HTTP_POOL_SIZE', str(SMS_WORKER_THREADS)))
+SMS_HTTP_CONNECT_TIMEOUT = float(os.environ.get('SMS_HTTP_CONNECT_TIMEOUT', '3'))
+SMS_HTTP_READ_TIMEOUT = float(os.environ.get('SMS_HTTP_READ_TIMEOUT', '10'))
+# After this many consecutive failed calls, stop calling the provider for
+# SMS_CIRCUIT_RESET_SECONDS, then try one message before resuming.
+SMS_CIRCUIT_FAILURES = int(os.environ.get('SMS_CIRCUIT_FAILURES', '5'))
+SMS_CIRCUIT_RESET_SECONDS = float(os.environ.get('SMS_CIRCUIT_RESET_SECONDS', '30'))
+
+# Automatic SMS for token lifecycle events, queued in the outbox after each
+# queue change commits (see notifications/lifecycle.py). Off by default.
+SMS_AUTO_NOTIFY = os.environ.get('SMS_AUTO_NOTIFY', '').lower() in ('1', 'true', 'yes')
+# Which events are sent (token_created, token_near, token_next, token_serving,
+# token_skipped, token_cancelled, token_completed).
+SMS_AUTO_NOTIFY_EVENTS = os.environ.get(
+    'SMS_AUTO_NOTIFY_EVENTS', 'token_created,token_near,token_next,token_serving,token_skipped,token_cancelled'
+).split(',')
+# Waiting tokens that get an "N ahead" (token_near) or "you are next"
+# (token_next) notice when the queue moves.
+SMS_NOTIFY_NEXT_COUNT = int(os.environ.get('SMS_NOTIFY_NEXT_COUNT', '3'))
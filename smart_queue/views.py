@@ -1,12 +1,14 @@
 from django.shortcuts import render
 from services.models import Service
-from queue_system.models import Queue
+from services.stats import queue_counts
 
 def home(request):
     # Get statistics for the dashboard
     services = Service.objects.all()
-    total_queues = Queue.objects.count()
-    active_queues = Queue.objects.filter(status__in=['waiting', 'serving']).count()
+    # Cached grouped counts shared with the admin dashboard.
+    counts = queue_counts()['totals']
+    total_queues = counts['total']
+    active_queues = counts['in_queue']
     total_services = services.count()
 
     context = {
@@ -4,6 +4,7 @@ from django.http import JsonResponse
 import speech_recognition as sr
 import pyttsx3
 from queue_system.models import Queue
+from services.utils import queue_eta
 
 @login_required
 def voice_interface(request):
@@ -94,6 +95,8 @@ def process_voice_text(request):
             })
 
     return JsonResponse({'success': False, 'error': 'Invalid request'})
+
+def process_voice_command(text, user):
     """Process voice commands and return appropriate responses"""
     text = text.lower()
 
@@ -120,14 +123,8 @@ def process_voice_text(request):
     elif 'time' in text or 'waiting' in text:
         if active_queues.exists():
             queue = active_queues.first()
-            # Calculate estimated waiting time (simplified)
-            position = Queue.objects.filter(
-                service=queue.service,
-                status='waiting',
-                token_number__lt=queue.token_number
-            ).count()
-            estimated_time = position * queue.service.avg_service_time
-            return f"You are number {position + 1} in queue. Estimated waiting time: {estimated_time} minutes"
+            info = queue_eta(queue)
+            return f"You are number {info['waiting_ahead'] + 1} in queue. Estimated waiting time: {info['eta_minutes']} minutes"
         else:
             return "You don't have any active queues"
 